@@ -0,0 +1,105 @@
+"""
+Distributed under the terms of the GNU General Public License v3.0.
+
+The full license is in the file LICENSE, distributed with this software.
+
+Copyright (C) Jun Zhu. All rights reserved.
+
+Benchmark of writing the particle file of a downstream beamline.
+
+The legacy implementation copies the phasespace into a structured array
+and writes it with numpy.savetxt, which calls printf row by row.
+
+Usage:
+    python benchmark_particle_file_generator.py [n_particles ...]
+"""
+import os.path as osp
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from liso import Phasespace
+from liso.simulation import ParticleFileGenerator
+from liso.simulation.input import MC2_E
+
+
+def random_phasespace(n, seed=42):
+    rng = np.random.RandomState(seed)
+    data = np.empty((n, 7), order='F')
+    data[:, 0] = rng.normal(0, 1e-4, n)
+    data[:, 1] = rng.normal(0, 1e-2, n)
+    data[:, 2] = rng.normal(0, 1e-4, n)
+    data[:, 3] = rng.normal(0, 1e-2, n)
+    data[:, 4] = rng.normal(5., 1e-3, n)
+    data[:, 5] = rng.normal(100., 0.1, n)
+    data[:, 6] = rng.normal(0, 1e-12, n)
+    return Phasespace(data, 1e-9)
+
+
+def to_astra_legacy(ps, filepath):
+    n = len(ps)
+    src = np.zeros((n, 7))
+    for i, col in enumerate(ps.columns):
+        src[:, i] = ps[col]
+
+    data = np.zeros(n, dtype=[('x', 'f8'), ('y', 'f8'), ('z', 'f8'),
+                              ('px', 'f8'), ('py', 'f8'), ('pz', 'f8'),
+                              ('t', 'f8'), ('q', 'f8'),
+                              ('index', 'i8'), ('flag', 'i8')])
+    data['x'][1:] = src[1:, 0]
+    data['y'][1:] = src[1:, 2]
+    data['px'][1:] = src[1:, 1] * MC2_E
+    data['py'][1:] = src[1:, 3] * MC2_E
+    pz_ref = src[:, 5].mean()
+    data['pz'][0] = pz_ref * MC2_E
+    data['pz'][1:] = (src[1:, 5] - pz_ref) * MC2_E
+    z_ref = src[:, 4].mean()
+    data['z'][0] = z_ref
+    data['z'][1:] = src[1:, 4] - z_ref
+    data['t'][1:] = src[1:, 6]
+    data['t'] *= 1.e9
+    data['q'] = -1.e9 * ps.charge / n
+    data['index'] = 1
+    data['flag'] = 5
+
+    with open(filepath, 'w+') as fp:
+        np.savetxt(fp, data,
+                   fmt=" ".join(["%20.12E"] * 8 + ["%3d"] * 2),
+                   delimiter='')
+
+
+def timeit(func, repeat):
+    dts = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        dts.append(time.perf_counter() - t0)
+    return min(dts)
+
+
+def main(sizes):
+    print(f"{'n':>10}  {'legacy (s)':>12}  {'to_astra (s)':>12}  {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        legacy_file = osp.join(tmp_dir, "legacy.ini")
+        new_file = osp.join(tmp_dir, "new.ini")
+        for n in sizes:
+            ps = random_phasespace(n)
+
+            to_astra_legacy(ps, legacy_file)
+            ParticleFileGenerator.from_phasespace(ps).to_astra(new_file)
+            with open(legacy_file, 'rb') as fp1, open(new_file, 'rb') as fp2:
+                assert fp1.read() == fp2.read()
+
+            repeat = 3
+            dt_legacy = timeit(lambda: to_astra_legacy(ps, legacy_file),
+                               repeat)
+            dt_new = timeit(lambda: ParticleFileGenerator.from_phasespace(
+                ps).to_astra(new_file), repeat)
+            print(f"{n:>10d}  {dt_legacy:>12.4f}  {dt_new:>12.4f}  "
+                  f"{dt_legacy / dt_new:>8.1f}")
+
+
+if __name__ == "__main__":
+    main([int(float(v)) for v in sys.argv[1:]] or [10_000, 200_000, 1_000_000])
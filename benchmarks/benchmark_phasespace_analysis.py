@@ -0,0 +1,101 @@
+"""
+Distributed under the terms of the GNU General Public License v3.0.
+
+The full license is in the file LICENSE, distributed with this software.
+
+Copyright (C) Jun Zhu. All rights reserved.
+
+Benchmark of Phasespace.analyze.
+
+The legacy implementation computes each statistic with a separate pass
+over pandas Series and sorts the whole bunch by |t| before selecting
+the slice.
+
+Usage:
+    python benchmark_phasespace_analysis.py [n_particles ...]
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from liso import Phasespace, compute_canonical_emit, compute_twiss
+from liso.proc import compute_current_profile
+
+
+def random_phasespace(n, seed=42):
+    rng = np.random.RandomState(seed)
+    data = np.empty((n, 7), order='F')
+    data[:, 0] = rng.normal(0, 1e-4, n)
+    data[:, 1] = rng.normal(0, 1e-2, n)
+    data[:, 2] = rng.normal(0, 1e-4, n)
+    data[:, 3] = rng.normal(0, 1e-2, n)
+    data[:, 4] = rng.normal(5., 1e-3, n)
+    data[:, 5] = rng.normal(100., 0.1, n)
+    data[:, 6] = rng.normal(0, 1e-12, n)
+    return Phasespace(data, 1e-9)
+
+
+def analyze_legacy(df, charge, slice_percent=0.1):
+    """Analyze the phasespace in the way before the moment engine."""
+    p = np.sqrt(df['pz'] ** 2 + df['px'] ** 2 + df['py'] ** 2)
+    p_ave = p.mean()
+    dp = (p - p_ave) / p_ave
+    dz = df['z'] - df['z'].mean()
+    gamma = np.sqrt(p_ave ** 2 + 1)
+
+    dp.cov(dz) / dz.var(ddof=0)
+    p.std(ddof=0)
+    df['t'].std(ddof=0)
+    df['z'].std(ddof=0)
+    currents, centers = compute_current_profile(df['t'], 'auto', charge)
+
+    compute_canonical_emit(df['x'], df['px'])
+    compute_twiss(df['x'], dz, df['px'], df['pz'], gamma)
+    compute_canonical_emit(df['y'], df['py'])
+    compute_twiss(df['y'], dz, df['py'], df['pz'], gamma)
+    for col in ('x', 'y', 't'):
+        df[col].mean()
+    (df['px'] / df['pz']).mean()
+    (df['py'] / df['pz']).mean()
+
+    sorted_data = df.reindex(df['t'].abs().sort_values(ascending=True).index)
+    ct = centers[np.argmax(currents)]
+    dt = 4 * df['t'].std(ddof=0) * slice_percent
+    slice_data = sorted_data[(sorted_data.t > ct - dt / 2)
+                             & (sorted_data.t < ct + dt / 2)]
+    p_slice = np.sqrt(slice_data['pz'] ** 2
+                      + slice_data['px'] ** 2
+                      + slice_data['py'] ** 2)
+    compute_canonical_emit(slice_data.x, slice_data.px)
+    compute_canonical_emit(slice_data.y, slice_data.py)
+    p_slice.std(ddof=0) / p_slice.mean()
+    slice_data['t'].corr(p_slice)
+
+
+def timeit(func, repeat):
+    dts = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        dts.append(time.perf_counter() - t0)
+    return min(dts)
+
+
+def main(sizes):
+    print(f"{'n':>10}  {'legacy (s)':>12}  {'analyze (s)':>12}  {'speedup':>8}")
+    for n in sizes:
+        ps = random_phasespace(n)
+        df = ps.to_pandas().copy()
+        repeat = 5 if n <= 1_000_000 else 1
+
+        dt_legacy = timeit(lambda: analyze_legacy(df, ps.charge), repeat)
+        dt_new = timeit(ps.analyze, repeat)
+        print(f"{n:>10d}  {dt_legacy:>12.4f}  {dt_new:>12.4f}  "
+              f"{dt_legacy / dt_new:>8.1f}")
+
+
+if __name__ == "__main__":
+    main([int(float(v)) for v in sys.argv[1:]]
+         or [100_000, 1_000_000, 10_000_000])
@@ -0,0 +1,132 @@
+"""
+Distributed under the terms of the GNU General Public License v3.0.
+
+The full license is in the file LICENSE, distributed with this software.
+
+Copyright (C) Jun Zhu. All rights reserved.
+
+Benchmark of parse_astra_phasespace.
+
+The legacy implementation reads the file with pandas.read_csv and
+modifies the DataFrame column by column.
+
+The reader used by the parser is also compared with the fixed-format
+numeric readers of numpy.
+
+Usage:
+    python benchmark_phasespace_parser.py [n_particles ...]
+"""
+import os.path as osp
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from scipy import constants
+
+from liso import Phasespace, parse_astra_phasespace
+from liso.proc.phasespace_parser import _read_columns
+
+V_LIGHT = constants.c
+MC2_E = constants.m_e * constants.c**2 / constants.e
+
+
+def write_astra_file(filepath, n, seed=42):
+    rng = np.random.RandomState(seed)
+    data = np.empty((n, 10))
+    data[:, 0] = rng.normal(0, 1e-4, n)
+    data[:, 1] = rng.normal(0, 1e-4, n)
+    data[:, 2] = rng.normal(0, 1e-3, n)
+    data[:, 3] = rng.normal(0, 1e3, n)
+    data[:, 4] = rng.normal(0, 1e3, n)
+    data[:, 5] = rng.normal(0, 1e4, n)
+    data[:, 6] = 0.
+    data[:, 7] = -1e-3 / n
+    data[:, 8] = 1
+    data[:, 9] = 5
+    data[0, 2] = 5.
+    data[0, 5] = 5e7
+    np.savetxt(filepath, data,
+               fmt=' '.join(['%18.12E'] * 8 + ['%3d'] * 2))
+
+
+def parse_legacy(particle_file):
+    col_names = ['x', 'y', 'z', 'px', 'py', 'pz',
+                 't', 'charge', 'index', 'flag']
+    data = pd.read_csv(particle_file, delim_whitespace=True, names=col_names)
+
+    pz_ref = data['pz'].iloc[0]
+    data.loc[0, 'pz'] = 0.0
+    data['pz'] += pz_ref
+    data['px'] /= MC2_E
+    data['py'] /= MC2_E
+    data['pz'] /= MC2_E
+    z_ref = data['z'].iloc[0]
+    data.loc[0, 'z'] = 0.0
+    data['z'] += z_ref
+
+    data = data[data['flag'].isin((3, 5))]
+    p = np.sqrt(data['px'] ** 2 + data['py'] ** 2 + data['pz'] ** 2)
+    t_ref = data['t'].iloc[0] * 1.e-9
+    data['t'] = t_ref - (data['z'] - z_ref) \
+        / (V_LIGHT * data['pz'] / np.sqrt(p ** 2 + 1))
+    charge = -1e-9 * data['charge'].sum()
+    data = data.drop(['charge', 'index', 'flag'], axis=1)
+    return Phasespace(data, charge)
+
+
+def read_fromfile(particle_file, n_cols):
+    return np.fromfile(particle_file, sep=' ').reshape(-1, n_cols)
+
+
+def read_loadtxt(particle_file, n_cols):
+    return np.loadtxt(particle_file, ndmin=2)
+
+
+def timeit(func, repeat):
+    dts = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        dts.append(time.perf_counter() - t0)
+    return min(dts)
+
+
+def main(sizes):
+    print(f"{'n':>10}  {'legacy (s)':>12}  {'parser (s)':>12}  {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n in sizes:
+            filepath = osp.join(tmp_dir, f"astra{n}.001")
+            write_astra_file(filepath, n)
+
+            ps = parse_astra_phasespace(filepath)
+            ps_legacy = parse_legacy(filepath)
+            for col in Phasespace.columns:
+                np.testing.assert_array_equal(ps[col].values,
+                                              ps_legacy[col].values)
+
+            repeat = 3
+            dt_legacy = timeit(lambda: parse_legacy(filepath), repeat)
+            dt_new = timeit(lambda: parse_astra_phasespace(filepath), repeat)
+            print(f"{n:>10d}  {dt_legacy:>12.4f}  {dt_new:>12.4f}  "
+                  f"{dt_legacy / dt_new:>8.1f}")
+
+    print()
+    print(f"{'n':>10}  {'read_csv (s)':>12}  {'fromfile (s)':>12}  "
+          f"{'loadtxt (s)':>12}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n in sizes:
+            filepath = osp.join(tmp_dir, f"astra{n}.001")
+            write_astra_file(filepath, n)
+
+            dts = []
+            for reader in (_read_columns, read_fromfile, read_loadtxt):
+                np.testing.assert_allclose(_read_columns(filepath, 10),
+                                           reader(filepath, 10), rtol=1e-15)
+                dts.append(timeit(lambda: reader(filepath, 10), 3))
+            print(f"{n:>10d}  " + "  ".join(f"{dt:>12.4f}" for dt in dts))
+
+
+if __name__ == "__main__":
+    main([int(float(v)) for v in sys.argv[1:]] or [10_000, 200_000, 1_000_000])
@@ -203,6 +203,11 @@ class ImageDoocsChannel(DoocsChannel):
         return schema
 
 
+class ArrayDoocsChannel(ImageDoocsChannel):
+    # e.g. a spectrum (1D) or a stack of images (3D)
+    shape: Tuple[int, ...]
+
+
 _DoocsChannelFactory = namedtuple(
     "DoocsChannelFactory",
     ["BOOL",
@@ -210,7 +215,7 @@ _DoocsChannelFactory = namedtuple(
      "INT32", "INT", "UINT32", "UINT",
      "INT16", "UINT16",
      "FLOAT64", "DOUBLE", "FLOAT32", "FLOAT",
-     "IMAGE"]
+     "IMAGE", "ARRAY"]
 )
 
 doocs_channels = _DoocsChannelFactory(
@@ -230,4 +235,5 @@ doocs_channels = _DoocsChannelFactory(
     FLOAT32=Float32DoocsChannel,
     FLOAT=Float32DoocsChannel,
     IMAGE=ImageDoocsChannel,
+    ARRAY=ArrayDoocsChannel,
 )
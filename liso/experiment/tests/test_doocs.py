@@ -13,6 +13,7 @@ from liso.experiment.doocs import (
     Float32DoocsChannel,
     Float64DoocsChannel,
     ImageDoocsChannel,
+    ArrayDoocsChannel,
 )
 
 
@@ -219,3 +220,16 @@ class TestDoocs(unittest.TestCase):
         with self.subTest("Test value schema"):
             self.assertDictEqual({'type': 'NDArray', 'shape': (2, 2), 'dtype': '<i8'},
                                  ch.value_schema())
+
+    def testArrayChannel(self):
+        self.assertEqual(doocs_channels.ARRAY, ArrayDoocsChannel)
+
+        for shape in [(4,), (2, 3), (2, 3, 4)]:
+            ch = ArrayDoocsChannel(address="A/B/C/D", shape=shape, dtype="<f4")
+            self.assertTupleEqual(shape, ch.shape)
+            np.testing.assert_array_equal(np.zeros(shape, dtype=np.float32), ch.value)
+            self.assertDictEqual({'type': 'NDArray', 'shape': shape, 'dtype': '<f4'},
+                                 ch.value_schema())
+
+        with self.assertRaisesRegex(ValidationError, "shape"):
+            ch.value = np.ones((2, 3), dtype=np.float32)
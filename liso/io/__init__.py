@@ -1,9 +1,11 @@
+from .exporter import export_parquet
 from .reader import open_run, open_sim
 from .writer import ExpWriter, SimWriter
 from .tempdir import TempSimulationDirectory
 
 
 __all__ = [
+    'export_parquet',
     'open_run',
     'open_sim',
 ]
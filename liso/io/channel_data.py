@@ -5,9 +5,322 @@ The full license is in the file LICENSE, distributed with this software.
 
 Copyright (C) Jun Zhu. All rights reserved.
 """
+from concurrent.futures import ProcessPoolExecutor
+import os
+import os.path as osp
+import tempfile
+import weakref
+
 import numpy as np
 
-from .file_access import _FileAccessBase
+from .file_access import _FileAccessBase, _file_access_registry
+
+
+# {file path: _FileAccessBase} opened in a worker process of a _FilePool
+_worker_files = dict()
+
+
+def _init_worker():
+    # do not share the file handles with the parent of a forked process
+    for fa in list(_file_access_registry.values()):
+        fa.close()
+
+
+def _worker_file(file_access, filepath):
+    """Return a file opened in the worker process.
+
+    The file is kept open for the following tasks.
+    """
+    fa = _worker_files.get(filepath)
+    if fa is None:
+        # reuse the metadata inherited from the parent process
+        meta = getattr(_file_access_registry.get(filepath), '_meta', None)
+        fa = _worker_files[filepath] = file_access(filepath, meta)
+    return fa
+
+
+def _read_meta(file_access, filepath):
+    """Return the metadata of a file or the error message.
+
+    :param type file_access: _FileAccessBase subclass.
+    :param str filepath: path of the file.
+    """
+    try:
+        return file_access(filepath).meta
+    except Exception as e:
+        return str(e)
+
+
+def _scan(file_access, filepath):
+    try:
+        return _worker_file(file_access, filepath).meta
+    except Exception as e:
+        return str(e)
+
+
+def _apply(func, file_access, filepath, *args):
+    return func(_worker_file(file_access, filepath), *args)
+
+
+class _FilePool:
+    """Process pool for scanning and reading the files of a collection.
+
+    h5py serializes all the HDF5 calls with a global lock, so threads do
+    not help. The pool is started on first use and reused for the
+    lifetime of the collection. A worker process keeps the files it has
+    opened, so that a task only sends the path of its file.
+    """
+    def __init__(self, file_access, workers=1):
+        """Initialization.
+
+        :param type file_access: _FileAccessBase subclass of the files.
+        :param int workers: number of worker processes. The files are
+            processed in the current process if it is 1.
+        """
+        self._file_access = file_access
+        self._workers = workers
+        self._executor = None
+        self._finalizer = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self._workers, initializer=_init_worker)
+            # wait=False can stop the management thread before the
+            # workers are told to exit in Python 3.8
+            self._finalizer = weakref.finalize(self, self._executor.shutdown)
+        return self._executor
+
+    def scan(self, paths):
+        """Return the metadata of files.
+
+        :param list paths: file paths.
+
+        :return list: metadata (see _FileAccessBase.meta) of each file or
+            the error message if the file cannot be opened.
+        """
+        if self._workers == 1 or len(paths) < 2:
+            return [_read_meta(self._file_access, p) for p in paths]
+
+        paths = [osp.abspath(p) for p in paths]
+        return list(self._get_executor().map(
+            _scan, [self._file_access] * len(paths), paths))
+
+    def map(self, func, files, *iterables):
+        """Apply a function to each file and return a list of the results.
+
+        :param callable func: a picklable function whose first argument
+            is a _FileAccessBase object.
+        :param list files: a list of _FileAccessBase objects.
+        """
+        if self._workers == 1 or len(files) < 2:
+            return list(map(func, files, *iterables))
+
+        return list(self._get_executor().map(
+            _apply,
+            [func] * len(files),
+            [self._file_access] * len(files),
+            [fa._filepath for fa in files],
+            *iterables))
+
+    def shutdown(self):
+        """Stop the worker processes."""
+        if self._finalizer is not None:
+            self._finalizer()
+            self._finalizer = None
+            self._executor = None
+
+
+def _savez_atomic(filepath, **arrays):
+    """Save arrays into an .npz file which is replaced atomically."""
+    fd, tmp = tempfile.mkstemp(dir=osp.dirname(osp.abspath(filepath)))
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            np.savez(fp, **arrays)
+        os.replace(tmp, filepath)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def _stat_files(files):
+    """Return the paths, sizes and modification times of files.
+
+    :param list files: a list of _FileAccessBase objects.
+    """
+    stats = [os.stat(fa._filepath) for fa in files]
+    return (np.array([fa._filepath for fa in files]),
+            np.array([st.st_size for st in stats], dtype=np.int64),
+            np.array([st.st_mtime_ns for st in stats], dtype=np.int64))
+
+
+def _read_rows(fa, paths, rows, mmap=False):
+    """Read the given rows of datasets in a file.
+
+    :param _FileAccessBase fa: file access.
+    :param list paths: paths of the datasets.
+    :param numpy.ndarray rows: row indices.
+    :param bool mmap: True for reading the datasets via memory-mapping
+        if the layout allows.
+
+    :return list: arrays read from the datasets.
+    """
+    start = rows.min()
+    stop = rows.max() + 1
+    ret = []
+    for path in paths:
+        ds = fa.dataset(path, mmap=mmap)
+        if isinstance(ds, np.ndarray):
+            ret.append(ds[rows])
+        elif stop - start <= 2 * rows.size:
+            ret.append(ds[start:stop][rows - start])
+        else:
+            # h5py requires increasing indices
+            unique_rows, inverse = np.unique(rows, return_inverse=True)
+            ret.append(ds[unique_rows][inverse])
+    return ret
+
+
+class _IdIndex:
+    """Sorted index which maps IDs to the locations in a list of files."""
+
+    def __init__(self, ids, file_indices, rows, n_files):
+        """Initialization.
+
+        :param numpy.ndarray ids: sorted IDs.
+        :param numpy.ndarray file_indices: indices of the files which
+            contain the sorted IDs.
+        :param numpy.ndarray rows: row indices of the sorted IDs in the
+            files.
+        :param int n_files: number of files.
+        """
+        self._ids = ids
+        self._file_indices = file_indices
+        self._rows = rows
+        self._n_files = n_files
+
+    @classmethod
+    def from_files(cls, files):
+        """Construct from a list of _FileAccessBase objects."""
+        if not files:
+            empty = np.array([], dtype=np.int64)
+            return cls(empty, empty, empty, 0)
+
+        ids = np.concatenate([fa._ids for fa in files])
+        file_indices = np.repeat(np.arange(len(files)),
+                                 [len(fa._ids) for fa in files])
+        rows = np.concatenate([np.arange(len(fa._ids)) for fa in files])
+        order = np.argsort(ids, kind='stable')
+        return cls(ids[order], file_indices[order], rows[order], len(files))
+
+    @classmethod
+    def load(cls, filepath, files):
+        """Load the index from a sidecar file.
+
+        :param str filepath: path of the sidecar file.
+        :param list files: a list of _FileAccessBase objects.
+
+        :return _IdIndex: None if the sidecar file does not exist or it
+            does not match the files, e.g. a file has been modified.
+        """
+        try:
+            with np.load(filepath) as data:
+                stats = (data['paths'], data['sizes'], data['mtimes'])
+                if any(len(x) != len(files) or np.any(x != y) for x, y
+                       in zip(stats, _stat_files(files))):
+                    return None
+                return cls(data['ids'], data['file_indices'], data['rows'],
+                           len(files))
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def save(self, filepath, files):
+        """Save the index to a sidecar file.
+
+        :param str filepath: path of the sidecar file.
+        :param list files: a list of _FileAccessBase objects which were
+            used to build the index.
+        """
+        paths, sizes, mtimes = _stat_files(files)
+        _savez_atomic(filepath, ids=self._ids, file_indices=self._file_indices,
+                      rows=self._rows, paths=paths, sizes=sizes,
+                      mtimes=mtimes)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def locate(self, ids):
+        """Return the locations of the given IDs.
+
+        :param array-like ids: IDs.
+
+        :return numpy.ndarray file_indices: indices of the files.
+        :return numpy.ndarray rows: row indices in the files.
+
+        :raise KeyError: if any of the IDs is not found.
+        """
+        ids = np.asarray(ids).astype(self._ids.dtype, copy=False)
+        if len(self._ids) == 0:
+            if ids.size > 0:
+                raise KeyError(ids.flat[0])
+            return self._file_indices[:0], self._rows[:0]
+
+        pos = np.searchsorted(self._ids, ids)
+        pos[pos == len(self._ids)] = 0
+        missing = self._ids[pos] != ids
+        if missing.any():
+            raise KeyError(ids[missing][0])
+        return self._file_indices[pos], self._rows[pos]
+
+    def find(self, id_):
+        """Return the location of the given ID.
+
+        :param int id_: ID.
+
+        :return int file_index: index of the file.
+        :return int row: row index in the file.
+
+        :raise KeyError: if the ID is not found.
+        """
+        try:
+            # avoid the cast to float when comparing uint64 with int64
+            key = self._ids.dtype.type(id_)
+        except (OverflowError, TypeError, ValueError):
+            raise KeyError(id_)
+        pos = self._ids.searchsorted(key)
+        if pos == len(self._ids) or self._ids[pos] != key:
+            raise KeyError(id_)
+        return self._file_indices[pos], self._rows[pos]
+
+    def sort_order(self):
+        """Return the positions of the sorted IDs in the concatenated IDs.
+
+        The IDs of the files are concatenated in the order of the files.
+        """
+        counts = np.bincount(self._file_indices, minlength=self._n_files)
+        offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        return offsets[self._file_indices] + self._rows
+
+
+def _normalize_columns(columns, avail_columns):
+    """Return a list of valid phasespace columns in upper case.
+
+    :param None/str/array-like columns: columns for the phasespace data.
+        If None, all the available columns are taken.
+    :param list avail_columns: available columns.
+    """
+    if columns is None:
+        return list(avail_columns)
+
+    if isinstance(columns, str):
+        columns = [columns.upper()]
+    else:
+        columns = [col.upper() for col in columns]
+
+    for col in columns:
+        if col not in avail_columns:
+            raise ValueError(f"{col} is not a valid phasespace column!")
+    return columns
 
 
 class _AbstractPulseTrainData:
@@ -15,6 +328,13 @@ class _AbstractPulseTrainData:
         self._ids = []
         self._files = []
 
+        self._index = None
+
+    def _get_index(self):
+        if self._index is None:
+            self._index = _IdIndex.from_files(self._files)
+        return self._index
+
     def __getitem__(self, item):
         raise NotImplementedError
 
@@ -37,11 +357,8 @@ class _AbstractPulseTrainData:
         return self.__getitem__(self._ids[index])
 
     def _find_data(self, id_) -> (_FileAccessBase, int):
-        for fa in self._files:
-            idx = (fa._ids == id_).nonzero()[0]
-            if idx.size > 0:
-                return fa, idx[0]
-        raise KeyError
+        file_index, row = self._get_index().find(id_)
+        return self._files[file_index], row
 
 
 class ChannelData(_AbstractPulseTrainData):
@@ -49,7 +366,8 @@ class ChannelData(_AbstractPulseTrainData):
 
     This class should not be created directly.
     """
-    def __init__(self, address, *, files, category, ids, columns):
+    def __init__(self, address, *, files, category, ids, columns,
+                 index=None, pool=None, mmap=False):
         """Initialization.
 
         :param str address: the address of the channel. For experimental
@@ -60,6 +378,13 @@ class ChannelData(_AbstractPulseTrainData):
         :param list ids: simulation/pulse IDs of the data.
         :param None/str/array-like columns: columns for the phasespace data.
             If None, all the columns are taken.
+        :param _IdIndex index: ID index of the files. If None, it will be
+            built on first use.
+        :param _FilePool pool: process pool of the data collection for
+            reading the files in numpy(). If None, the files are read in
+            the current process.
+        :param bool mmap: True for reading contiguous datasets via
+            memory-mapping. See _FileAccessBase.dataset().
         """
         super().__init__()
 
@@ -68,20 +393,8 @@ class ChannelData(_AbstractPulseTrainData):
         self._category = category
 
         if category == 'PHASESPACE':
-            avail_columns = list(files[0].file['PHASESPACE'].keys())
-            if columns is None:
-                columns = avail_columns
-            else:
-                if isinstance(columns, str):
-                    columns = [columns.upper()]
-                else:
-                    columns = [col.upper() for col in columns]
-
-                for col in columns:
-                    if col not in avail_columns:
-                        raise ValueError(
-                            f"{col} is not a valid phasespace column!")
-
+            columns = _normalize_columns(
+                columns, list(files[0].file['PHASESPACE'].keys()))
             self._columns = columns
 
             # for consistency, here we only take the first phasespace column
@@ -99,6 +412,11 @@ class ChannelData(_AbstractPulseTrainData):
 
         self._ids = ids
 
+        self._index = index
+
+        self._pool = _FilePool(type(files[0])) if pool is None else pool
+        self._mmap = mmap
+
     def __getitem__(self, id_):
         """Override."""
         fa, idx = self._find_data(id_)
@@ -107,16 +425,62 @@ class ChannelData(_AbstractPulseTrainData):
             address = self._address
             out = np.empty(shape=self._entry_shape, dtype=self._dtype)
             for i, col in enumerate(self._columns):
-                out[i] = fa.file[f"{category}/{col}/{address}"][idx]
+                out[i] = fa.dataset(f"{category}/{col}/{address}",
+                                    mmap=self._mmap)[idx]
             return out
 
-        return fa.file[self._full_path][idx]
+        return fa.dataset(self._full_path, mmap=self._mmap)[idx]
+
+    def numpy(self, ids=None, columns=None):
+        """Return data as a numpy array.
+
+        The data in each file is read in one contiguous slice (per
+        phasespace column) and then placed into the output array. The
+        files are read in parallel if the data collection was opened with
+        more than one worker.
 
-    def numpy(self):
-        """Return data as a numpy array."""
-        # TODO: improve the performance
-        out = np.empty(shape=(len(self._ids), *self._entry_shape),
-                       dtype=self._dtype)
-        for i, item in enumerate(self):
-            out[i] = item
+        :param None/array-like ids: IDs of the data. If None, all the
+            IDs are taken.
+        :param None/str/array-like columns: a subset of the columns for the
+            phasespace data. If None, all the columns of this channel are
+            taken.
+
+        :raise KeyError: if any of the IDs is not found.
+        """
+        ids = self._ids if ids is None else np.asarray(ids)
+        if self._category == 'PHASESPACE':
+            columns = _normalize_columns(columns, self._columns)
+            entry_shape = (len(columns),) + self._entry_shape[1:]
+            paths = [f"{self._category}/{col}/{self._address}"
+                     for col in columns]
+        elif columns is not None:
+            raise ValueError(
+                f"{self._category} data do not have columns!")
+        else:
+            entry_shape = self._entry_shape
+            paths = [self._full_path]
+
+        out = np.empty(shape=(len(ids), *entry_shape), dtype=self._dtype)
+        if len(ids) == 0:
+            return out
+
+        file_indices, rows = self._get_index().locate(ids)
+        files, selections = [], []
+        for i, fa in enumerate(self._files):
+            sel = np.nonzero(file_indices == i)[0]
+            if sel.size > 0:
+                files.append(fa)
+                selections.append(sel)
+
+        results = self._pool.map(_read_rows,
+                                 files,
+                                 [paths] * len(files),
+                                 [rows[sel] for sel in selections],
+                                 [self._mmap] * len(files))
+        for sel, arrays in zip(selections, results):
+            for j, data in enumerate(arrays):
+                if self._category == 'PHASESPACE':
+                    out[sel, j] = data
+                else:
+                    out[sel] = data
         return out
@@ -0,0 +1,162 @@
+"""
+Distributed under the terms of the GNU General Public License v3.0.
+
+The full license is in the file LICENSE, distributed with this software.
+
+Copyright (C) Jun Zhu. All rights reserved.
+"""
+import os.path as osp
+import pathlib
+
+import numpy as np
+
+from .reader import open_sim, SimDataCollection
+from ..exceptions import LisoRuntimeError
+from ..proc import Phasespace
+from ..proc.beam_parameters import BeamParameters
+
+
+# columns of the phasespace summary table
+_BEAM_PARAMETERS = [k.lstrip('_') for k in vars(BeamParameters())]
+
+
+def _beam_parameters(ps, options):
+    """Return the beam parameters of a phasespace as a dictionary.
+
+    None is returned if the phasespace cannot be analyzed, e.g. too few
+    particles.
+    """
+    try:
+        with np.errstate(all='ignore'):
+            params = ps.analyze(**options)
+    except LisoRuntimeError:
+        return None
+    return {k.lstrip('_'): v for k, v in vars(params).items()}
+
+
+def export_parquet(path, output_dir, *, channels=None, particles=False,
+                   batch_size=100, analysis_options=None,
+                   compression='snappy'):
+    """Export simulation data to partitioned Parquet tables.
+
+    The data files are converted one by one and a file is read in
+    blocks of batch_size simulations, so that the memory usage does not
+    depend on the size of the run. Each table is a folder containing one
+    Parquet file per data file, which can be read as a dataset by Spark,
+    pyarrow, etc.:
+
+        output_dir/controls/: 'id' and one column per control channel.
+        output_dir/phasespace/: 'id', 'channel' and one column per beam
+            parameter calculated by Phasespace.analyze().
+        output_dir/particles/: 'id', 'channel' and one column per
+            phasespace column. Only written if particles is True.
+
+    :param str path: file or directory path of the simulation data.
+    :param str output_dir: output directory. It will be created if it
+        does not exist.
+    :param None/array-like channels: phasespace channels to be exported.
+        If None, all the phasespace channels are exported.
+    :param bool particles: True for exporting the particle data as well.
+    :param int batch_size: number of simulations in a block.
+    :param dict analysis_options: keyword arguments of
+        Phasespace.analyze().
+    :param str compression: compression codec of the Parquet files.
+
+    :raise ImportError: if pyarrow is not installed.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Exporting to Parquet requires the package "
+                          "pyarrow!")
+
+    data = open_sim(path)
+    if channels is None:
+        channels = sorted(data.phasespace_channels)
+    else:
+        channels = list(channels)
+        for ch in channels:
+            if ch not in data.phasespace_channels:
+                raise KeyError(f"{ch} is not a phasespace channel!")
+
+    if analysis_options is None:
+        analysis_options = dict()
+
+    output_dir = pathlib.Path(output_dir)
+    folders = ['controls', 'phasespace'] + (['particles'] if particles else [])
+    for folder in folders:
+        output_dir.joinpath(folder).mkdir(parents=True, exist_ok=True)
+
+    for fa in data._files:
+        # process one file at a time
+        sub = SimDataCollection([fa])
+        fname = osp.splitext(osp.basename(fa._filepath))[0] + '.parquet'
+
+        controls = sub.get_controls()
+        controls.index.name = 'id'
+        pq.write_table(
+            pa.Table.from_pandas(controls.reset_index(), preserve_index=False),
+            output_dir.joinpath('controls', fname),
+            compression=compression)
+
+        chs = [ch for ch in channels if ch in fa.phasespace_channels]
+        if not chs:
+            continue
+
+        # columns of the batch are in the order of the file
+        cols = list(fa.file['PHASESPACE'].keys())
+        order = [cols.index(col.upper()) for col in Phasespace.columns]
+
+        summary_writer = None
+        particle_writer = None
+        try:
+            for ids, batch in sub.iter_batches(batch_size, channels=chs):
+                summary = []
+                for ch in chs:
+                    # (events, columns, particles)
+                    arr = batch[ch]
+                    for id_, item in zip(ids, arr[:, order]):
+                        # the phasespace is filled with zeros in case of
+                        # particle loss
+                        params = _beam_parameters(
+                            Phasespace(item.T, 0.), analysis_options) \
+                            if item.any() else None
+                        summary.append((id_, ch, params))
+
+                    if particles:
+                        n_events, _, n_particles = arr.shape
+                        columns = {
+                            'id': np.repeat(ids, n_particles),
+                            'channel': np.full(n_events * n_particles, ch,
+                                               dtype=object),
+                        }
+                        for i, col in zip(order, Phasespace.columns):
+                            columns[col] = arr[:, i].ravel()
+                        table = pa.Table.from_pydict(columns)
+                        if particle_writer is None:
+                            particle_writer = pq.ParquetWriter(
+                                output_dir.joinpath('particles', fname),
+                                table.schema, compression=compression)
+                        particle_writer.write_table(table)
+
+                columns = {
+                    'id': np.array([id_ for id_, _, _ in summary],
+                                   dtype=ids.dtype),
+                    'channel': [ch for _, ch, _ in summary],
+                }
+                for k in _BEAM_PARAMETERS:
+                    columns[k] = np.array(
+                        [np.nan if p is None else p[k]
+                         for _, _, p in summary], dtype=np.float64)
+                table = pa.Table.from_pydict(columns)
+                if summary_writer is None:
+                    summary_writer = pq.ParquetWriter(
+                        output_dir.joinpath('phasespace', fname),
+                        table.schema, compression=compression)
+                summary_writer.write_table(table)
+        finally:
+            if summary_writer is not None:
+                summary_writer.close()
+            if particle_writer is not None:
+                particle_writer.close()
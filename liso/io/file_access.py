@@ -13,6 +13,7 @@ from collections import OrderedDict
 from weakref import WeakValueDictionary
 
 import h5py
+import numpy as np
 
 # Track all FileAccess objects - {path: FileAccess}
 _file_access_registry = WeakValueDictionary()
@@ -77,6 +78,17 @@ def _init_file_open_registry():
 _file_open_registry = _init_file_open_registry()
 
 
+def _register_filter_plugins():
+    """Register the filters in hdf5plugin if it is installed.
+
+    It allows reading files compressed by plugin filters, e.g. blosc.
+    """
+    try:
+        import hdf5plugin  # noqa
+    except ImportError:
+        pass
+
+
 class _FileAccessBase:
     """Base class for accessing an HDF5 file.
 
@@ -85,7 +97,7 @@ class _FileAccessBase:
     """
     _file = None
 
-    def __new__(cls, filepath):
+    def __new__(cls, filepath, meta=None):
         filepath = osp.abspath(filepath)
         instance = _file_access_registry.get(filepath, None)
         if instance is None:
@@ -94,20 +106,77 @@ class _FileAccessBase:
             _file_access_registry[filepath] = instance
         return instance
 
-    def __init__(self, filepath):
-        self._ids = []
+    def __init__(self, filepath, meta=None):
+        """Initialization.
+
+        :param str filepath: path of the file.
+        :param dict meta: metadata of the file, i.e. {'channels': tuple
+            of channel sets, 'ids': IDs}, e.g. from a manifest. If None,
+            it is read from the file.
+        """
+        if meta is None:
+            meta = {'channels': self._read_data_channels(),
+                    'ids': self._read_ids()}
+        self._meta = meta
+        self._ids = meta['ids']
+
+        # {dataset path: numpy.memmap}
+        self._mmaps = dict()
+
+    @property
+    def meta(self):
+        """Metadata of the file, which can be used to re-create it."""
+        return self._meta
 
     @property
     def file(self):
         _file_open_registry.touch(self._filepath)
         if self._file is None:
+            _register_filter_plugins()
             self._file = h5py.File(self._filepath, 'r')
         return self._file
 
+    def dataset(self, path, *, mmap=False):
+        """Return a dataset in the file.
+
+        :param str path: path of the dataset.
+        :param bool mmap: True for returning a read-only numpy.memmap of
+            the dataset if its data are stored contiguously and without
+            filters in the file, e.g. written by SimWriter or ExpWriter
+            with contiguous=True or after 'h5repack -l CONTI'. Slicing
+            it does not copy the data. The h5py.Dataset is returned if
+            the layout does not allow it, e.g. chunked or compressed
+            datasets.
+        """
+        if mmap:
+            try:
+                return self._mmaps[path]
+            except KeyError:
+                pass
+
+        ds = self.file[path]
+        if not mmap or ds.chunks is not None or ds.external \
+                or ds.size == 0 or ds.dtype.hasobject:
+            return ds
+
+        offset = ds.id.get_offset()
+        if offset is None:
+            # storage has not been allocated
+            return ds
+
+        data = np.memmap(self._filepath, dtype=ds.dtype, mode='r',
+                         offset=offset, shape=ds.shape)
+        self._mmaps[path] = data
+        return data
+
     @abstractmethod
     def _read_data_channels(self):
         raise NotImplementedError
 
+    @abstractmethod
+    def _read_ids(self):
+        raise NotImplementedError
+
     def close(self):
         """Close the HDF5 file this refers to.
 
@@ -117,22 +186,36 @@ class _FileAccessBase:
         """
         if self._file:
             self._file = None
+        self._mmaps = dict()
         _file_open_registry.remove(self._filepath)
 
+    def __getnewargs__(self):
+        return self._filepath,
+
+    def __getstate__(self):
+        # an opened file cannot be pickled
+        state = self.__dict__.copy()
+        state.pop('_file', None)
+        state.pop('_mmaps', None)
+        return state
+
+    def __setstate__(self, state):
+        # do not share the file handle with the parent of a forked process
+        self.close()
+        self.__dict__.update(state)
+
     def __repr__(self):
         return "{}({})".format(type(self).__name__, repr(self._filepath))
 
 
 class SimFileAccess(_FileAccessBase):
     """Access an HDF5 file which stores simulated data."""
-    def __init__(self, filepath):
-        super().__init__(filepath)
+    def __init__(self, filepath, meta=None):
+        super().__init__(filepath, meta)
 
         self.control_channels, self.phasespace_channels = \
-            self._read_data_channels()
-
-        self.sim_ids = self.file["INDEX/simId"][()]
-        self._ids = self.sim_ids
+            self._meta['channels']
+        self.sim_ids = self._ids
 
     def _read_data_channels(self):
         """Override."""
@@ -152,24 +235,19 @@ class SimFileAccess(_FileAccessBase):
 
         return frozenset(control_channels), frozenset(phasespace_channels)
 
+    def _read_ids(self):
+        """Override."""
+        return self.file["INDEX/simId"][()]
+
 
 class ExpFileAccess(_FileAccessBase):
     """Access an HDF5 file which stores experimental data."""
-    def __init__(self, filepath):
-        super().__init__(filepath)
+    def __init__(self, filepath, meta=None):
+        super().__init__(filepath, meta)
 
         self.control_channels, self.diagnostic_channels = \
-            self._read_data_channels()
-
-        try:
-            self.pulse_ids = self.file["INDEX/pulseId"][()]
-        except KeyError:
-            try:
-                self.pulse_ids = self.file["INDEX/timestamp"][()]
-            except KeyError:
-                raise KeyError("Cannot find both 'pulseId' and 'timestamp' "
-                               "in the data!")
-        self._ids = self.pulse_ids
+            self._meta['channels']
+        self.pulse_ids = self._ids
 
     def _read_data_channels(self):
         """Override."""
@@ -188,3 +266,14 @@ class ExpFileAccess(_FileAccessBase):
             diagnostic_channels.add(src)
 
         return frozenset(control_channels), frozenset(diagnostic_channels)
+
+    def _read_ids(self):
+        """Override."""
+        try:
+            return self.file["INDEX/pulseId"][()]
+        except KeyError:
+            try:
+                return self.file["INDEX/timestamp"][()]
+            except KeyError:
+                raise KeyError("Cannot find both 'pulseId' and 'timestamp' "
+                               "in the data!")
@@ -7,30 +7,112 @@ Copyright (C) Jun Zhu. All rights reserved.
 """
 import abc
 from collections import defaultdict
+import json
 import os
 import os.path as osp
 
 import numpy as np
 import pandas as pd
 
-from .channel_data import _AbstractPulseTrainData, ChannelData
+from .channel_data import (
+    _AbstractPulseTrainData, _FilePool, _IdIndex, _normalize_columns,
+    _savez_atomic, _stat_files, ChannelData
+)
 from .file_access import SimFileAccess, ExpFileAccess
 from ..proc import Phasespace
 
 
+def _load_manifest(filepath):
+    """Load the metadata of files from a manifest.
+
+    :param str filepath: path of the manifest.
+
+    :return dict: {file path: (size, modification time, metadata)}. Empty
+        if the manifest does not exist or cannot be read.
+    """
+    try:
+        with np.load(filepath) as data:
+            paths, sizes, mtimes = data['paths'], data['sizes'], data['mtimes']
+            channels, counts, ids = data['channels'], data['counts'], data['ids']
+    except (OSError, KeyError, ValueError):
+        return dict()
+
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+    manifest = dict()
+    for i, path in enumerate(paths):
+        meta = {
+            'channels': tuple(frozenset(chs)
+                              for chs in json.loads(str(channels[i]))),
+            'ids': ids[offsets[i]:offsets[i + 1]]
+        }
+        manifest[str(path)] = (sizes[i], mtimes[i], meta)
+    return manifest
+
+
+def _save_manifest(filepath, files):
+    """Save the metadata of files into a manifest.
+
+    :param str filepath: path of the manifest.
+    :param list files: a list of _FileAccessBase objects.
+    """
+    paths, sizes, mtimes = _stat_files(files)
+    channels = [json.dumps([sorted(chs) for chs in fa.meta['channels']])
+                for fa in files]
+    _savez_atomic(
+        filepath,
+        paths=paths,
+        sizes=sizes,
+        mtimes=mtimes,
+        channels=np.array(channels, dtype=str),
+        counts=np.array([len(fa._ids) for fa in files], dtype=np.int64),
+        ids=np.concatenate([fa._ids for fa in files]) if files
+        else np.array([], dtype=np.uint64))
+
+
+def _read_controls(fa):
+    """Return the control data in a file as a pandas.DataFrame.
+
+    :param _FileAccessBase fa: file access.
+    """
+    if 'METADATA/controlChannels' in fa.file:
+        # backward compatibility
+        control_channel_path = 'METADATA/controlChannels'
+    else:
+        control_channel_path = 'METADATA/controlChannel'
+
+    ids = fa._ids
+    df = pd.DataFrame.from_dict({
+        ch: fa.file[f"CONTROL/{ch}"][:len(ids)]
+        for ch in fa.file[control_channel_path]
+    })
+    df.set_index(ids, inplace=True)
+    return df
+
+
 class _DataCollectionBase(_AbstractPulseTrainData):
     """A collection of simulated or experimental data."""
 
     _FileAccess = None
 
-    def __init__(self, files):
+    def __init__(self, files, *, index_file=None, workers=1, pool=None):
         """Initialization
 
         :param list files: a list of FileAccess instances.
+        :param str index_file: path of the sidecar file which persists
+            the ID index. If None, the index is not persisted.
+        :param int workers: number of processes for reading the files in
+            get_controls() and ChannelData.numpy(). The processes are
+            started on first use and shared by the channels until the
+            collection is closed.
+        :param _FilePool/None pool: process pool which has scanned the
+            files. If None, a new one with 'workers' processes is used.
         """
         super().__init__()
 
         self._files = list(files)
+        self._index_file = index_file
+        self._pool = _FilePool(self._FileAccess, workers) \
+            if pool is None else pool
 
         # channels are not ubiquitous in each file
         self._channel_files = defaultdict(list)
@@ -40,39 +122,83 @@ class _DataCollectionBase(_AbstractPulseTrainData):
         """Print out the information of this data collection."""
         raise NotImplementedError
 
+    def close(self):
+        """Stop the processes reading the files."""
+        self._pool.shutdown()
+
+    def _get_index(self):
+        """Override."""
+        if self._index is None:
+            index = None
+            if self._index_file is not None:
+                index = _IdIndex.load(self._index_file, self._files)
+            if index is None:
+                index = _IdIndex.from_files(self._files)
+                if self._index_file is not None:
+                    index.save(self._index_file, self._files)
+            self._index = index
+        return self._index
+
     @classmethod
-    def from_path(cls, path):
+    def from_path(cls, path, *, index_file=None):
         """Construct a data collection from a single file.
 
         :param str path: file path.
+        :param str index_file: path of the sidecar file which persists
+            the ID index.
         """
         files = [cls._FileAccess(path)]
-        return cls(files)
-
-    @classmethod
-    def _open_file(cls, path):
-        try:
-            fa = cls._FileAccess(path)
-        except Exception as e:
-            return osp.basename(path), str(e)
-        else:
-            return osp.basename(path), fa
+        return cls(files, index_file=index_file)
 
     @classmethod
-    def from_paths(cls, paths):
+    def from_paths(cls, paths, *, index_file=None, manifest_file=None,
+                   workers=1):
         """Construct a data collection from a list of files.
 
         :param list paths: a list of file paths.
+        :param str index_file: path of the sidecar file which persists
+            the ID index.
+        :param str manifest_file: path of the sidecar file which persists
+            the channels and IDs of the files. A file is only opened if
+            it is not found in the manifest or it has been modified.
+        :param int workers: number of processes for scanning and reading
+            the files. The worker processes only send the metadata of
+            the scanned files back and keep the files open for reading.
         """
-        files = []
-        for path in paths:
-            fname, ret = cls._open_file(path)
-            if isinstance(ret, cls._FileAccess):
-                files.append(ret)
+        manifest = dict() if manifest_file is None \
+            else _load_manifest(manifest_file)
+
+        files = [None] * len(paths)
+        to_open = []
+        for i, path in enumerate(paths):
+            entry = manifest.get(osp.abspath(path))
+            if entry is not None:
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    entry = None
+                else:
+                    if (st.st_size, st.st_mtime_ns) != entry[:2]:
+                        entry = None
+
+            if entry is None:
+                to_open.append(i)
             else:
-                print(f"Skipping path {fname}: {ret}")
+                files[i] = cls._FileAccess(path, entry[2])
 
-        return cls(files)
+        pool = _FilePool(cls._FileAccess, workers)
+        for i, meta in zip(to_open, pool.scan([paths[i] for i in to_open])):
+            if isinstance(meta, str):
+                print(f"Skipping path {osp.basename(paths[i])}: {meta}")
+            else:
+                files[i] = cls._FileAccess(paths[i], meta)
+        files = [fa for fa in files if fa is not None]
+
+        if manifest_file is not None \
+                and (to_open or len(manifest) != len(files)):
+            _save_manifest(manifest_file, files)
+
+        return cls(files, index_file=index_file, pool=pool)
 
     def get_controls(self, *, sorted=False):
         """Return control data in a Pandas.DataFrame.
@@ -82,54 +208,135 @@ class _DataCollectionBase(_AbstractPulseTrainData):
             data are not stored with the simulation IDs monotonically
             increasing.
         """
-        data = []
-        for fa in self._files:
-            if 'METADATA/controlChannels' in fa.file:
-                # backward compatibility
-                control_channel_path = 'METADATA/controlChannels'
-            else:
-                control_channel_path = 'METADATA/controlChannel'
-
-            ids = fa._ids
-            df = pd.DataFrame.from_dict({
-                ch: fa.file[f"CONTROL/{ch}"][:len(ids)]
-                for ch in fa.file[control_channel_path]
-            })
-            df.set_index(ids, inplace=True)
-            data.append(df)
+        data = self._pool.map(_read_controls, self._files)
 
         if sorted:
-            return pd.concat(data).sort_index()
+            return pd.concat(data).iloc[self._get_index().sort_order()]
         return pd.concat(data)
 
+    def iter_batches(self, batch_size, *, channels=None, columns=None,
+                     shuffle=False, seed=None):
+        """Iterate over the data in batches.
+
+        Each file is read in contiguous blocks of batch_size events and
+        only the current block is kept in memory. A batch can consist of
+        events from two blocks at the end of a file.
+
+        :param int batch_size: number of events in a batch. The last
+            batch can be smaller.
+        :param None/str/array-like channels: channels to read. If None,
+            all the channels are read.
+        :param None/str/array-like columns: columns for the phasespace
+            data. If None, all the columns are taken.
+        :param bool shuffle: True for reading the blocks in a random order
+            and shuffling the events in each block.
+        :param int/None seed: seed of the random number generator used
+            for shuffling.
+
+        :return generator: (ids, {channel: numpy.ndarray}). The shape of a
+            phasespace array is (events, columns, particles).
+
+        :raise KeyError: if a channel is not found in all the files.
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be a positive integer")
+
+        if channels is None:
+            channels = sorted(self._channel_files)
+        elif isinstance(channels, str):
+            channels = [channels]
+
+        paths = dict()
+        for ch in channels:
+            if len(self._channel_files.get(ch, [])) != len(self._files):
+                raise KeyError(f"Channel {ch} is not found in all the files")
+            category = self._get_channel_category(ch)
+            if category == 'PHASESPACE':
+                paths[ch] = [
+                    f"{category}/{col}/{ch}" for col in _normalize_columns(
+                        columns, list(self._files[0].file[category].keys()))
+                ]
+            else:
+                paths[ch] = f"{category}/{ch}"
+
+        blocks = [(fa, start)
+                  for fa in self._files
+                  for start in range(0, len(fa._ids), batch_size)]
+        rng = np.random.default_rng(seed)
+        if shuffle:
+            blocks = [blocks[i] for i in rng.permutation(len(blocks))]
+
+        ids, data = None, None
+        for fa, start in blocks:
+            stop = min(start + batch_size, len(fa._ids))
+            block_ids = fa._ids[start:stop]
+            block = dict()
+            for ch, path in paths.items():
+                if isinstance(path, list):
+                    block[ch] = np.stack(
+                        [fa.file[p][start:stop] for p in path], axis=1)
+                else:
+                    block[ch] = fa.file[path][start:stop]
+
+            if shuffle:
+                perm = rng.permutation(stop - start)
+                block_ids = block_ids[perm]
+                block = {ch: v[perm] for ch, v in block.items()}
+
+            if ids is None:
+                ids, data = block_ids, block
+            else:
+                ids = np.concatenate((ids, block_ids))
+                data = {ch: np.concatenate((data[ch], block[ch]))
+                        for ch in data}
+
+            while len(ids) >= batch_size:
+                yield ids[:batch_size], {ch: v[:batch_size]
+                                         for ch, v in data.items()}
+                ids = ids[batch_size:]
+                data = {ch: v[batch_size:] for ch, v in data.items()}
+
+        if ids is not None and len(ids) > 0:
+            yield ids, data
+
     @abc.abstractmethod
     def _get_channel_category(self, ch):
         raise NotImplementedError
 
-    def channel(self, address, columns=None):
+    def channel(self, address, columns=None, *, mmap=False):
         """Return an array for a particular data field.
 
         :param str address: address of the channel.
         :param None/str/array-like columns: columns for the phasespace data.
             If None, all the columns are taken.
+        :param bool mmap: True for reading the datasets which are stored
+            contiguously and without filters via memory-mapping. Other
+            datasets are read via h5py.
         """
         files = self._channel_files[address]
         if not files:
             raise KeyError(f"No data was found for channel: {address}")
         category = self._get_channel_category(address)
+        # the index can be shared if the channel exists in all the files
+        index = self._get_index() if len(files) == len(self._files) \
+            else None
         return ChannelData(address,
                            files=files,
                            category=category,
                            ids=self._ids,
-                           columns=columns)
+                           columns=columns,
+                           index=index,
+                           pool=self._pool,
+                           mmap=mmap)
 
 
 class SimDataCollection(_DataCollectionBase):
     """A collection of simulated data."""
     _FileAccess = SimFileAccess
 
-    def __init__(self, files):
-        super().__init__(files)
+    def __init__(self, files, *, index_file=None, workers=1, pool=None):
+        super().__init__(files, index_file=index_file, workers=workers,
+                         pool=pool)
 
         self.control_channels = set()
         self.phasespace_channels = set()
@@ -175,26 +382,38 @@ class SimDataCollection(_DataCollectionBase):
         return 'CONTROL' if ch in self.control_channels else 'PHASESPACE'
 
 
-def open_sim(path):
+def open_sim(path, *, index_file=None, manifest_file=None, workers=1):
     """Open simulation data from a single file or a directory.
 
     :param str path: file or directory path.
+    :param str index_file: path of the sidecar file which persists the
+        sorted simulation ID index. It is rebuilt if any of the data
+        files has changed.
+    :param str manifest_file: path of the sidecar file which persists the
+        channels and IDs of the data files, so that opening the directory
+        again does not need to scan the files which have not changed.
+    :param int workers: number of processes for scanning and reading the
+        data files.
     """
     if osp.isfile(path):
-        return SimDataCollection.from_path(path)
+        return SimDataCollection.from_path(path, index_file=index_file)
 
     paths = [osp.join(path, f) for f in os.listdir(path) if f.endswith('.hdf5')]
     if not paths:
         raise Exception(f"No HDF5 files found in {path}!")
-    return SimDataCollection.from_paths(sorted(paths))
+    return SimDataCollection.from_paths(sorted(paths),
+                                       index_file=index_file,
+                                       manifest_file=manifest_file,
+                                       workers=workers)
 
 
 class ExpDataCollection(_DataCollectionBase):
     """A collection of experimental data."""
     _FileAccess = ExpFileAccess
 
-    def __init__(self, files):
-        super().__init__(files)
+    def __init__(self, files, *, index_file=None, workers=1, pool=None):
+        super().__init__(files, index_file=index_file, workers=workers,
+                         pool=pool)
 
         self.control_channels = set()
         self.diagnostic_channels = set()
@@ -237,15 +456,26 @@ class ExpDataCollection(_DataCollectionBase):
         return 'CONTROL' if ch in self.control_channels else 'DIAGNOSTIC'
 
 
-def open_run(path):
+def open_run(path, *, index_file=None, manifest_file=None, workers=1):
     """Open experimental data from a single file or a directory.
 
     :param str path: file or directory path.
+    :param str index_file: path of the sidecar file which persists the
+        sorted pulse ID index. It is rebuilt if any of the data files
+        has changed.
+    :param str manifest_file: path of the sidecar file which persists the
+        channels and IDs of the data files, so that opening the directory
+        again does not need to scan the files which have not changed.
+    :param int workers: number of processes for scanning and reading the
+        data files.
     """
     if osp.isfile(path):
-        return ExpDataCollection.from_path(path)
+        return ExpDataCollection.from_path(path, index_file=index_file)
 
     paths = [osp.join(path, f) for f in os.listdir(path) if f.endswith('.hdf5')]
     if not paths:
         raise Exception(f"No HDF5 files found in {path}!")
-    return ExpDataCollection.from_paths(sorted(paths))
+    return ExpDataCollection.from_paths(sorted(paths),
+                                       index_file=index_file,
+                                       manifest_file=manifest_file,
+                                       workers=workers)
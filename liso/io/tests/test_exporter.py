@@ -0,0 +1,74 @@
+import unittest
+import pathlib
+import tempfile
+
+import numpy as np
+
+from liso import Phasespace
+from liso.io import SimWriter, export_parquet, open_sim
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+
+@unittest.skipIf(pq is None, "pyarrow is not installed")
+class TestExporter(unittest.TestCase):
+    def testExportParquet(self):
+        n_particles = 100
+        schema = ({"gun/gun_gradient": {"type": "<f4"},
+                   "gun/gun_phase": {"type": "<f4"}},
+                  {"gun/out1": {"macroparticles": n_particles, "type": "phasespace"},
+                   "gun/out2": {"macroparticles": n_particles, "type": "phasespace"}})
+
+        rng = np.random.RandomState(1)
+        sim_ids = rng.permutation(25) + 1
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            sim_dir = pathlib.Path(tmp_dir).joinpath("sim")
+            sim_dir.mkdir()
+            with SimWriter(sim_dir, schema=schema, chunk_size=5,
+                           max_events_per_file=10) as writer:
+                for i, sid in enumerate(sim_ids):
+                    data = rng.randn(n_particles, 7) * 1e-3
+                    data[:, 5] += 100.
+                    ps = Phasespace(data, 1e-12)
+                    # particle loss
+                    out2 = ps if i != 3 else Phasespace(data[:10], 1e-12)
+                    writer.write(sid, {'gun/gun_gradient': i, 'gun/gun_phase': 2 * i},
+                                 {'gun/out1': ps, 'gun/out2': out2})
+
+            out_dir = pathlib.Path(tmp_dir).joinpath("parquet")
+            export_parquet(sim_dir, out_dir, particles=True, batch_size=4)
+            self.assertListEqual(
+                ["SIM-G01-S00000%d.parquet" % i for i in range(3)],
+                sorted(f.name for f in out_dir.joinpath("controls").iterdir()))
+
+            sim = open_sim(sim_dir)
+
+            controls = pq.read_table(out_dir.joinpath("controls")).to_pandas()
+            controls.set_index('id', inplace=True)
+            self.assertEqual(controls.index.dtype, np.uint64)
+            np.testing.assert_array_equal(sim.get_controls().loc[controls.index],
+                                          controls[sim.get_controls().columns])
+
+            summary = pq.read_table(out_dir.joinpath("phasespace")).to_pandas()
+            self.assertEqual(2 * len(sim_ids), len(summary))
+            row = summary[(summary['id'] == sim_ids[5]) & (summary['channel'] == 'gun/out1')]
+            _, item = sim.from_id(sim_ids[5])
+            params = item['gun/out1'].analyze()
+            self.assertAlmostEqual(params.emitx, row['emitx'].iloc[0])
+            self.assertAlmostEqual(params.Sz, row['Sz'].iloc[0])
+            row = summary[(summary['id'] == sim_ids[3]) & (summary['channel'] == 'gun/out2')]
+            self.assertTrue(np.isnan(row['emitx'].iloc[0]))
+
+            table = pq.read_table(out_dir.joinpath("particles"),
+                                  columns=['id', 'channel', 'x', 'pz'])
+            self.assertEqual(2 * len(sim_ids) * n_particles, table.num_rows)
+            particles = table.to_pandas()
+            particles = particles[(particles['id'] == sim_ids[5])
+                                  & (particles['channel'] == 'gun/out1')]
+            np.testing.assert_array_equal(item['gun/out1']['pz'], particles['pz'])
+
+            with self.assertRaises(KeyError):
+                export_parquet(sim_dir, out_dir, channels=['gun/gun_phase'])
@@ -1,8 +1,94 @@
 import unittest
+import pathlib
+import tempfile
 
-from liso.io.file_access import _init_file_open_registry
+import h5py
+import numpy as np
+
+from liso.io import open_sim, SimWriter
+from liso.proc import Phasespace
+from liso.io.file_access import _init_file_open_registry, SimFileAccess
 
 
 class TestFileAccess(unittest.TestCase):
     def testGeneral(self):
         _init_file_open_registry()
+
+    def testMemoryMap(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filepath = pathlib.Path(tmp_dir).joinpath("SIM-G01-S000000.hdf5")
+            n = 10
+            with h5py.File(filepath, 'w') as fp:
+                fp.create_dataset("METADATA/controlChannel", dtype=h5py.string_dtype(),
+                                  data=np.array(["a", "b"], dtype=object))
+                fp.create_dataset("METADATA/phasespaceChannel", dtype=h5py.string_dtype(),
+                                  data=np.array(["out"], dtype=object))
+                fp.create_dataset("INDEX/simId", data=np.arange(n)[::-1] + 1, dtype='u8')
+                # contiguous
+                fp.create_dataset("CONTROL/a", data=np.arange(n, dtype='>f4'))
+                # chunked
+                fp.create_dataset("CONTROL/b", data=np.arange(n, dtype='<f8'), chunks=(5,))
+                for col in ['X', 'Y']:
+                    fp.create_dataset(f"PHASESPACE/{col}/out",
+                                      data=np.arange(3 * n).reshape(n, 3))
+
+            fa = SimFileAccess(filepath)
+            ds = fa.dataset("CONTROL/a", mmap=True)
+            self.assertIsInstance(ds, np.memmap)
+            self.assertIs(ds, fa.dataset("CONTROL/a", mmap=True))
+            self.assertEqual(np.dtype('>f4'), ds.dtype)
+            np.testing.assert_array_equal(np.arange(n), ds)
+            with self.assertRaises(ValueError):
+                ds[0] = 1
+            self.assertIsInstance(fa.dataset("CONTROL/a"), h5py.Dataset)
+            self.assertIsInstance(fa.dataset("CONTROL/b", mmap=True), h5py.Dataset)
+
+            data = open_sim(tmp_dir)
+            for ch in ['a', 'b', 'out']:
+                item = data.channel(ch, mmap=True)
+                np.testing.assert_array_equal(data.channel(ch).numpy(), item.numpy())
+                np.testing.assert_array_equal(data.channel(ch).numpy([3, 1]),
+                                              item.numpy([3, 1]))
+                np.testing.assert_array_equal(data.channel(ch)[4], item[4])
+            # slicing does not copy
+            self.assertIsInstance(fa.dataset('PHASESPACE/X/out', mmap=True)[4], np.memmap)
+
+            del ds, item
+            fa.close()
+
+    def testMemoryMapSimWriter(self):
+        n_particles = 5
+        schema = ({"gun/gun_gradient": {"type": "<f4"}},
+                  {"gun/out": {"macroparticles": n_particles,
+                               "type": "phasespace"}})
+        with self.assertRaises(ValueError):
+            SimWriter("", schema=schema, contiguous=True,
+                      compression={'compression': 'gzip'})
+
+        for contiguous in [False, True]:
+            with self.subTest(contiguous=contiguous):
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    with SimWriter(tmp_dir, schema=schema, chunk_size=4,
+                                   contiguous=contiguous) as writer:
+                        for i in range(6):
+                            ps = Phasespace(np.full((n_particles, 7), i, dtype=float), 1.0)
+                            writer.write(i + 1, {'gun/gun_gradient': i}, {'gun/out': ps})
+
+                    data = open_sim(tmp_dir)
+                    fa = data._files[0]
+                    for path in ["CONTROL/gun/gun_gradient", "PHASESPACE/X/gun/out"]:
+                        ds = fa.dataset(path, mmap=True)
+                        if contiguous:
+                            self.assertIsInstance(ds, np.memmap)
+                        else:
+                            self.assertIsInstance(ds, h5py.Dataset)
+                    item = data.channel('gun/gun_gradient', mmap=True)
+                    np.testing.assert_array_equal(np.arange(6), item.numpy())
+                    item = data.channel('gun/out', mmap=True)
+                    np.testing.assert_array_equal(
+                        data.channel('gun/out').numpy(), item.numpy())
+                    np.testing.assert_array_equal(data.channel('gun/out')[6], item[6])
+
+                    del ds, item
+                    data.close()
+                    fa.close()
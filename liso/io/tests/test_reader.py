@@ -1,4 +1,6 @@
 import unittest
+from unittest.mock import patch
+from concurrent.futures import ProcessPoolExecutor
 import tempfile
 import pathlib
 
@@ -86,6 +88,101 @@ class TestSimReader(unittest.TestCase):
                 self._check_sim_iterate_over_data(data)
                 self._check_sim_access_data(data)
 
+            with self.subTest("Test persisting the ID index"), \
+                    tempfile.TemporaryDirectory() as index_dir:
+                index_file = pathlib.Path(index_dir).joinpath('index.npz')
+                indexed = open_sim(tmp_dir, index_file=index_file)
+                self.assertFalse(index_file.exists())
+                self._check_sim_access_data(indexed)
+                self.assertTrue(index_file.exists())
+
+                indexed = open_sim(tmp_dir, index_file=index_file)
+                with patch('liso.io.channel_data._IdIndex.from_files') as mocked:
+                    self._check_sim_access_data(indexed)
+                    mocked.assert_not_called()
+
+                # the index does not match the files
+                indexed = open_sim(path.joinpath(files[0]), index_file=index_file)
+                self._check_sim_access_data(indexed, 0)
+
+            with self.subTest("Test persisting the manifest"), \
+                    tempfile.TemporaryDirectory() as manifest_dir:
+                manifest_file = pathlib.Path(manifest_dir).joinpath('manifest.npz')
+                opened = open_sim(tmp_dir, manifest_file=manifest_file)
+                self.assertTrue(manifest_file.exists())
+                self._check_sim_metadata(opened)
+
+                with patch('liso.io.file_access.SimFileAccess._read_ids') as mocked:
+                    opened = open_sim(tmp_dir, manifest_file=manifest_file)
+                    mocked.assert_not_called()
+                self._check_sim_metadata(opened)
+                self._check_sim_get_control(opened)
+                self._check_sim_access_data(opened)
+
+                # a modified file is scanned again
+                path.joinpath(files[1]).touch()
+                with patch('liso.io.file_access.SimFileAccess._read_ids',
+                           autospec=True,
+                           side_effect=lambda fa: fa.file["INDEX/simId"][()]) as mocked:
+                    opened = open_sim(tmp_dir, manifest_file=manifest_file)
+                    mocked.assert_called_once()
+                self._check_sim_metadata(opened)
+
+            with self.subTest("Test reading with multiple processes"), \
+                    patch('liso.io.channel_data.ProcessPoolExecutor',
+                          wraps=ProcessPoolExecutor) as mocked_pool:
+                parallel = open_sim(tmp_dir, workers=2)
+                # the metadata are scanned by the worker processes
+                mocked_pool.assert_called_once()
+                self._check_sim_metadata(parallel)
+                self._check_sim_get_control(parallel)
+                self._check_sim_access_data(parallel)
+                pd.testing.assert_frame_equal(data.get_controls(sorted=True),
+                                              parallel.get_controls(sorted=True))
+                ids = sim_ids_gt[::-7]
+                for ch in ['gun/gun_phase', 'gun/out1']:
+                    np.testing.assert_array_equal(data.channel(ch).numpy(),
+                                                  parallel.channel(ch).numpy())
+                    np.testing.assert_array_equal(data.channel(ch).numpy(ids),
+                                                  parallel.channel(ch).numpy(ids))
+                np.testing.assert_array_equal(
+                    data.channel('gun/out2', columns=['x', 't']).numpy(ids),
+                    parallel.channel('gun/out2', columns=['x', 't']).numpy(ids))
+                # the processes are shared by the scan and all the reads
+                mocked_pool.assert_called_once()
+                parallel.close()
+
+            with self.subTest("Test iterating over batches"):
+                positions = {sid: i for i, sid in enumerate(sim_ids_gt)}
+                for shuffle in (False, True):
+                    batches = list(data.iter_batches(
+                        40, channels=['gun/gun_phase', 'gun/out1'], columns='y',
+                        shuffle=shuffle, seed=1))
+                    self.assertListEqual([40, 40, 40, 14], [len(ids) for ids, _ in batches])
+                    ids = np.concatenate([ids for ids, _ in batches])
+                    if shuffle:
+                        self.assertFalse(np.array_equal(data.sim_ids, ids))
+                        np.testing.assert_array_equal(np.sort(data.sim_ids), np.sort(ids))
+                    else:
+                        np.testing.assert_array_equal(data.sim_ids, ids)
+
+                    for ids, batch in batches:
+                        self.assertSetEqual({'gun/gun_phase', 'gun/out1'}, set(batch))
+                        idx = np.array([positions[sid] for sid in ids])
+                        np.testing.assert_array_equal(20 * idx, batch['gun/gun_phase'])
+                        np.testing.assert_array_equal(
+                            idx[:, None, None] * np.ones((1, 1, n_particles)),
+                            batch['gun/out1'])
+
+                ids, batch = next(data.iter_batches(200))
+                self.assertEqual(len(sim_ids_gt), len(ids))
+                self.assertEqual((len(sim_ids_gt), 7, n_particles), batch['gun/out2'].shape)
+
+                with self.assertRaises(KeyError):
+                    next(data.iter_batches(10, channels='gun/random'))
+                with self.assertRaises(ValueError):
+                    next(data.iter_batches(0))
+
             with self.subTest("Test control channel data"):
                 with self.assertRaisesRegex(KeyError, 'No data was found for channel'):
                     data.channel('gun/random')
@@ -103,6 +200,10 @@ class TestSimReader(unittest.TestCase):
                 self.assertEqual(np.float32, item.numpy().dtype)
                 np.testing.assert_array_equal(
                     20 * np.arange(len(self._sim_ids_gt)), item.numpy())
+                np.testing.assert_array_equal(
+                    [20 * 100, 20 * 5], item.numpy(self._sim_ids_gt[[100, 5]]))
+                with self.assertRaises(ValueError):
+                    item.numpy(columns='x')
 
             with self.subTest("Test phasespace channel data"):
                 item = data.channel('gun/out1')
@@ -118,6 +219,15 @@ class TestSimReader(unittest.TestCase):
                 np.testing.assert_array_equal(
                     idx * np.ones((2, self._n_particles)), item[self._sim_ids_gt[idx]])
 
+                item = data.channel('gun/out1')
+                sim_ids = self._sim_ids_gt[[70, 3, 120]]
+                np.testing.assert_array_equal(
+                    np.array([70, 3, 120])[:, None, None] * np.ones((3, 2, n_particles)),
+                    item.numpy(sim_ids, ['y', 'x']))
+                self.assertEqual((0, 7, n_particles), item.numpy([]).shape)
+                with self.assertRaises(KeyError):
+                    item.numpy([max(self._sim_ids_gt) + 1])
+
                 with self.assertRaisesRegex(ValueError, "not a valid phasespace column"):
                     data.channel('gun/out1', 'a')
 
@@ -159,6 +269,9 @@ class TestSimReader(unittest.TestCase):
             sorted_control_data = data.get_controls(sorted=True)
             np.testing.assert_array_equal(sorted(self._sim_ids_gt),
                                           sorted_control_data.index)
+            order = np.argsort(self._sim_ids_gt)
+            np.testing.assert_array_equal(10 * order,
+                                          sorted_control_data['gun/gun_gradient'])
         elif i == 2:
             self.assertEqual(self._chunk_size + 9, len(control_data))
             indices = (2 * file_size, 2 * file_size + chunk_size + 9)
@@ -238,17 +351,11 @@ class TestExpReader(unittest.TestCase):
         m.add_diagnostic_channel(dc.IMAGE, "XFEL.H/I/J/L", shape=self._s2, dtype='float32')
         self._schema = m.schema
 
-        self._orig_image_chunk = ExpWriter._IMAGE_CHUNK
-        ExpWriter._IMAGE_CHUNK = (3, 2)
-
         self._chunk_size = 30
         self._file_size = 50
 
         self._pulse_ids_gt = np.arange(2 * self._file_size + self._chunk_size + 9) + self._file_size
 
-    def tearDown(self):
-        ExpWriter._IMAGE_CHUNK = self._orig_image_chunk
-
     def testOpenRun(self):
         chunk_size = self._chunk_size
         file_size = self._file_size
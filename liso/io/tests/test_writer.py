@@ -1,4 +1,5 @@
 import unittest
+import json
 import tempfile
 import pathlib
 from datetime import datetime
@@ -102,6 +103,95 @@ class TestSimWriter(unittest.TestCase):
                         self.assertFalse(
                             np.any(writer._fp[f'PHASESPACE/{col.upper()}/gun/out'][0, ...]))
 
+    def testFlush(self):
+        schema = ({"gun/gun_gradient": {"type": "<f4"}},
+                  {"gun/out": {"macroparticles": self._n_particles,
+                               "type": "phasespace"}})
+        ps = Phasespace(np.ones((self._n_particles, 7)), 1.0)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with SimWriter(tmp_dir, schema=schema, chunk_size=4,
+                           max_events_per_file=10) as writer:
+                for i in range(3):
+                    writer.write(i, {'gun/gun_gradient': i + 1}, {'gun/out': ps})
+                fp = writer._fp
+                # events are buffered until a chunk is full
+                np.testing.assert_array_equal(
+                    [0, 0, 0, 0], fp['CONTROL/gun/gun_gradient'][()])
+
+                writer.flush()
+                np.testing.assert_array_equal(
+                    [1, 2, 3, 0], fp['CONTROL/gun/gun_gradient'][()])
+                np.testing.assert_array_equal(
+                    np.ones((3, self._n_particles)), fp['PHASESPACE/X/gun/out'][:3])
+
+                # the partially flushed chunk is completed
+                writer.write(3, {'gun/gun_gradient': 4}, {'gun/out': ps})
+                np.testing.assert_array_equal(
+                    [1, 2, 3, 4], fp['CONTROL/gun/gun_gradient'][()])
+
+                for i in range(4, 10):
+                    writer.write(i, {'gun/gun_gradient': i + 1}, {'gun/out': ps})
+                # the last chunk of the file is smaller than chunk_size
+                np.testing.assert_array_equal(
+                    np.arange(1, 11), fp['CONTROL/gun/gun_gradient'][()])
+
+                writer.write(10, {'gun/gun_gradient': 11}, {'gun/out': ps})
+
+            with h5py.File(pathlib.Path(tmp_dir).joinpath(
+                    "SIM-G01-S000001.hdf5"), 'r') as fp:
+                np.testing.assert_array_equal(
+                    [11, 0, 0, 0], fp['CONTROL/gun/gun_gradient'][()])
+                np.testing.assert_array_equal([10], fp['INDEX/simId'][()])
+
+    def testCompression(self):
+        schema = ({"gun/gun_gradient": {"type": "<f4"},
+                   "gun/gun_phase": {"type": "<f4", "compression": None}},
+                  {"gun/out": {"macroparticles": self._n_particles,
+                               "type": "phasespace",
+                               "compression": "gzip",
+                               "compression_opts": 4,
+                               "shuffle": True}})
+        ps = Phasespace(np.random.randn(self._n_particles, 7), 1.0)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with SimWriter(tmp_dir, schema=schema, chunk_size=5,
+                           compression={'compression': 'lzf'},
+                           phasespace_dtype='<f4') as writer:
+                for i in range(7):
+                    writer.write(i, {'gun/gun_gradient': i, 'gun/gun_phase': i},
+                                 {'gun/out': ps})
+
+            with h5py.File(pathlib.Path(tmp_dir).joinpath(
+                    "SIM-G01-S000000.hdf5"), 'r') as fp:
+                self.assertEqual('lzf', fp['CONTROL/gun/gun_gradient'].compression)
+                self.assertIsNone(fp['CONTROL/gun/gun_phase'].compression)
+                ds = fp['PHASESPACE/X/gun/out']
+                self.assertEqual('gzip', ds.compression)
+                self.assertEqual(4, ds.compression_opts)
+                self.assertTrue(ds.shuffle)
+                self.assertEqual(np.float32, ds.dtype)
+                np.testing.assert_array_equal(
+                    ps['x'].astype(np.float32), ds[6])
+
+                self.assertDictEqual(
+                    {'compression': 'lzf'},
+                    json.loads(fp['METADATA/controlChannelFilter'][0]))
+                self.assertDictEqual(
+                    {'compression': 'gzip', 'compression_opts': 4,
+                     'shuffle': True, 'dtype': '<f4'},
+                    json.loads(fp['METADATA/phasespaceChannelFilter'][0]))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with self.assertRaisesRegex(ValueError, "Unknown compression"):
+                SimWriter(tmp_dir, schema=schema, compression={'compression': 'abc'})
+            try:
+                import hdf5plugin
+            except ImportError:
+                with self.assertRaisesRegex(ValueError, "hdf5plugin"):
+                    SimWriter(tmp_dir, schema=schema,
+                              compression={'compression': 'blosc'})
+
     def _check_data_files(self, path, files):
         chunk_size = self._chunk_size
         file_size = self._file_size
@@ -169,17 +259,11 @@ class TestExpWriter(unittest.TestCase):
         m.add_diagnostic_channel(dc.IMAGE, "XFEL.H/I/J/L", shape=self._s2, dtype='float32')
         self._schema = m.schema
 
-        self._orig_image_chunk = ExpWriter._IMAGE_CHUNK
-        ExpWriter._IMAGE_CHUNK = (2, 3)
-
         self._chunk_size = 30
         self._file_size = 50
 
         self._pulse_ids_gt = np.arange(2 * self._file_size + self._chunk_size + 9) + self._file_size
 
-    def tearDown(self):
-        ExpWriter._IMAGE_CHUNK = self._orig_image_chunk
-
     def testWrite(self):
         chunk_size = self._chunk_size
         file_size = self._file_size
@@ -209,6 +293,106 @@ class TestExpWriter(unittest.TestCase):
             with self.subTest("Test data in the file"):
                 self._check_data_files(path, files)
 
+    def testBackgroundWrite(self):
+        chunk_size = self._chunk_size
+        file_size = self._file_size
+        s1, s2 = self._s1, self._s2
+        pulse_ids_gt = self._pulse_ids_gt
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with ExpWriter(tmp_dir,
+                           schema=self._schema,
+                           chunk_size=chunk_size,
+                           max_events_per_file=file_size,
+                           queue_size=2) as writer:
+                for i, pid in enumerate(pulse_ids_gt):
+                    writer.write(
+                        pid,
+                        {"XFEL.A/B/C/D": 10 * i, "XFEL.A/B/C/E": 0.1 * i},
+                        {"XFEL.H/I/J/K": np.ones(s1, dtype=np.uint16),
+                         "XFEL.H/I/J/L": np.ones(s2, dtype=np.float32)}
+                    )
+                writer.flush()
+                metrics = writer.metrics
+                self.assertEqual(0, metrics['queue_depth'])
+                self.assertLessEqual(metrics['max_queue_depth'], 2)
+
+            self.assertIsNone(writer._thread)
+            path = pathlib.Path(tmp_dir)
+            self._check_data_files(path, sorted([f.name for f in path.iterdir()]))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            writer = ExpWriter(tmp_dir, schema=self._schema, queue_size=1)
+            writer.write(1, {"XFEL.A/B/C/Z": 1.}, {})
+            # the exception raised in the writer thread is propagated
+            with self.assertRaises(KeyError):
+                writer.flush()
+            # the writer stays failed and rejects the following events
+            with self.assertRaises(KeyError):
+                writer.write(2, {"XFEL.A/B/C/D": 1.}, {})
+            with self.assertRaises(KeyError):
+                writer.flush()
+            with self.assertRaises(KeyError):
+                writer.close()
+            self.assertIsNone(writer._thread)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            writer = ExpWriter(tmp_dir, schema=self._schema, queue_size=10)
+            writer.write(1, {"XFEL.A/B/C/D": 1.}, {})
+            writer.write(2, {"XFEL.A/B/C/Z": 1.}, {})
+            writer.write(3, {"XFEL.A/B/C/D": 3.}, {})
+            # the events queued after the failed one are discarded
+            with self.assertRaises(KeyError):
+                writer.close()
+            files = list(pathlib.Path(tmp_dir).iterdir())
+            self.assertEqual(1, len(files))
+            with h5py.File(files[0], 'r') as fp:
+                np.testing.assert_array_equal([1], fp["INDEX/pulseId"][()])
+
+    def testChunks(self):
+        m = EuXFELInterface()
+        m.add_control_channel(dc.FLOAT64, "XFEL.A/B/C/D")
+        m.add_diagnostic_channel(dc.ARRAY, "XFEL.H/I/J/K", shape=(100,), dtype='<f8')
+        m.add_diagnostic_channel(dc.ARRAY, "XFEL.H/I/J/L", shape=(3, 20, 16), dtype='<u2')
+        m.add_diagnostic_channel(dc.IMAGE, "XFEL.H/I/J/M", shape=(70, 40), dtype='<f8')
+        m.add_diagnostic_channel(dc.IMAGE, "XFEL.H/I/J/N", shape=(20, 30), dtype='<u2')
+        schema = m.schema
+        schema[1]["XFEL.H/I/J/N"]['chunks'] = (2, 20, 30)
+
+        data = {
+            "XFEL.H/I/J/K": np.arange(100, dtype=np.float64),
+            "XFEL.H/I/J/L": np.ones((3, 20, 16), dtype=np.uint16),
+            "XFEL.H/I/J/M": np.random.randn(70, 40),
+            "XFEL.H/I/J/N": 2 * np.ones((20, 30), dtype=np.uint16),
+        }
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with ExpWriter(tmp_dir, schema=schema, chunk_size=10,
+                           chunks={"XFEL.H/I/J/L": (5, 1, 20, 16)},
+                           chunk_bytes=4000) as writer:
+                for pid in range(1, 16):
+                    writer.write(pid, {"XFEL.A/B/C/D": 1.}, data)
+
+            path = pathlib.Path(tmp_dir)
+            with h5py.File(next(path.iterdir()), 'r') as fp:
+                self.assertEqual((10,), fp['CONTROL/XFEL.A/B/C/D'].chunks)
+                # stacked events
+                self.assertEqual((5, 100), fp['DIAGNOSTIC/XFEL.H/I/J/K'].chunks)
+                # from the argument
+                self.assertEqual((5, 1, 20, 16), fp['DIAGNOSTIC/XFEL.H/I/J/L'].chunks)
+                # complete rows of a single event
+                self.assertEqual((1, 12, 40), fp['DIAGNOSTIC/XFEL.H/I/J/M'].chunks)
+                # from the schema
+                self.assertEqual((2, 20, 30), fp['DIAGNOSTIC/XFEL.H/I/J/N'].chunks)
+
+                for k, v in data.items():
+                    np.testing.assert_array_equal(v, fp[f'DIAGNOSTIC/{k}'][14])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for chunks in [(20, 100), (1, 101), (100,)]:
+                with self.assertRaisesRegex(ValueError, "Invalid chunk shape"):
+                    ExpWriter(tmp_dir, schema=schema, chunk_size=10,
+                              chunks={"XFEL.H/I/J/K": chunks})
+
     def _check_data_files(self, path, files):
         chunk_size = self._chunk_size
         file_size = self._file_size
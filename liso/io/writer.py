@@ -7,28 +7,153 @@ Copyright (C) Jun Zhu. All rights reserved.
 """
 import abc
 from datetime import datetime
+import json
 import os
 import pathlib
+import queue
 from string import Template
+import threading
+import time
 
 import h5py
+import numpy as np
 
 from ..proc import Phasespace
 
 
+# filters provided by the optional package hdf5plugin
+_PLUGIN_FILTERS = {
+    'blosc': 'Blosc',
+    'bitshuffle': 'Bitshuffle',
+    'lz4': 'LZ4',
+    'zstd': 'Zstd',
+}
+
+_FILTER_KEYS = ('compression', 'compression_opts', 'shuffle')
+
+
+def _auto_chunks(shape, itemsize, n_events, target_bytes):
+    """Return the chunk shape of a dataset storing one array per event.
+
+    Arrays smaller than target_bytes are stacked along the event axis so
+    that reading a time series touches a few chunks. Larger arrays are
+    split along the leading axes so that a chunk consists of complete
+    rows and reading a whole array touches as few chunks as possible.
+
+    :param tuple shape: shape of an array.
+    :param int itemsize: number of bytes of an element.
+    :param int n_events: maximum number of events in a chunk. The
+        returned value is a divisor of it.
+    :param int target_bytes: target size of a chunk in bytes.
+    """
+    nbytes = itemsize * int(np.prod(shape))
+    if nbytes <= target_bytes:
+        n = max(1, min(n_events, target_bytes // max(nbytes, 1)))
+        while n_events % n:
+            n -= 1
+        return (n, *shape)
+
+    chunks = [1] * len(shape)
+    for axis in range(len(shape)):
+        row_bytes = itemsize * int(np.prod(shape[axis + 1:]))
+        if row_bytes <= target_bytes:
+            chunks[axis] = min(shape[axis], target_bytes // row_bytes)
+            chunks[axis + 1:] = shape[axis + 1:]
+            break
+    return (1, *chunks)
+
+
+def _get_filter_kwargs(options):
+    """Return the filter keyword arguments for creating a dataset.
+
+    :param dict options: filter options. 'compression' can be None,
+        'gzip', 'lzf' or, if hdf5plugin is installed, one of 'blosc',
+        'bitshuffle', 'lz4' and 'zstd'. For the plugin filters,
+        'compression_opts' is a dictionary of keyword arguments of the
+        corresponding filter class in hdf5plugin and 'shuffle' is not
+        supported.
+
+    :raise ValueError: if the filter is unknown or not available.
+    """
+    compression = options.get('compression')
+    opts = options.get('compression_opts')
+    shuffle = options.get('shuffle', False)
+
+    if compression is None:
+        return {'shuffle': shuffle} if shuffle else {}
+
+    if compression in ('gzip', 'lzf'):
+        kwargs = {'compression': compression, 'shuffle': shuffle}
+        if opts is not None:
+            kwargs['compression_opts'] = opts
+        return kwargs
+
+    if compression in _PLUGIN_FILTERS:
+        if shuffle:
+            raise ValueError(
+                f"'shuffle' is not supported by the '{compression}' filter!")
+        try:
+            import hdf5plugin
+        except ImportError:
+            raise ValueError(f"The '{compression}' filter requires "
+                             f"the package hdf5plugin!")
+        return dict(getattr(hdf5plugin, _PLUGIN_FILTERS[compression])(
+            **(opts or {})))
+
+    raise ValueError(f"Unknown compression filter: {compression}")
+
+
+def _repack_contiguous(filepath, block_bytes=1 << 26):
+    """Rewrite the chunked datasets of a file with the contiguous layout.
+
+    Datasets with filters, e.g. compression, cannot be contiguous and
+    are copied as they are.
+
+    :param str filepath: path of the file.
+    :param int block_bytes: maximum number of bytes copied at once.
+    """
+    tmp = f"{filepath}.tmp"
+    with h5py.File(filepath, 'r') as src, h5py.File(tmp, 'w-') as dst:
+        def _copy(name, obj):
+            if isinstance(obj, h5py.Group):
+                dst.require_group(name).attrs.update(obj.attrs)
+            elif obj.chunks is None or obj.compression is not None \
+                    or obj.shuffle or obj.size == 0 \
+                    or obj.dtype.hasobject:
+                src.copy(obj, dst, name=name)
+            else:
+                ds = dst.create_dataset(name, shape=obj.shape, dtype=obj.dtype)
+                row_bytes = obj.dtype.itemsize * int(np.prod(obj.shape[1:]))
+                step = max(1, block_bytes // max(row_bytes, 1))
+                for start in range(0, obj.shape[0], step):
+                    ds[start:start + step] = obj[start:start + step]
+                ds.attrs.update(obj.attrs)
+
+        dst.attrs.update(src.attrs)
+        src.visititems(_copy)
+    os.replace(tmp, filepath)
+
+
 class _BaseWriter(abc.ABC):
     """Base class for HDF5 writer."""
 
     # cap the number of sequence files
     _MAX_SEQUENCE = 99
 
-    _IMAGE_CHUNK = (16, 512)
+    # datasets whose buffer would be larger than this are written
+    # event by event, e.g. camera images
+    _MAX_BUFFER_BYTES = 1 << 26
 
     def __init__(self, path, *,
                  chmod=True,
                  group=1,
                  chunk_size=50,
-                 max_events_per_file):
+                 max_events_per_file,
+                 queue_size=0,
+                 compression=None,
+                 start_seq=0,
+                 on_close=None,
+                 contiguous=False):
         """Initialization.
 
         :param pathlib.Path path: path of the simulation/run folder.
@@ -38,6 +163,22 @@ class _BaseWriter(abc.ABC):
         :param int chunk_size: size of the first dimention of a chunk in
             a dataset.
         :param int max_events_per_file: maximum events stored in a single file.
+        :param int queue_size: if positive, events are written by a
+            background thread and at most queue_size events can wait in
+            the queue. write() blocks when the queue is full. An exception
+            raised in the writer thread is re-raised by the next call of
+            write(), flush() or close().
+        :param dict compression: default filter options of the datasets,
+            e.g. {'compression': 'gzip', 'compression_opts': 4,
+            'shuffle': True}. The options can be overridden by the same
+            keys in the schema of a channel.
+        :param int start_seq: sequence number of the first file.
+        :param callable on_close: called with the file path and the list
+            of event IDs in the file after a file is closed.
+        :param bool contiguous: True for rewriting the datasets without
+            filters with the contiguous layout after a file is closed,
+            so that they can be memory-mapped by the reader, e.g.
+            ChannelData with mmap=True. It doubles the I/O of writing.
 
         :raise OSError is the file already exists.
         """
@@ -59,13 +200,230 @@ class _BaseWriter(abc.ABC):
             raise ValueError("group must be an integer within [1, 99]")
 
         self._index = 0
-        self._file_count = 0
+        self._file_count = start_seq
+        self._on_close = on_close
+
+        self._compression = dict() if compression is None \
+            else dict(compression)
+        if contiguous and self._compression.get('compression') is not None:
+            raise ValueError("Compressed datasets cannot be contiguous!")
+        self._contiguous = contiguous
+
+        # paths of the datasets in the current file
+        self._datasets = []
+        # {dataset path: buffer of a chunk of events}
+        self._buffers = dict()
+        # row index of the first event in the buffers
+        self._buffer_start = 0
+
+        self._queue = None
+        self._thread = None
+        self._exception = None
+        self._max_queue_depth = 0
+        self._blocked_puts = 0
+        self._blocked_time = 0.
+        if queue_size > 0:
+            self._queue = queue.Queue(maxsize=queue_size)
+            self._thread = threading.Thread(target=self._run_writer,
+                                            daemon=True)
+            self._thread.start()
+
+    @property
+    def metrics(self):
+        """Metrics of the writer queue.
+
+        queue_depth: number of events waiting in the queue.
+        max_queue_depth: maximum number of events waiting in the queue.
+        blocked_puts: number of writes which waited for a free slot.
+        blocked_time: total time (s) spent on waiting for a free slot.
+        """
+        return {
+            'queue_depth': 0 if self._queue is None else self._queue.qsize(),
+            'max_queue_depth': self._max_queue_depth,
+            'blocked_puts': self._blocked_puts,
+            'blocked_time': self._blocked_time,
+        }
+
+    def _run_writer(self):
+        """Write the events in the queue until receiving None."""
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                # the writer stays failed after an exception and the
+                # remaining events are discarded until it is closed
+                if self._exception is None:
+                    self._write(*item)
+            except Exception as e:
+                self._exception = e
+            finally:
+                self._queue.task_done()
+
+    def _raise_exception(self):
+        # the exception is not reset so that no event is written after
+        # a failed one
+        if self._exception is not None:
+            raise self._exception
+
+    def _submit(self, *args):
+        """Write an event directly or put it into the queue."""
+        if self._queue is None:
+            self._write(*args)
+            return
+
+        self._raise_exception()
+        try:
+            self._queue.put_nowait(args)
+        except queue.Full:
+            t0 = time.perf_counter()
+            self._queue.put(args)
+            self._blocked_time += time.perf_counter() - t0
+            self._blocked_puts += 1
+        self._max_queue_depth = max(self._max_queue_depth,
+                                    self._queue.qsize())
+
+    @abc.abstractmethod
+    def _write(self, *args):
+        """Write one event into the file."""
+        pass
 
     @abc.abstractmethod
     def _create_new_file(self):
         """Create a new file in the run folder."""
         pass
 
+    def _get_filters(self, channel_schema):
+        """Return the filter options of a channel.
+
+        :param dict channel_schema: schema of the channel.
+        """
+        filters = self._compression.copy()
+        for k in _FILTER_KEYS:
+            if k in channel_schema:
+                filters[k] = channel_schema[k]
+        return filters
+
+    def _check_filters(self, *schemas):
+        """Raise if any of the filters in the schemas is not available."""
+        for schema in schemas:
+            for v in schema.values():
+                _get_filter_kwargs(self._get_filters(v))
+
+    def _init_filter_meta_data(self, channel_category, filters):
+        """Record the filter options of the channels in a category.
+
+        :param str channel_category: channel category.
+        :param list filters: filter options of each channel.
+        """
+        meta_ch = f"METADATA/{channel_category}ChannelFilter"
+        self._fp.create_dataset(meta_ch,
+                                dtype=h5py.string_dtype(),
+                                shape=(len(filters),))
+        for i, f in enumerate(filters):
+            self._fp[meta_ch][i] = json.dumps(f, sort_keys=True)
+
+    def _create_dataset(self, path, shape, dtype, chunks, filters):
+        """Create a dataset which stores one entry per event.
+
+        :param str path: path of the dataset.
+        :param tuple shape: shape of an entry.
+        :param str dtype: data type.
+        :param tuple chunks: chunk shape.
+        :param dict filters: filter options.
+        """
+        self._fp.create_dataset(
+            path,
+            shape=(self._chunk_size, *shape),
+            dtype=dtype,
+            chunks=chunks,
+            maxshape=(self._max_events_per_file, *shape),
+            **_get_filter_kwargs(filters))
+        self._datasets.append(path)
+
+        buffer = np.zeros((self._chunk_size, *shape), dtype=dtype)
+        if buffer.nbytes <= self._MAX_BUFFER_BYTES:
+            self._buffers[path] = buffer
+
+    def _open_file(self, filepath):
+        """Open a new file and reset the buffers."""
+        self._fp = h5py.File(filepath, 'w-')
+        self._datasets.clear()
+        self._buffers.clear()
+        self._buffer_start = 0
+        return self._fp
+
+    def _next_event(self):
+        """Prepare for writing a new event and return its row index."""
+        idx = self._index
+        if idx % self._max_events_per_file == 0:
+            # close the current file
+            self._close_file()
+            # create a new one
+            self._create_new_file()
+            self._index = idx = 0
+        elif idx % self._chunk_size == 0:
+            n_chunks = idx // self._chunk_size + 1
+            new_size = min(n_chunks * self._chunk_size,
+                           self._max_events_per_file)
+            for path in self._datasets:
+                self._fp[path].resize(new_size, axis=0)
+        return idx
+
+    def _set(self, path, idx, value):
+        """Set the value of the event at the given row of a dataset."""
+        buffer = self._buffers.get(path)
+        if buffer is None:
+            self._fp[path][idx] = value
+        else:
+            buffer[idx - self._buffer_start] = value
+
+    def _reset(self, path, idx):
+        """Reset the value of the event at the given row of a dataset."""
+        buffer = self._buffers.get(path)
+        if buffer is not None:
+            buffer[idx - self._buffer_start] = 0
+
+    def _commit_event(self):
+        """Finish writing an event and flush a full chunk."""
+        self._index += 1
+        capacity = min(self._chunk_size,
+                       self._max_events_per_file - self._buffer_start)
+        if self._index - self._buffer_start == capacity:
+            self._flush()
+
+    def flush(self):
+        """Write the buffered events into the file.
+
+        Each buffered dataset is written with a single chunk-aligned
+        write. The buffer of a partially filled chunk is kept and
+        written again together with the following events.
+
+        In the background mode, it waits until the queue is empty.
+        """
+        if self._queue is not None:
+            self._queue.join()
+            self._raise_exception()
+        self._flush()
+
+    def _flush(self):
+        if self._fp is None:
+            return
+
+        start = self._buffer_start
+        n = self._index - start
+        if n > 0:
+            for path, buffer in self._buffers.items():
+                self._fp[path][start:start + n] = buffer[:n]
+
+            if n == min(self._chunk_size,
+                        self._max_events_per_file - start):
+                for buffer in self._buffers.values():
+                    buffer.fill(0)
+                self._buffer_start += n
+
+        self._fp.flush()
+
     def _init_meta_data(self):
         fp = self._fp
         fp.create_dataset("METADATA/createDate",
@@ -81,16 +439,37 @@ class _BaseWriter(abc.ABC):
 
     @abc.abstractmethod
     def _finalize(self):
+        """Write the index of the file and return the event IDs."""
         pass
 
     def close(self):
+        """Write all the events and close the file.
+
+        In the background mode, the writer thread is stopped. If writing
+        an event failed, the exception is raised again and none of the
+        events submitted after the failed one has been written.
+        """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            self._queue = None
+        self._close_file()
+        self._raise_exception()
+
+    def _close_file(self):
         if self._fp is not None:
-            self._finalize()
+            self._flush()
+            ids = self._finalize()
             filename = self._fp.filename
             self._fp.close()
+            if self._contiguous:
+                _repack_contiguous(filename)
             if self._chmod:
                 os.chmod(filename, 0o400)
             self._fp = None
+            if self._on_close is not None:
+                self._on_close(filename, ids)
 
 
 class SimWriter(_BaseWriter):
@@ -98,11 +477,16 @@ class SimWriter(_BaseWriter):
 
     _FILE_ROOT_NAME = Template("SIM-G$group-S$seq.hdf5")
 
-    def __init__(self, path, *, schema, max_events_per_file=10000, **kwargs):
+    def __init__(self, path, *, schema, max_events_per_file=10000,
+                 phasespace_dtype='<f8', **kwargs):
         """Initialization.
 
         :param str/pathlib.Path path: path of the simulation folder.
         :param tuple schema: (control, phasespace) data schema
+        :param str phasespace_dtype: default data type of the phasespace
+            columns. Use '<f4' to halve the file size at the cost of
+            precision. It can be overridden by 'dtype' in the schema of
+            a phasespace channel.
         """
         super().__init__(path,
                          max_events_per_file=max_events_per_file, **kwargs)
@@ -110,6 +494,8 @@ class SimWriter(_BaseWriter):
         self._sim_ids = []
 
         self._control_schema, self._phasespace_schema = schema
+        self._phasespace_dtype = phasespace_dtype
+        self._check_filters(*schema)
 
     def _create_new_file(self):
         """Override."""
@@ -118,7 +504,7 @@ class SimWriter(_BaseWriter):
         self._file_count += 1
         self._sim_ids.clear()
 
-        self._fp = h5py.File(next_file, 'w-')
+        self._open_file(next_file)
 
         self._init_meta_data()
         self._init_channel_data("control", self._control_schema)
@@ -134,24 +520,31 @@ class SimWriter(_BaseWriter):
                           dtype=h5py.string_dtype(),
                           shape=(len(schema),))
 
+        all_filters = []
         for i, (k, v) in enumerate(schema.items()):
             fp[meta_ch][i] = k
             dtype = v['type']
+            filters = self._get_filters(v)
             if dtype == 'phasespace':
+                ps_dtype = v.get('dtype', self._phasespace_dtype)
                 for col in Phasespace.columns:
-                    fp.create_dataset(
+                    self._create_dataset(
                         f"{channel_category.upper()}/{col.upper()}/{k}",
-                        shape=(self._chunk_size, v['macroparticles']),
-                        dtype='<f8',
-                        chunks=(self._chunk_size, v['macroparticles']),
-                        maxshape=(self._max_events_per_file, v['macroparticles']))
+                        (v['macroparticles'],),
+                        ps_dtype,
+                        (self._chunk_size, v['macroparticles']),
+                        filters)
+                filters['dtype'] = ps_dtype
             else:
-                fp.create_dataset(
+                self._create_dataset(
                     f"{channel_category.upper()}/{k}",
-                    shape=(self._chunk_size,),
-                    dtype=v['type'],
-                    chunks=(self._chunk_size,),
-                    maxshape=(self._max_events_per_file,))
+                    (),
+                    v['type'],
+                    (self._chunk_size,),
+                    filters)
+            all_filters.append(filters)
+
+        self._init_filter_meta_data(channel_category, all_filters)
 
     def write(self, sim_id, controls, phasespaces):
         """Write data from one simulation into the file.
@@ -160,64 +553,77 @@ class SimWriter(_BaseWriter):
         :param dict controls: dictionary of the control data.
         :param dict phasespaces: dictionary of the phasespace data.
         """
-        fp = self._fp
-        chunk_size = self._chunk_size
-        idx = self._index
+        self._submit(sim_id, controls, phasespaces)
 
-        if idx % self._max_events_per_file == 0:
-            # close the current file
-            self.close()
-            # create a new one
-            fp = self._create_new_file()
-            self._index = idx = 0
-        elif idx % chunk_size == 0:
-            n_chunks = idx // chunk_size + 1
-            new_size = min(n_chunks * chunk_size, self._max_events_per_file)
-            for k in self._control_schema:
-                fp[f"CONTROL/{k}"].resize(new_size, axis=0)
-            for k in self._phasespace_schema:
-                for col in Phasespace.columns:
-                    fp[f"PHASESPACE/{col.upper()}/{k}"].resize(new_size, axis=0)
+    def _write(self, sim_id, controls, phasespaces):
+        """Override."""
+        idx = self._next_event()
 
         for k, v in controls.items():
-            fp[f"CONTROL/{k}"][idx] = v
+            self._set(f"CONTROL/{k}", idx, v)
 
         for k, v in phasespaces.items():
+            paths = [f"PHASESPACE/{col.upper()}/{k}" for col in v.columns]
+            data = v.to_numpy()
             try:
                 # The rational behind writing different columns separately
                 # is to avoid reading out all the columns when only one
                 # or two columns are needed.
-                for col in v.columns:
-                    fp[f"PHASESPACE/{col.upper()}/{k}"][idx] = v[col]
-            except TypeError:
+                for i, path in enumerate(paths):
+                    self._set(path, idx, data[:, i])
+            except (TypeError, ValueError):
                 # particle loss
-                pass
+                for path in paths:
+                    self._reset(path, idx)
 
         # Caveat: sim ID does not arrive in sequence
         self._sim_ids.append(sim_id)
-        self._index += 1
+        self._commit_event()
 
     def _finalize(self):
         """Override."""
         fp = self._fp
         fp.create_dataset("INDEX/simId", data=self._sim_ids, dtype='u8')
         fp["METADATA/updateDate"][()] = datetime.now().isoformat()
+        return list(self._sim_ids)
 
 
 class ExpWriter(_BaseWriter):
 
     _FILE_ROOT_NAME = Template("RAW-$run-G$group-S$seq.hdf5")
 
-    def __init__(self, path, *, schema, max_events_per_file=500, **kwargs):
+    # target size of an auto-tuned chunk of array data, which is the
+    # default size of the chunk cache in HDF5
+    _CHUNK_BYTES = 1 << 20
+
+    def __init__(self, path, *, schema, max_events_per_file=500,
+                 chunks=None, chunk_bytes=None, **kwargs):
         """Initialization.
 
         :param pathlib.Path path: path of the run folder.
         :param tuple schema: (control, diagnostic) data schema.
+        :param dict chunks: chunk shapes of array channels, e.g.
+            {"XFEL.DIAG/CAMERA/OTRC.64.I1D/IMAGE_EXT_ZMQ": (1, 256, 2330)}.
+            The first dimension is the number of events in a chunk and it
+            must not exceed chunk_size. A 'chunks' item in the schema of
+            a channel is used if the channel is not found here. Otherwise,
+            the chunk shape is tuned according to chunk_bytes.
+        :param int chunk_bytes: target size of an auto-tuned chunk in bytes.
         """
         super().__init__(path,
                          max_events_per_file=max_events_per_file, **kwargs)
 
         self._control_schema, self._diagnostic_schema = schema
+        self._check_filters(*schema)
+
+        self._chunks = dict() if chunks is None else dict(chunks)
+        self._chunk_bytes = self._CHUNK_BYTES if chunk_bytes is None \
+            else chunk_bytes
+        # fail fast
+        for k, v in (*self._control_schema.items(),
+                     *self._diagnostic_schema.items()):
+            if v['type'] == 'NDArray':
+                self._get_chunks(k, v)
 
         self._pulse_ids = []
 
@@ -230,7 +636,7 @@ class ExpWriter(_BaseWriter):
         self._file_count += 1
         self._pulse_ids.clear()
 
-        self._fp = h5py.File(next_file, 'w-')
+        self._open_file(next_file)
 
         self._init_meta_data()
         self._init_channel_data("control", self._control_schema)
@@ -238,6 +644,31 @@ class ExpWriter(_BaseWriter):
 
         return self._fp
 
+    def _get_chunks(self, address, channel_schema):
+        """Return the chunk shape of an array channel.
+
+        :param str address: channel address.
+        :param dict channel_schema: schema of the channel.
+
+        :raise ValueError: if the given chunk shape is invalid.
+        """
+        shape = tuple(channel_schema['shape'])
+        chunks = self._chunks.get(address, channel_schema.get('chunks'))
+        if chunks is None:
+            return _auto_chunks(shape,
+                                np.dtype(channel_schema['dtype']).itemsize,
+                                self._chunk_size,
+                                self._chunk_bytes)
+
+        chunks = tuple(chunks)
+        if len(chunks) != len(shape) + 1 \
+                or not 0 < chunks[0] <= self._chunk_size \
+                or not all(0 < c <= s for c, s in zip(chunks[1:], shape)):
+            raise ValueError(
+                f"Invalid chunk shape {chunks} for channel {address} with "
+                f"shape {shape} and chunk_size {self._chunk_size}")
+        return chunks
+
     def _init_channel_data(self, channel_category, schema):
         fp = self._fp
 
@@ -246,30 +677,28 @@ class ExpWriter(_BaseWriter):
                           dtype=h5py.string_dtype(),
                           shape=(len(schema),))
 
+        all_filters = []
         for i, (k, v) in enumerate(schema.items()):
             fp[meta_ch][i] = k
             dtype = v['type']
+            filters = self._get_filters(v)
             if dtype == 'NDArray':
-                shape = v['shape']
-                if len(shape) == 2:
-                    # image data
-                    chunk_size = (1, *self._IMAGE_CHUNK)
-                else:
-                    # TODO: finish it
-                    chunk_size = (self._chunk_size, *v['shape'])
-                fp.create_dataset(
+                self._create_dataset(
                     f"{channel_category.upper()}/{k}",
-                    shape=(self._chunk_size, *v['shape']),
-                    dtype=v['dtype'],
-                    chunks=chunk_size,
-                    maxshape=(self._max_events_per_file, *v['shape']))
+                    tuple(v['shape']),
+                    v['dtype'],
+                    self._get_chunks(k, v),
+                    filters)
             else:
-                fp.create_dataset(
+                self._create_dataset(
                     f"{channel_category.upper()}/{k}",
-                    shape=(self._chunk_size,),
-                    dtype=v['type'],
-                    chunks=(self._chunk_size,),
-                    maxshape=(self._max_events_per_file,))
+                    (),
+                    v['type'],
+                    (self._chunk_size,),
+                    filters)
+            all_filters.append(filters)
+
+        self._init_filter_meta_data(channel_category, all_filters)
 
     def write(self, pulse_id, controls, diagnostics):
         """Write matched data from one train into the file.
@@ -278,34 +707,23 @@ class ExpWriter(_BaseWriter):
         :param dict controls: dictionary of the control data.
         :param dict diagnostics: dictionary of the phasespace data.
         """
-        fp = self._fp
-        chunk_size = self._chunk_size
-        idx = self._index
+        self._submit(pulse_id, controls, diagnostics)
 
-        if idx % self._max_events_per_file == 0:
-            # close the current file
-            self.close()
-            # create a new one
-            fp = self._create_new_file()
-            self._index = idx = 0
-        elif idx % chunk_size == 0:
-            n_chunks = idx // chunk_size + 1
-            new_size = min(n_chunks * chunk_size, self._max_events_per_file)
-            for k in self._control_schema:
-                fp[f"CONTROL/{k}"].resize(new_size, axis=0)
-            for k in self._diagnostic_schema:
-                fp[f"DIAGNOSTIC/{k}"].resize(new_size, axis=0)
+    def _write(self, pulse_id, controls, diagnostics):
+        """Override."""
+        idx = self._next_event()
 
         for k, v in controls.items():
-            fp[f"CONTROL/{k}"][idx] = v
+            self._set(f"CONTROL/{k}", idx, v)
         for k, v in diagnostics.items():
-            fp[f"DIAGNOSTIC/{k}"][idx] = v
+            self._set(f"DIAGNOSTIC/{k}", idx, v)
 
         self._pulse_ids.append(pulse_id)
-        self._index += 1
+        self._commit_event()
 
     def _finalize(self):
         """Override."""
         fp = self._fp
         fp.create_dataset("INDEX/pulseId", data=self._pulse_ids, dtype='u8')
         fp["METADATA/updateDate"][()] = datetime.now().isoformat()
+        return list(self._pulse_ids)
@@ -26,7 +26,9 @@ Copyright (C) Jun Zhu. All rights reserved.
 #     m is the total number of constraints (number of equality
 #     constraints: m_i = m - m_e).
 
+import asyncio
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from itertools import chain
 import math
 import sys
@@ -54,6 +56,10 @@ class Optimization(object):
         e_constraints (OrderedDict): equality constraint set.
         i_constraints (OrderedDict): inequality constraint set.
     """
+    # True if eval_objs_cons_batch() evaluates the points in the
+    # executor given by the optimizer
+    use_executor = True
+
     def __init__(self, name='opt_prob', *, opt_func=None):
         """Initialization.
 
@@ -162,24 +168,58 @@ class Optimization(object):
         except KeyError:
             raise KeyError("{} is not an equality constraint!".format(name))
 
-    def _update_x_map(self, x):
-        """Update values in x_map.
+    def _get_x_map(self, x):
+        """Return a new x_map with the given variable values.
 
-        Invoked in self.eval_objs_cons(). Not raise.
+        Neither x_map nor the variables will be modified. Not raise.
 
         :param x: 1D array like
             New variable values.
         """
+        x_map = OrderedDict()
         x_covar = [0] * len(self.covariables)  # placeholder
         for key, v in zip(self._x_map.keys(), chain(x, x_covar)):
-            self._x_map[key] = v
-            try:
-                self.variables[key].value = v
-            except KeyError:
+            if key in self.variables:
+                x_map[key] = v
+            else:
                 var = self.covariables[key].dependent
                 a = self.covariables[key].scale
                 b = self.covariables[key].shift
-                self._x_map[key] = a * self._x_map[var] + b
+                x_map[key] = a * x_map[var] + b
+        return x_map
+
+    def _update_x_map(self, x):
+        """Update values in x_map.
+
+        Invoked in self.eval_objs_cons(). Not raise.
+
+        :param x: 1D array like
+            New variable values.
+        """
+        self._x_map = self._get_x_map(x)
+        for key, var in self.variables.items():
+            var.value = self._x_map[key]
+
+    def _normalize(self, f_eval, g_eval):
+        """Update the objectives and constraints with the evaluated values.
+
+        :return: f: list
+            Objective values seen by the optimizer.
+        :return: g: list
+            Constraint values seen by the optimizer.
+        """
+        # update objective values
+        for i, item in enumerate(self.objectives.values()):
+            item.value = f_eval[i]
+        # update constraint values
+        for i, item in enumerate(chain(self.e_constraints.values(),
+                                       self.i_constraints.values())):
+            item.value = g_eval[i]
+
+        f = [obj.value for obj in self.objectives.values()]
+        g = [con.value for con in chain(self.e_constraints.values(),
+                                        self.i_constraints.values())]
+        return f, g
 
     def eval_objs_cons(self, x, *args, **kwargs):
         """Objective-constraint function.
@@ -203,38 +243,96 @@ class Optimization(object):
         f_eval, g_eval = self._opt_func(x)
         self._nfeval += 1
 
-        # update objective values
-        for i, item in enumerate(self.objectives.values()):
-            item.value = f_eval[i]
-        # update constraint values
-        for i, item in enumerate(chain(self.e_constraints.values(),
-                                       self.i_constraints.values())):
-            item.value = g_eval[i]
+        f, g = self._normalize(f_eval, g_eval)
 
-        f = [obj.value for obj in self.objectives.values()]
-        g = [con.value for con in chain(self.e_constraints.values(),
-                                        self.i_constraints.values())]
+        self._report_eval(f, g, False)
+
+        return f, g, False
+
+    def eval_objs_cons_batch(self, X, *, workers=1, executor=None):
+        """Batched objective-constraint function.
+
+        The points are independent of each other and thus can be
+        evaluated concurrently. Neither x_map nor the variables will
+        be modified.
+
+        :param numpy.ndarray X: variables of all the points with shape
+            (n_points, n_vars).
+        :param int workers: number of processes used to evaluate the
+            points if executor is not given.
+        :param concurrent.futures.Executor executor: executor used to
+            evaluate the points. It will not be shut down afterwards.
+
+        :return: f: numpy.ndarray
+            Evaluations of objective functions with shape
+            (n_points, n_objs).
+        :return: g: numpy.ndarray
+            Evaluations of constraint functions with shape
+            (n_points, n_cons).
+        :return: is_failed: numpy.ndarray
+            Indicators of failed function evaluations with shape
+            (n_points,).
+        """
+        x_maps = [self._get_x_map(x) for x in X]
+        xs = [list(x_map.values()) for x_map in x_maps]
+
+        if executor is not None:
+            rets = list(executor.map(self._opt_func, xs))
+        elif workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                rets = list(executor.map(self._opt_func, xs))
+        else:
+            rets = [self._opt_func(x) for x in xs]
+
+        return self._collect_batch(
+            x_maps, rets, np.zeros(len(x_maps), dtype=bool))
+
+    def _collect_batch(self, x_maps, rets, is_failed):
+        """Stack the results of a batch of evaluations.
+
+        :param list x_maps: x_map of each point.
+        :param list rets: (f_eval, g_eval) of each point. Ignored for
+            failed points.
+        :param numpy.ndarray is_failed: failure indicators.
+        """
+        n_points = len(x_maps)
+        n_cons = len(self.e_constraints) + len(self.i_constraints)
+        f = np.full((n_points, len(self.objectives)), math.inf)
+        g = np.full((n_points, n_cons), math.inf)
+        for i, (x_map, ret) in enumerate(zip(x_maps, rets)):
+            self._nfeval += 1
+            if not is_failed[i]:
+                f[i], g[i] = self._normalize(*ret)
+
+            self._report_eval(f[i], g[i], is_failed[i], x_map)
+
+        return f, g, is_failed
+
+    def _report_eval(self, f, g, is_failed, x_map=None):
+        """Report the result of an evaluation.
 
-        text = self._get_eval_info(f, g, False)
+        It is shared by the sequential and the batched evaluations.
+        """
+        text = self._get_eval_info(f, g, is_failed, x_map)
         opt_logger.info(text)
         print(text)
 
-        return f, g, False
-
-    def _get_eval_info(self, f, g, is_failed):
+    def _get_eval_info(self, f, g, is_failed, x_map=None):
         """Optimization result after each step."""
         text = '{:05d} - '.format(self._nfeval)
         text += "obj(s): "
         for v in f:
             text += '{:11.4e}, '.format(v)
-        if g:
+        if len(g) > 0:
             text += "con(s): "
         for v in g:
             text += '{:11.4e}, '.format(v)
         text += "var(s): "
-        for value in self._x_map.values():
+        if x_map is None:
+            x_map = self._x_map
+        for value in x_map.values():
             text += '{:11.4e}, '.format(value)
-        text += "Failed" if is_failed is True else "Succeeded"
+        text += "Failed" if is_failed else "Succeeded"
         return text
 
     def solve(self, optimizer, *args, **kwargs):
@@ -304,6 +402,10 @@ class Optimization(object):
 
 class LinacOptimization(Optimization):
     """Inherited from Optimization."""
+    # Simulations run in the shared working directory of the linac if
+    # the problem is evaluated in other processes.
+    use_executor = False
+
     def __init__(self, linac, *, max_nf=20, **kwargs):
         """Initialization.
 
@@ -366,16 +468,7 @@ class LinacOptimization(Optimization):
             for item in chain(self.objectives.values(),
                               self.e_constraints.values(),
                               self.i_constraints.values()):
-                if item.func is not None:
-                    item.value = item.func(self._linac)
-                else:
-                    bl, src, ppt = item.expr
-                    if src in ('max', 'min', 'start', 'end', 'ave', 'std'):
-                        item.value = self._linac[bl].__getattribute__(
-                            src).__getattribute__(ppt) * item.scale
-                    else:
-                        beam_params = getattr(self._linac[bl], src)
-                        item.value = getattr(beam_params, ppt) * item.scale
+                item.value = self._eval_item(item, self._linac)
 
             f = [obj.value for obj in self.objectives.values()]
             g = [con.value for con in chain(self.e_constraints.values(),
@@ -393,8 +486,105 @@ class LinacOptimization(Optimization):
                      .format(self._nfeval, dt, dt_cpu))
 
         # optimization result after each step
-        text = self._get_eval_info(f, g, is_update_failed)
+        self._report_eval(f, g, is_update_failed)
+
+        return f, g, is_update_failed
+
+    def _report_eval(self, f, g, is_failed, x_map=None):
+        """Override."""
+        text = self._get_eval_info(f, g, is_failed, x_map)
         logger.info(text)
         opt_logger.info(text)
 
-        return f, g, is_update_failed
+    @staticmethod
+    def _eval_item(item, linac):
+        """Evaluate an objective or a constraint.
+
+        :param EvaluatedElement item: objective or constraint.
+        :param Mapping linac: Linac or LinacResult.
+        """
+        if item.func is not None:
+            return item.func(linac)
+
+        bl, src, ppt = item.expr
+        if src in ('max', 'min', 'start', 'end', 'ave', 'std'):
+            return linac[bl].__getattribute__(
+                src).__getattribute__(ppt) * item.scale
+        beam_params = getattr(linac[bl], src)
+        return getattr(beam_params, ppt) * item.scale
+
+    def eval_objs_cons_batch(self, X, *, workers=1, executor=None,
+                             timeout=None):
+        """Batched objective-constraint function.
+
+        Override the method in the parent class.
+
+        The simulations of different points are run concurrently in
+        isolated scratch directories by Linac.async_evaluate().
+
+        :param int workers: maximum number of simulations running at
+            the same time.
+        :param executor: ignored. Simulations are run in subprocesses
+            already.
+        :param float timeout: Maximum allowed duration in seconds of
+            each simulation.
+        """
+        x_maps = [self._get_x_map(x) for x in X]
+
+        t0 = time.perf_counter()
+        loop = asyncio.get_event_loop()
+        results = loop.run_until_complete(
+            self._async_eval_batch(x_maps, workers, timeout=timeout))
+
+        rets = []
+        is_failed = np.zeros(len(x_maps), dtype=bool)
+        for i, (x_map, result) in enumerate(zip(x_maps, results)):
+            nfeval = self._nfeval + i + 1
+            try:
+                if isinstance(result, Exception):
+                    raise result
+                f_eval = [self._eval_item(item, result)
+                          for item in self.objectives.values()]
+                g_eval = [self._eval_item(item, result)
+                          for item in chain(self.e_constraints.values(),
+                                            self.i_constraints.values())]
+                rets.append((f_eval, g_eval))
+                self._nf = 0
+            except LisoRuntimeError as e:
+                self._nf += 1
+                is_failed[i] = True
+                rets.append(None)
+                logger.debug(f"{nfeval:05d}: " +
+                             repr(traceback.format_tb(e.__traceback__)) +
+                             str(e))
+                logger.warning(str(e))
+            except Exception as e:
+                self._nf += 1
+                logger.error(f"{nfeval:05d} (Unexpected exceptions): " +
+                             repr(traceback.format_tb(e.__traceback__)) +
+                             str(e))
+                raise
+
+        if self._nf > self._max_nf:
+            logger.info("Maximum allowed number of successive failures "
+                        "reached!")
+
+        logger.debug('{:05d}-{:05d}: elapsed time: {:.4f} s'.format(
+            self._nfeval + 1, self._nfeval + len(x_maps),
+            time.perf_counter() - t0))
+
+        return self._collect_batch(x_maps, rets, is_failed)
+
+    async def _async_eval_batch(self, x_maps, n_tasks, **kwargs):
+        """Run simulations for a batch of points.
+
+        :return list: LinacResult or the raised exception for each point.
+        """
+        semaphore = asyncio.Semaphore(n_tasks)
+
+        async def _run(x_map):
+            async with semaphore:
+                return await self._linac.async_evaluate(x_map, **kwargs)
+
+        return await asyncio.gather(*[_run(x_map) for x_map in x_maps],
+                                    return_exceptions=True)
@@ -0,0 +1,102 @@
+import unittest
+from unittest.mock import patch
+from concurrent.futures import ThreadPoolExecutor
+import math
+from types import SimpleNamespace
+
+import numpy as np
+
+from liso import ALPSO, Linac, LinacOptimization, Optimization
+from liso.exceptions import LisoRuntimeError
+
+
+def _opt_func(x):
+    return [x[0] ** 2 + x[1] ** 2 + x[2]], [x[0] + x[1], x[0] - x[2]]
+
+
+class TestOptimization(unittest.TestCase):
+    def setUp(self):
+        opt_prob = Optimization(opt_func=_opt_func)
+        opt_prob.add_obj('f')
+        opt_prob.add_var('x1', lb=-1, ub=1, value=0.5)
+        opt_prob.add_var('x2', lb=-1, ub=1, value=0.5)
+        opt_prob.add_covar('x3', 'x1', scale=2., shift=1.)
+        opt_prob.add_econ('g1', eq=1.)
+        opt_prob.add_icon('g2', ub=0.5)
+        self._opt_prob = opt_prob
+
+    def testEvalObjsConsBatch(self):
+        opt_prob = self._opt_prob
+        X = np.array([[0.1, 0.2], [-0.3, 0.4], [0.5, -0.6]])
+
+        with patch('builtins.print') as mocked_print:
+            f, g, is_failed = opt_prob.eval_objs_cons_batch(X)
+        # each evaluation is reported like in eval_objs_cons()
+        self.assertEqual(3, mocked_print.call_count)
+        self.assertTrue(mocked_print.call_args[0][0].startswith("00003 - obj(s): "))
+        self.assertTrue(mocked_print.call_args[0][0].endswith("Succeeded"))
+        self.assertEqual((3, 1), f.shape)
+        self.assertEqual((3, 2), g.shape)
+        np.testing.assert_array_equal([False] * 3, is_failed)
+        self.assertEqual(3, opt_prob._nfeval)
+        # variables are not modified
+        self.assertEqual(0.5, opt_prob.variables['x1'].value)
+        self.assertListEqual([0.5, 0.5, 2.], list(opt_prob._x_map.values()))
+
+        for i, x in enumerate(X):
+            f_gt, g_gt, _ = opt_prob.eval_objs_cons(x)
+            np.testing.assert_array_almost_equal(f_gt, f[i])
+            np.testing.assert_array_almost_equal(g_gt, g[i])
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            f_exec, g_exec, _ = opt_prob.eval_objs_cons_batch(
+                X, executor=executor)
+        np.testing.assert_array_equal(f, f_exec)
+        np.testing.assert_array_equal(g, g_exec)
+
+        f_mp, g_mp, _ = opt_prob.eval_objs_cons_batch(X, workers=2)
+        np.testing.assert_array_equal(f, f_mp)
+        np.testing.assert_array_equal(g, g_mp)
+
+
+class TestLinacOptimization(unittest.TestCase):
+    def setUp(self):
+        linac = Linac()
+        opt_prob = LinacOptimization(linac)
+        opt_prob.add_obj('f', expr='gun.out.Sx', scale=2.)
+        opt_prob.add_icon('g', func=lambda a: a['gun'].out.emitx, ub=1.)
+        opt_prob.add_var('gun/x1', lb=-1, ub=1)
+        self._opt_prob = opt_prob
+
+    def testEvalObjsConsBatch(self):
+        opt_prob = self._opt_prob
+        X = np.array([[0.1], [0.2], [0.3]])
+
+        async def _async_evaluate(mapping, **kwargs):
+            x = mapping['gun/x1']
+            if x == 0.2:
+                raise LisoRuntimeError("Output file does not exist!")
+            return {'gun': SimpleNamespace(out=SimpleNamespace(Sx=x, emitx=10 * x))}
+
+        with patch.object(opt_prob._linac, 'async_evaluate',
+                          side_effect=_async_evaluate) as mocked_async_evaluate:
+            f, g, is_failed = opt_prob.eval_objs_cons_batch(X, workers=2)
+            self.assertEqual(3, mocked_async_evaluate.call_count)
+
+        np.testing.assert_array_almost_equal([[0.2], [math.inf], [0.6]], f)
+        np.testing.assert_array_almost_equal([[0.], [math.inf], [2.]], g)
+        np.testing.assert_array_equal([False, True, False], is_failed)
+        self.assertEqual(3, opt_prob._nfeval)
+
+    def testOpenExecutor(self):
+        optimizer = ALPSO()
+        optimizer.workers = 2
+        # the simulations are not run in a process pool
+        with patch('liso.optimizers.optimizer.ProcessPoolExecutor') as mocked_pool:
+            with optimizer._open_executor(self._opt_prob) as executor:
+                self.assertIsNone(executor)
+            mocked_pool.assert_not_called()
+
+            with optimizer._open_executor(Optimization(opt_func=_opt_func)) as executor:
+                self.assertIsNotNone(executor)
+            mocked_pool.assert_called_once_with(max_workers=2)
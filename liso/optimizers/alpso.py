@@ -113,8 +113,11 @@ def alpso(x0,
     :param rho_min: float
         Minimum search radius (GCPSO).
     :param f_obj_con: function object.
-        Take the normalized input parameters and output a tuple of
-        (objective, constraints).
+        Take the normalized positions of all the particles, which has the
+        shape (swarm_size, num_vars), and output a tuple of (objectives,
+        constraints) with the shapes (swarm_size,) and (swarm_size, n_cons)
+        respectively. Since the whole swarm is passed in one call, the
+        particles can be evaluated in parallel.
 
     :return:
     """
@@ -161,9 +164,9 @@ def alpso(x0,
     f = np.ones(swarm_size, float) * math.inf  # objective
     L = np.ones(swarm_size, float) * math.inf  # Lagrangian function
     g = np.ones([swarm_size, n_cons], float) * math.inf  # Constraint
+    f[:], g[:, :] = f_obj_con(x_k)
+    nfeval += swarm_size
     for i in range(swarm_size):
-        f[i], g[i, :] = f_obj_con(x_k[i, :])
-        nfeval += 1
         L[i] = f[i]
         for j in range(n_cons):
             # Equality Constraints
@@ -256,10 +259,8 @@ def alpso(x0,
                 v_k[i, x_k[i, :] == 0] = 0
 
             # update Lagrangian function values
-            # TODO: parallelize this loop
-            for i in range(swarm_size):
-                f[i], g[i, :] = f_obj_con(x_k[i, :])
-                nfeval += 1
+            f[:], g[:, :] = f_obj_con(x_k)
+            nfeval += swarm_size
 
             # update Lagrangian, particle best and global best
             for i in range(swarm_size):
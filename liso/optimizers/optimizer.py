@@ -6,6 +6,8 @@ The full license is in the file LICENSE, distributed with this software.
 Copyright (C) Jun Zhu. All rights reserved.
 """
 from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 import time
 
 
@@ -15,6 +17,14 @@ class Optimizer(ABC):
     Attributes:
         name (str): Name of the optimizer.
         seed (int): Seed for random number. Default = None.
+        executor (concurrent.futures.Executor/None): Executor used to
+            evaluate a batch of points in parallel, e.g. an
+            mpi4py.futures.MPIPoolExecutor. If None, a
+            ProcessPoolExecutor with 'workers' processes will be created
+            when 'workers' > 1. Only used by optimizers which support
+            multiprocessing and problems whose use_executor is True,
+            e.g. not LinacOptimization, which runs the simulations
+            concurrently by itself. Default = None.
     """
     category = None  # should be either 'global' or 'local'.
     name = None
@@ -27,6 +37,8 @@ class Optimizer(ABC):
         self._workers = None
         self.workers = 1
 
+        self.executor = None
+
     @property
     def workers(self):
         return self._workers
@@ -41,6 +53,27 @@ class Optimizer(ABC):
         else:
             raise ValueError("Invalid input {} for 'workers'!".format(value))
 
+    @contextmanager
+    def _open_executor(self, opt_prob):
+        """Open the executor used to evaluate a batch of points.
+
+        The user-provided executor is not shut down on exit.
+
+        :param Optimization opt_prob: optimization problem.
+
+        :return: None if points should be evaluated serially or the
+            problem evaluates the points concurrently by itself.
+        """
+        if not opt_prob.use_executor:
+            yield None
+        elif self.executor is not None:
+            yield self.executor
+        elif self._workers > 1:
+            with ProcessPoolExecutor(max_workers=self._workers) as executor:
+                yield executor
+        else:
+            yield None
+
     @abstractmethod
     def __call__(self, opt_problem):
         """Run Optimizer (Calling Routine)
@@ -44,7 +44,7 @@ class ALPSO(Optimizer):
     """
     category = 'global'
     name = 'ALPSO'
-    multiprocessing = False
+    multiprocessing = True
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -95,12 +95,6 @@ class ALPSO(Optimizer):
             x_min[i] = opt_prob.variables[key].lb
             x_max[i] = opt_prob.variables[key].ub
 
-        def f_obj_con(x):
-            f, g, _ = opt_prob.eval_objs_cons(x*(x_max - x_min) + x_min)
-            return f[0], g
-
-        # =====================================================================
-
         # Constraints
         n_eq_cons = len(opt_prob.e_constraints)
         n_cons = n_eq_cons + len(opt_prob.i_constraints)
@@ -113,31 +107,39 @@ class ALPSO(Optimizer):
         v0 = np.zeros([self.swarm_size, n_vars], float)
 
         t0 = time.perf_counter()
-        opt_x, opt_f, k_out, nfeval, stop_info = \
-            alpso(x0,
-                  v0,
-                  n_cons,
-                  n_eq_cons,
-                  self.topology,
-                  self.max_outer_iter,
-                  self.max_inner_iter,
-                  self.min_inner_iter,
-                  self.etol,
-                  self.itol,
-                  self.rtol,
-                  self.atol,
-                  self.dtol,
-                  self.c1,
-                  self.c2,
-                  self.w0,
-                  self.w1,
-                  self.use_gcpso,
-                  self._nf,
-                  self._ns,
-                  self._rho_max,
-                  self._rho_min,
-                  f_obj_con
-                  )
+        with self._open_executor(opt_prob) as executor:
+
+            def f_obj_con(x):
+                x = x * (x_max - x_min) + x_min
+                f, g, _ = opt_prob.eval_objs_cons_batch(
+                    x, workers=self._workers, executor=executor)
+                return f[:, 0], g
+
+            opt_x, opt_f, k_out, nfeval, stop_info = \
+                alpso(x0,
+                      v0,
+                      n_cons,
+                      n_eq_cons,
+                      self.topology,
+                      self.max_outer_iter,
+                      self.max_inner_iter,
+                      self.min_inner_iter,
+                      self.etol,
+                      self.itol,
+                      self.rtol,
+                      self.atol,
+                      self.dtol,
+                      self.c1,
+                      self.c2,
+                      self.w0,
+                      self.w1,
+                      self.use_gcpso,
+                      self._nf,
+                      self._ns,
+                      self._rho_max,
+                      self._rho_min,
+                      f_obj_con
+                      )
         opt_x[:] = opt_x*(x_max - x_min) + x_min
         delta_t = time.perf_counter() - t0
 
@@ -92,6 +92,32 @@ class TestALPSO(unittest.TestCase):
     def test_tp43(self):
         self._setup_test(TP43, ret_dtol=0.10)
 
+    def test_parallel_evaluation(self):
+        def solve(workers):
+            optimizer = ALPSO(seed=42)
+            optimizer.swarm_size = 20
+            optimizer.max_outer_iter = 5
+            optimizer.workers = workers
+
+            opt_prob = Optimization(name=TP14.name, opt_func=TP14())
+            opt_prob.add_obj('f')
+            for i in range(len(TP14.x_min)):
+                opt_prob.add_var('x' + str(i + 1),
+                                 lb=TP14.x_min[i], ub=TP14.x_max[i])
+            opt_prob.add_econ('g1')
+            opt_prob.add_icon('g2')
+            return opt_prob.solve(optimizer)
+
+        opt_f_serial, opt_x_serial = solve(1)
+        # the swarm is evaluated in particle order and thus the result
+        # must be identical
+        opt_f, opt_x = solve(2)
+        self.assertEqual(opt_f_serial, opt_f)
+        np.testing.assert_array_equal(opt_x_serial, opt_x)
+
+        with self.assertRaisesRegex(ValueError, "Invalid input"):
+            self.optimizer.workers = 0
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,8 +1,8 @@
 from .line_analysis import analyze_line
 from .phasespace import Phasespace
 from .phasespace_analysis import (
-    compute_canonical_emit, compute_current_profile,
-    compute_twiss, phasespace_density, mesh_phasespace
+    compute_binned_moments, compute_canonical_emit, compute_current_profile,
+    compute_moments, compute_twiss, phasespace_density, mesh_phasespace
 )
 from .phasespace_parser import (
     parse_astra_phasespace, parse_impactt_phasespace, parse_elegant_phasespace,
@@ -18,8 +18,10 @@ __all__ = [
     # phasespace
     'Phasespace',
     # phasespace analysis
+    'compute_binned_moments',
     'compute_canonical_emit',
     'compute_current_profile',
+    'compute_moments',
     'compute_twiss',
     'phasespace_density',
     'mesh_phasespace',
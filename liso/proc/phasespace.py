@@ -7,71 +7,133 @@ Copyright (C) Jun Zhu. All rights reserved.
 """
 import numpy as np
 import pandas as pd
+from scipy import constants
 
 from .beam_parameters import BeamParameters
+from .slice_parameters import SliceParameters
 from .phasespace_analysis import (
-    compute_canonical_emit, compute_twiss, compute_current_profile,
+    compute_binned_moments, compute_current_profile, compute_moments,
     gaussian_filter1d
 )
 from ..exceptions import LisoRuntimeError
 
 
+# columns of the augmented phasespace used for computing moments
+_X, _PX, _Y, _PY, _Z, _PZ, _T, _P, _XP, _YP, _X_TR, _Y_TR = range(12)
+
+
+def _augment(data, z_ave):
+    """Append p, xp, yp and the back-tracked x and y to the phasespace.
+
+    :param numpy.ndarray data: phasespace data with shape (n, 7).
+    :param float z_ave: longitudinal centroid of the bunch.
+    """
+    x, px, y, py, z, pz, _ = data.T
+    ret = np.empty((len(data), 12), order='F')
+    ret[:, :7] = data
+    ret[:, _P] = np.sqrt(px ** 2 + py ** 2 + pz ** 2)
+    np.divide(px, pz, out=ret[:, _XP])
+    np.divide(py, pz, out=ret[:, _YP])
+    dz = z - z_ave
+    ret[:, _X_TR] = x - dz * ret[:, _XP]
+    ret[:, _Y_TR] = y - dz * ret[:, _YP]
+    return ret
+
+
+def _compute_emit(cov, i, j):
+    """Compute the emittance from the covariance matrix."""
+    return np.sqrt(cov[i, i] * cov[j, j] - cov[i, j] ** 2)
+
+
 class Phasespace:
+    """Phasespace of a bunch.
+
+    The data is stored in a single (n, 7) float64 array in the column
+    order of Phasespace.columns. The array is Fortran-ordered so that
+    each column is contiguous in memory.
+    """
 
     columns = ('x', 'px', 'y', 'py', 'z', 'pz', 't')
 
     def __init__(self, data, charge):
         """Initialization.
 
-        :param pandas.DataFrame data: phasespace data containing the
-            following entries which can be accessed via [] operator:
-            x (m), px (mc), y (m), py (mc), z (m), pz (mc), t (s)
+        :param pandas.DataFrame/numpy.ndarray data: phasespace data
+            containing the following entries which can be accessed via
+            [] operator: x (m), px (mc), y (m), py (mc), z (m), pz (mc),
+            t (s). If it is a numpy.ndarray, it must have the shape
+            (n, 7) and the columns must be in the above order.
         :param None/float charge: bunch charge
         """
-        if not isinstance(data, pd.DataFrame):
-            raise TypeError("data must be a pandas.DataFrame")
+        if isinstance(data, pd.DataFrame):
+            if set(data.columns) != set(self.columns):
+                raise ValueError(f"Data can only have columns: {self.columns}: "
+                                 f"actual {data.columns}")
+
+            self._data = np.empty((len(data), len(self.columns)),
+                                  dtype=np.float64, order='F')
+            for i, col in enumerate(self.columns):
+                self._data[:, i] = data[col]
+            self._index = data.index
+        elif isinstance(data, np.ndarray):
+            if data.ndim != 2 or data.shape[1] != len(self.columns):
+                raise ValueError(f"Data must have the shape (n, "
+                                 f"{len(self.columns)}): actual {data.shape}")
+
+            self._data = np.asfortranarray(data, dtype=np.float64)
+            self._index = pd.RangeIndex(len(data))
+        else:
+            raise TypeError("data must be a pandas.DataFrame or a "
+                            "numpy.ndarray")
 
-        if set(data.columns) != set(self.columns):
-            raise ValueError(f"Data can only have columns: {self.columns}: "
-                             f"actual {data.columns}")
-
-        self._data = data
         self.charge = charge
 
-    def __getitem__(self, item):
-        try:
-            return self._data[item]
-        except KeyError:
-            data = self._data
-
-            if item == 'dt':
-                return data['t'] - data['t'].mean()
-
-            if item == 'p':
-                return np.sqrt(data['px'] ** 2 + data['py'] ** 2 + data['pz'] ** 2)
+    def _column(self, item):
+        """Return the view of a column."""
+        return self._data[:, self.columns.index(item)]
 
-            if item == 'xp':
-                return data['px'] / data['pz']
-
-            if item == 'yp':
-                return data['py'] / data['pz']
+    def __getitem__(self, item):
+        if item in self.columns:
+            return pd.Series(self._column(item), index=self._index,
+                             name=item, copy=False)
+
+        x, px, y, py, z, pz, t = self._data.T
+
+        if item == 'dt':
+            v = t - t.mean()
+        elif item == 'p':
+            v = np.sqrt(px ** 2 + py ** 2 + pz ** 2)
+        elif item == 'xp':
+            v = px / pz
+        elif item == 'yp':
+            v = py / pz
+        elif item == 'dz':
+            v = z - z.mean()
+        elif item == 'delta':
+            p = np.sqrt(px ** 2 + py ** 2 + pz ** 2)
+            v = 100. * (p - p.mean()) / p
+        else:
+            raise KeyError(item)
+
+        return pd.Series(v, index=self._index, name=item, copy=False)
 
-            if item == 'dz':
-                z_ave = data['z'].mean()
-                return data['z'] - z_ave
+    def __len__(self):
+        return self._data.shape[0]
 
-            if item == 'delta':
-                p = np.sqrt(data['px'] ** 2 + data['py'] ** 2 + data['pz'] ** 2)
-                p_ave = p.mean()
-                return 100. * (p - p_ave) / p
+    def to_numpy(self):
+        """Return the (n, 7) phasespace array without copying."""
+        return self._data
 
-            raise
+    def to_pandas(self):
+        """Return the phasespace as a pandas.DataFrame.
 
-    def __len__(self):
-        return self._data.__len__()
+        The data is not copied.
+        """
+        return pd.DataFrame(self._data, index=self._index,
+                            columns=list(self.columns), copy=False)
 
     def reindex(self, *args, **kwargs):
-        self._data.reindex(*args, **kwargs)
+        return self.to_pandas().reindex(*args, **kwargs)
 
     def slice(self, start=None, stop=None, step=None, *, inplace=False):
         """Slice the phasespace.
@@ -86,15 +148,38 @@ class Phasespace:
 
         :return Phasespace: the sliced phasespace instance.
         """
-        slicer = slice(start, stop, step)
-        sliced = self._data[slicer]
+        return self._take(slice(start, stop, step), inplace=inplace)
+
+    def _take(self, indices, *, inplace):
+        """Select particles by a slice or an array of indices."""
+        n0 = len(self)
+        if isinstance(indices, slice):
+            data = self._data[indices]
+        else:
+            # keep the columns contiguous
+            data = np.empty((len(indices), self._data.shape[1]),
+                            dtype=np.float64, order='F')
+            for i in range(data.shape[1]):
+                data[:, i] = self._data[indices, i]
+        index = self._index[indices]
+        charge = self.charge * len(data) / n0
 
         if inplace:
-            self.charge *= len(sliced) / len(self._data)
-            self._data = sliced
-            return self
-
-        return Phasespace(sliced, self.charge * len(sliced) / len(self._data))
+            ps = self
+        else:
+            ps = Phasespace.__new__(Phasespace)
+        ps._data = data
+        ps._index = index
+        ps.charge = charge
+        return ps
+
+    def _take_smallest(self, v, n):
+        """Keep the n particles with the smallest values of v.
+
+        The order of the kept particles is preserved.
+        """
+        indices = np.sort(np.argpartition(v, n - 1)[:n])
+        self._take(indices, inplace=True)
 
     def cut_halo(self, percent):
         """Remove halo from the phasespace.
@@ -103,12 +188,10 @@ class Phasespace:
             their transverse distance to the bunch centroid.
         """
         if 1.0 > percent > 0.0:
-            data = self._data
-            n = int(len(data) * (1 - percent))
-            data['r'] = np.sqrt(data['x'] ** 2 + data['y'] ** 2)
-            data = data.reindex(data['r'].sort_values(ascending=True).index)
-            del data['r']
-            self.slice(None, n, inplace=True)
+            n = int(len(self) * (1 - percent))
+            x = self._column('x')
+            y = self._column('y')
+            self._take_smallest(np.sqrt(x ** 2 + y ** 2), n)
 
     def cut_tail(self, percent):
         """Remove tail from the phasespace.
@@ -117,14 +200,10 @@ class Phasespace:
             in the tail.
         """
         if 1.0 > percent > 0.0:
-            data = self._data
-            n = int(len(data) * (1 - percent))
+            n = int(len(self) * (1 - percent))
+            t = self._column('t')
             # User median() to deal with extreme outliers
-            data['t_'] = data['t'] - data['t'].median()
-            data = data.reindex(
-                data['t_'].abs().sort_values(ascending=True).index)
-            del data['t_']
-            self.slice(None, n, inplace=True)
+            self._take_smallest(np.abs(t - np.median(t)), n)
 
     def rotate(self, angle):
         """Rotate the phasespace.
@@ -134,34 +213,22 @@ class Phasespace:
         if angle != 0.0:
             theta = angle * np.pi / 180.0  # Convert to rad
 
-            # x(m), px(mc), y(m), py(mc), t(s), p(mc), z(m).
-
             cos_theta = np.cos(theta)
             sin_theta = np.sin(theta)
 
-            def transformation(r, cm):
-                x = r[0]
-                y = r[1]
-                z = r[2]
-                cx = cm[0]
-                cy = cm[1]
-                cz = cm[2]
-
-                x_new = cx - cx*cos_theta + x*cos_theta - cz*sin_theta + z*sin_theta
-                y_new = y
-                z_new = cz - cz*cos_theta + z*cos_theta + cx*sin_theta - x*sin_theta
-
-                return [x_new, y_new, z_new]
+            # copy to avoid modifying the phasespace it was sliced from
+            data = np.array(self._data, order='F')
+            for ix, iz in ((0, 4), (1, 5)):
+                x = self._data[:, ix]
+                z = self._data[:, iz]
+                cx = x.mean()
+                cz = z.mean()
 
-            data = self._data
-            pos = [data['x'], data['y'], data['z']]
-            cm_pos = [np.mean(data['x']), np.mean(data['y']), np.mean(data['z'])]
-            mom = [data['px'], data['py'], data['pz']]
-            cm_mom = [np.mean(data['px']), np.mean(data['py']),
-                      np.mean(data['pz'])]
-
-            [data['x'], data['y'], data['z']] = transformation(pos, cm_pos)
-            [data['px'], data['py'], data['pz']] = transformation(mom, cm_mom)
+                data[:, ix] = cx - cx*cos_theta + x*cos_theta \
+                    - cz*sin_theta + z*sin_theta
+                data[:, iz] = cz - cz*cos_theta + z*cos_theta \
+                    + cx*sin_theta - x*sin_theta
+            self._data = data
 
     def analyze(self, *,
                 current_bins='auto',
@@ -187,10 +254,9 @@ class Phasespace:
         """
         charge = 0 if self.charge is None else self.charge
 
-        data = self._data
         params = BeamParameters()
 
-        n0 = len(data)
+        n0 = len(self)
         params.n = n0  # Number of particles after processing
         params.q = charge / n0  # charge per particle
 
@@ -199,44 +265,54 @@ class Phasespace:
         if n0 < min_particles:
             raise LisoRuntimeError(f"Too few particles {n0} in the phasespace")
 
-        p = np.sqrt(data['pz'] ** 2 + data['px'] ** 2 + data['py'] ** 2)
+        t = self._column('t')
+        z_ave = self._column('z').mean()
+
+        def augment(chunk):
+            return _augment(chunk, z_ave)
 
-        p_ave = p.mean()
-        dp = (p - p_ave) / p_ave
-        dz = data['z'] - data['z'].mean()
+        mean, cov = compute_moments(self._data, transform=augment)
 
+        p_ave = mean[_P]
         params.p = p_ave
         params.gamma = np.sqrt(p_ave ** 2 + 1)
-        params.chirp = -1 * dp.cov(dz) / dz.var(ddof=0)
-        params.Sdelta = p.std(ddof=0) / p_ave
-        params.St = data['t'].std(ddof=0)
-        params.Sz = data['z'].std(ddof=0)
+        # covariance of dp and dz with ddof=1 as pandas.Series.cov
+        params.chirp = -1 * cov[_P, _Z] / p_ave * n0 / (n0 - 1) / cov[_Z, _Z]
+        params.Sdelta = np.sqrt(cov[_P, _P]) / p_ave
+        params.St = np.sqrt(cov[_T, _T])
+        params.Sz = np.sqrt(cov[_Z, _Z])
 
         currents, centers = compute_current_profile(
-            data['t'], current_bins, params.charge)
+            t, current_bins, params.charge)
         params.I_peak = currents.max()
         params.current_dist = [centers, currents]
 
-        params.emitx = compute_canonical_emit(data['x'], data['px'])
-
-        params.Sx, params.betax, params.alphax, params.emitx_tr \
-            = compute_twiss(data['x'], dz, data['px'], data['pz'], params.gamma)
-
-        params.emity = compute_canonical_emit(data['y'], data['py'])
-
-        params.Sy, params.betay, params.alphay, params.emity_tr \
-            = compute_twiss(data['y'], dz, data['py'], data['pz'], params.gamma)
-
-        params.Cx = data['x'].mean()
-        params.Cy = data['y'].mean()
-        params.Cxp = (data['px'] / data['pz']).mean()
-        params.Cyp = (data['py'] / data['pz']).mean()
-        params.Ct = data['t'].mean()
+        # Note: In the calculation of the Twiss parameters, the particles
+        # are drifted back to the center of the bunch without considering
+        # the collective effects!!!
+        beta = np.sqrt(1 - 1 / params.gamma ** 2)
+
+        params.emitx = _compute_emit(cov, _X, _PX)
+        emitx = _compute_emit(cov, _X_TR, _XP)
+        params.emitx_tr = emitx * beta * params.gamma
+        params.Sx = np.sqrt(cov[_X_TR, _X_TR])
+        params.betax = cov[_X_TR, _X_TR] / emitx
+        params.alphax = -1 * cov[_X_TR, _XP] / emitx
+
+        params.emity = _compute_emit(cov, _Y, _PY)
+        emity = _compute_emit(cov, _Y_TR, _YP)
+        params.emity_tr = emity * beta * params.gamma
+        params.Sy = np.sqrt(cov[_Y_TR, _Y_TR])
+        params.betay = cov[_Y_TR, _Y_TR] / emity
+        params.alphay = -1 * cov[_Y_TR, _YP] / emity
+
+        params.Cx = mean[_X]
+        params.Cy = mean[_Y]
+        params.Cxp = mean[_XP]
+        params.Cyp = mean[_YP]
+        params.Ct = mean[_T]
 
         # Calculate the slice parameters
-        sorted_data = data.reindex(
-            data['t'].abs().sort_values(ascending=True).index)
-
         try:
             filtered_currents = gaussian_filter1d(currents, sigma=filter_size)
             if slice_with_peak_current and params.charge != 0.0:
@@ -247,37 +323,107 @@ class Phasespace:
 
             # assume 4-sigma full bunch length
             dt_slice = 4 * params.St * slice_percent
-            slice_data = sorted_data[(sorted_data.t > Ct_slice - dt_slice / 2) &
-                                     (sorted_data.t < Ct_slice + dt_slice / 2)]
+            mask = (t > Ct_slice - dt_slice / 2) & (t < Ct_slice + dt_slice / 2)
+            slice_data = self._data[mask]
 
             if len(slice_data) < min_particles:
                 raise LisoRuntimeError(
                     f"Too few particles {len(slice_data)} in the slice")
 
-            p_slice = np.sqrt(slice_data['pz'] ** 2
-                              + slice_data['px'] ** 2
-                              + slice_data['py'] ** 2)
+            mean, cov = compute_moments(slice_data, transform=augment)
 
-            params.emitx_slice = compute_canonical_emit(
-                slice_data.x, slice_data.px)
-            params.emity_slice = compute_canonical_emit(
-                slice_data.y, slice_data.py)
-            params.Sdelta_slice = p_slice.std(ddof=0) / p_slice.mean()
-            params.dt_slice = slice_data.t.max() - slice_data.t.min()
+            params.emitx_slice = _compute_emit(cov, _X, _PX)
+            params.emity_slice = _compute_emit(cov, _Y, _PY)
+            params.Sdelta_slice = np.sqrt(cov[_P, _P]) / mean[_P]
+            t_slice = slice_data[:, _T]
+            params.dt_slice = t_slice.max() - t_slice.min()
 
             # The output will be different from the output by msddsplot
             # because the slightly different No of particles sliced. It
             # affects the correlation calculation since the value is
             # already very close to 1.
-            params.Sdelta_un = \
-                params.Sdelta_slice \
-                * np.sqrt(1 - (slice_data['t'].corr(p_slice)) ** 2)
+            corr = cov[_T, _P] / np.sqrt(cov[_T, _T] * cov[_P, _P])
+            params.Sdelta_un = params.Sdelta_slice * np.sqrt(1 - corr ** 2)
 
         except Exception:
             pass
 
         return params
 
+    def analyze_slices(self, n_slices=100, *, by='t', bounds=None,
+                       min_particles=20):
+        """Calculate beam parameters of all the slices along the bunch.
+
+        The particles are binned into slices of equal width without
+        sorting. The Twiss parameters and the trace-space emittances of
+        the slices are calculated without back-tracking.
+
+        :param int n_slices: number of slices.
+        :param str by: coordinate along which the bunch is sliced, 't'
+            or 'z'.
+        :param None/tuple bounds: (lower, upper) bounds of the sliced
+            coordinate. Particles outside the bounds are ignored. Default
+            to the full range of the bunch.
+        :param int min_particles: minimum number of particles required for
+            the analysis of a slice. The parameters of slices with fewer
+            particles are NaN.
+
+        :return SliceParameters: slice parameters.
+        """
+        if by not in ('t', 'z'):
+            raise ValueError(f"Slicing by '{by}' is not supported!")
+        if n_slices < 1:
+            raise ValueError("n_slices must be a positive integer!")
+
+        v = self._column(by)
+        lb, ub = (v.min(), v.max()) if bounds is None else bounds
+        width = (ub - lb) / n_slices
+        if not width > 0:
+            raise LisoRuntimeError(f"Invalid slicing range: ({lb}, {ub})")
+
+        mask = (v >= lb) & (v <= ub)
+        bins = np.minimum(((v[mask] - lb) / width).astype(np.intp),
+                          n_slices - 1)
+
+        data = _augment(self._data[mask], self._column('z').mean())
+        counts, mean, cov = compute_binned_moments(
+            data[:, [_X, _PX, _Y, _PY, _P, _XP, _YP]], bins, n_slices)
+        # indices in the moments
+        x, px, y, py, p, xp, yp = range(7)
+
+        params = SliceParameters()
+        params.centers = lb + width * (np.arange(n_slices) + 0.5)
+        params.n = counts
+        charge = 0 if self.charge is None else self.charge
+        params.current = counts * (charge / len(self)) / width
+        if by == 'z':
+            params.current *= constants.c
+
+        mean[counts < min_particles] = np.nan
+        cov[counts < min_particles] = np.nan
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            params.p = mean[:, p]
+            params.Sdelta = np.sqrt(cov[:, p, p]) / params.p
+            params.Sx = np.sqrt(cov[:, x, x])
+            params.Sy = np.sqrt(cov[:, y, y])
+            params.emitx = np.sqrt(
+                cov[:, x, x] * cov[:, px, px] - cov[:, x, px] ** 2)
+            params.emity = np.sqrt(
+                cov[:, y, y] * cov[:, py, py] - cov[:, y, py] ** 2)
+
+            emitx = np.sqrt(cov[:, x, x] * cov[:, xp, xp] - cov[:, x, xp] ** 2)
+            emity = np.sqrt(cov[:, y, y] * cov[:, yp, yp] - cov[:, y, yp] ** 2)
+            # beta * gamma = p
+            params.emitx_tr = emitx * params.p
+            params.emity_tr = emity * params.p
+            params.betax = cov[:, x, x] / emitx
+            params.betay = cov[:, y, y] / emity
+            params.alphax = -1 * cov[:, x, xp] / emitx
+            params.alphay = -1 * cov[:, y, yp] / emity
+
+        return params
+
     @classmethod
     def from_columns(cls,
                      x=None, px=None,
@@ -12,8 +12,8 @@ from scipy.ndimage.filters import gaussian_filter
 def compute_canonical_emit(x, px):
     """ Calculate the canonical emittance.
 
-    :param pandas.Series x: position coordinates
-    :param pandas.Series px: momentum coordinates
+    :param numpy.ndarray x: position coordinates
+    :param numpy.ndarray px: momentum coordinates
 
     :return Normalized canonical emittance.
     """
@@ -33,10 +33,10 @@ def compute_twiss(x, dz, px, pz, gamma, backtracking=True):
     particles are drifted back to the center of the bunch without
     considering the collective effects!!!
 
-    :param pandas.Series x: position coordinates.
-    :param pandas.Series dz: longitudinal distance to the bunch centre.
-    :param pandas.Series px: momentum coordinates
-    :param pandas.Series pz: longitudinal momentum.
+    :param numpy.ndarray x: position coordinates.
+    :param numpy.ndarray dz: longitudinal distance to the bunch centre.
+    :param numpy.ndarray px: momentum coordinates
+    :param numpy.ndarray pz: longitudinal momentum.
     :param float gamma: average Lorentz factor of the bunch.
     :param bool backtracking: True for drifting the particles back to
         the longitudinal centroid of the bunch.
@@ -66,6 +66,84 @@ def compute_twiss(x, dz, px, pz, gamma, backtracking=True):
     return sigma_x, betax, alphax, emitnx
 
 
+def compute_moments(data, *, chunk_size=1 << 20, transform=None):
+    """Compute the first and the second central moments in one pass.
+
+    The data is processed in chunks to limit the memory usage. The
+    accumulation is shifted by the mean of the first chunk to avoid
+    catastrophic cancellation.
+
+    :param numpy.ndarray data: data with shape (n, k).
+    :param int chunk_size: number of rows processed at once.
+    :param callable transform: if given, each chunk is replaced by
+        transform(chunk) before the accumulation, which can be used to
+        append derived columns.
+
+    :return numpy.ndarray mean: mean of each column with shape (m,),
+        where m is the number of columns after the transformation.
+    :return numpy.ndarray cov: covariance matrix (ddof=0) with shape
+        (m, m).
+    """
+    n = data.shape[0]
+    shift = None
+    s1 = 0.
+    s2 = 0.
+    for i in range(0, n, chunk_size):
+        chunk = data[i:i + chunk_size]
+        if transform is not None:
+            chunk = transform(chunk)
+        if shift is None:
+            shift = chunk.mean(axis=0)
+        chunk = chunk - shift
+        s1 = s1 + chunk.sum(axis=0)
+        s2 = s2 + chunk.T @ chunk
+
+    d = s1 / n
+    return shift + d, s2 / n - np.outer(d, d)
+
+
+def compute_binned_moments(data, bins, n_bins):
+    """Compute the first and the second central moments in each bin.
+
+    Particles are not sorted. Instead, the sums are accumulated per bin
+    with numpy.bincount.
+
+    :param numpy.ndarray data: data with shape (n, k).
+    :param numpy.ndarray bins: bin index of each row with shape (n,).
+    :param int n_bins: number of bins.
+
+    :return numpy.ndarray counts: number of rows in each bin with shape
+        (n_bins,).
+    :return numpy.ndarray mean: mean of each column in each bin with
+        shape (n_bins, k). NaN for empty bins.
+    :return numpy.ndarray cov: covariance matrix (ddof=0) in each bin
+        with shape (n_bins, k, k). NaN for empty bins.
+    """
+    k = data.shape[1]
+    # shift by the global mean to reduce the cancellation error
+    shift = data.mean(axis=0)
+    data = data - shift
+
+    counts = np.bincount(bins, minlength=n_bins)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        inv = 1. / counts
+
+    mean = np.empty((n_bins, k))
+    for i in range(k):
+        mean[:, i] = np.bincount(bins, weights=data[:, i],
+                                 minlength=n_bins) * inv
+
+    cov = np.empty((n_bins, k, k))
+    for i in range(k):
+        for j in range(i, k):
+            cov[:, i, j] = np.bincount(
+                bins, weights=data[:, i] * data[:, j], minlength=n_bins) * inv
+            cov[:, i, j] -= mean[:, i] * mean[:, j]
+            cov[:, j, i] = cov[:, i, j]
+
+    return counts, mean + shift, cov
+
+
 def compute_current_profile(t, n_bins, charge):
     """Calculate the current profile.
 
@@ -12,6 +12,7 @@ pd.options.mode.chained_assignment = None
 
 from .phasespace import Phasespace
 from .proc_utils import check_data_file
+from ..exceptions import LisoRuntimeError
 
 
 V_LIGHT = constants.c
@@ -23,39 +24,63 @@ MC2_E = constants.m_e * constants.c**2 / constants.e
 #    ELEGANT: relative z, absolute t
 
 
+def _read_columns(particle_file, n_cols):
+    """Read a space-separated particle file into a 2D array.
+
+    Fields are split on single spaces with the leading spaces skipped,
+    which is considerably faster than the regex-like whitespace
+    delimiter. Missing values are filled with NaN and redundant fields
+    are ignored.
+
+    The C parser of pandas is also several times faster than the
+    fixed-format readers numpy.fromfile and numpy.loadtxt (see
+    benchmarks/benchmark_phasespace_parser.py).
+
+    :param string particle_file: pathname of the particle file.
+    :param int n_cols: number of columns.
+
+    :return numpy.ndarray: data with shape (n, n_cols).
+    """
+    try:
+        return pd.read_csv(particle_file,
+                           sep=' ',
+                           skipinitialspace=True,
+                           header=None,
+                           names=range(n_cols),
+                           index_col=False,
+                           dtype=np.float64,
+                           engine='c').to_numpy()
+    except ValueError as e:
+        raise LisoRuntimeError(
+            f"{particle_file} does not have {n_cols} numeric columns: "
+            f"{repr(e)}")
+
+
 def parse_astra_phasespace(particle_file, *, cathode=False):
     """Parse the ASTRA particle file.
 
     :param string particle_file: pathname of the particle file.
     :param bool cathode: True for a particle file for the cathode.
 
-    :return pandas.DataFrame data: phase-space data.
-    :return float charge: charge (C) of the bunch.
+    :return Phasespace: phasespace with the charge (C) of the bunch.
     """
     # Units: m, m, m, eV/c, eV/c, eV/c, ns, nC, NA, NA
-    col_names = ['x', 'y', 'z', 'px', 'py', 'pz',
-                 't', 'charge', 'index', 'flag']
+    x, y, z, px, py, pz, t, q, _, flag = range(10)
 
     check_data_file(particle_file)
 
-    data = pd.read_csv(particle_file, delim_whitespace=True, names=col_names)
-
-    pz_ref = data['pz'].iloc[0]
-    data.loc[0, 'pz'] = 0.0
-    data['pz'] += pz_ref
-
-    data['px'] /= MC2_E
-    data['py'] /= MC2_E
-    data['pz'] /= MC2_E
+    raw = _read_columns(particle_file, 10)
+    if np.isnan(raw).any():
+        raise LisoRuntimeError(
+            f"{particle_file} does not have 10 numeric columns!")
 
-    # ix will first try to act like loc to find the index label.
-    # If the index label is not found, it will add an index label
-    # (new row). Therefore, the reference particle must be used
-    # before removing lost particles since the reference particle
-    # could be removed.
-    z_ref = data['z'].iloc[0]
-    data.loc[0, 'z'] = 0.0
-    data['z'] += z_ref
+    # The first particle is the reference particle. The longitudinal
+    # position and momentum of the others are relative to it. Therefore,
+    # the reference particle must be used before removing lost particles
+    # since it could be removed.
+    z_ref = raw[0, z]
+    pz_ref = raw[0, pz]
+    t_ref = raw[0, t] * 1.e-9
 
     # remove lost particles
     #   -1: standard particle at the cathode (not yet started)
@@ -63,21 +88,32 @@ def parse_astra_phasespace(particle_file, *, cathode=False):
     #    3: trajectory probe particle
     #    5: standard particle
     flags = (-1, -3) if cathode else (3, 5)
-    data = data[data['flag'].isin(flags)]
-
-    p = np.sqrt(data['px'] ** 2 + data['py'] ** 2 + data['pz'] ** 2)
+    kept = np.isin(raw[:, flag], flags)
+    is_ref_kept = kept[0]
+    raw = raw[kept]
+
+    data = np.empty((len(raw), 7), order='F')
+    data[:, 0] = raw[:, x]
+    data[:, 1] = raw[:, px] / MC2_E
+    data[:, 2] = raw[:, y]
+    data[:, 3] = raw[:, py] / MC2_E
+    data[:, 4] = raw[:, z] + z_ref
+    data[:, 5] = (raw[:, pz] + pz_ref) / MC2_E
+    if is_ref_kept:
+        data[0, 4] = z_ref
+        data[0, 5] = pz_ref / MC2_E
 
     # At this step, the timing can be used for timing parameter_scan study.
-    t_ref = data['t'].iloc[0] * 1.e-9
     if not cathode:
-        data['t'] = t_ref - (data['z'] - z_ref) \
-                    / (V_LIGHT * data['pz'] / np.sqrt(p ** 2 + 1))
+        p = np.sqrt(data[:, 1] ** 2 + data[:, 3] ** 2 + data[:, 5] ** 2)
+        data[:, 6] = t_ref - (data[:, 4] - z_ref) \
+            / (V_LIGHT * data[:, 5] / np.sqrt(p ** 2 + 1))
     else:
-        data['t'][1:] = data['t'][1:] * 1.e-9 + t_ref
-
-    charge = -1e-9 * data['charge'].sum()
+        data[:, 6] = raw[:, t] * 1.e-9 + t_ref
+        if is_ref_kept:
+            data[0, 6] = t_ref
 
-    data.drop(['charge', 'index', 'flag'], inplace=True, axis=1)
+    charge = -1e-9 * raw[:, q].sum()
 
     return Phasespace(data, charge)
 
@@ -87,23 +123,27 @@ def parse_impactt_phasespace(particle_file):
 
     :param string particle_file: pathname of the particle file.
 
-    :return pandas.DataFrame data: phase-space data.
-    :return None charge: Impact-T particle file does not contain charge
-        information.
+    :return Phasespace: phasespace. Impact-T particle file does not
+        contain charge information.
     """
     # Units: m, /mc, m, /mc, m, /mc
-    col_names = ['x', 'px', 'y', 'py', 'z', 'pz']
+    check_data_file(particle_file)
 
-    data = pd.read_csv(particle_file, delim_whitespace=True, names=col_names)
+    raw = _read_columns(particle_file, 6)
+    # The first line of the input file 'partcl.data' is the number of
+    # particles.
+    if len(raw) > 0 and np.isnan(raw[0, 1]):
+        raw = raw[1:]
 
-    # Drop the first row if the input file is 'partcl.data'.
-    data.dropna(inplace=True)
+    data = np.empty((len(raw), 7), order='F')
+    data[:, :6] = raw
 
-    p = np.sqrt(data['px'] ** 2 + data['py'] ** 2 + data['pz'] ** 2)
+    pz = data[:, 5]
+    p = np.sqrt(data[:, 1] ** 2 + data[:, 3] ** 2 + pz ** 2)
 
     # Impact-T does not support timing, here 't' is the relative number
-    data['t'] = (data['z'].mean() - data['z']) / \
-                (V_LIGHT * data['pz'] / np.sqrt(p ** 2 + 1))
+    z = data[:, 4]
+    data[:, 6] = (z.mean() - z) / (V_LIGHT * pz / np.sqrt(p ** 2 + 1))
 
     return Phasespace(data, None)
 
@@ -0,0 +1,32 @@
+"""
+Distributed under the terms of the GNU General Public License v3.0.
+
+The full license is in the file LICENSE, distributed with this software.
+
+Copyright (C) Jun Zhu. All rights reserved.
+"""
+
+
+class SliceParameters(object):
+    """Store beam parameters of all the slices along the bunch.
+
+    Each attribute is a numpy.ndarray with one entry per slice. The
+    parameters of slices with too few particles are NaN.
+    """
+    def __init__(self):
+        """Initialization."""
+        self.centers = None  # slice centers (s or m)
+        self.n = None  # number of particles
+        self.current = None  # current (A)
+        self.p = None  # average momentum (mc)
+        self.Sdelta = None  # rms relative momentum spread
+        self.Sx = None  # rms bunch sizes (m)
+        self.Sy = None  # rms bunch sizes (m)
+        self.emitx = None  # normalized canonical emittance (m.rad)
+        self.emity = None  # normalized canonical emittance (m.rad)
+        self.emitx_tr = None  # normalized trace-space emittance (m.rad)
+        self.emity_tr = None  # normalized trace-space emittance (m.rad)
+        self.betax = None  # beta functions (m)
+        self.betay = None  # beta functions (m)
+        self.alphax = None  # alpha functions
+        self.alphay = None  # alpha functions
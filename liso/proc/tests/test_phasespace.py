@@ -1,11 +1,12 @@
 import unittest
 import os.path as osp
+import tempfile
 
 import pandas as pd
 import numpy as np
 
 from liso import (
-    Phasespace,
+    Phasespace, compute_canonical_emit, compute_current_profile,
     parse_astra_phasespace, parse_impactt_phasespace, parse_elegant_phasespace,
 )
 from liso.exceptions import LisoRuntimeError
@@ -32,6 +33,27 @@ class TestPhasespaceAstra(unittest.TestCase):
         with self.assertRaises(ValueError):
             Phasespace(pd.DataFrame(columns=['x', 'y', 'px', 'py']), 1.0)
 
+        with self.assertRaises(ValueError):
+            Phasespace(np.ones((10, 6)), 1.0)
+
+    def testConstructFromArray(self):
+        ps = Phasespace(self.data.to_pandas().values, self.data.charge)
+        self.assertEqual(500, len(ps))
+        self.assertTrue(ps.to_numpy().flags['F_CONTIGUOUS'])
+        for col in ps.columns:
+            np.testing.assert_array_equal(ps[col], self.data[col])
+
+        params = ps.analyze()
+        params_gt = self.data.analyze()
+        for attr in ['emitx', 'Sx', 'betax', 'I_peak', 'emitx_slice']:
+            self.assertAlmostEqual(getattr(params_gt, attr), getattr(params, attr))
+
+    def testPandasView(self):
+        df = self.data.to_pandas()
+        self.assertListEqual(list(self.data.columns), list(df.columns))
+        self.assertTrue(np.shares_memory(df['x'].values, self.data.to_numpy()))
+        self.assertTrue(np.shares_memory(self.data['pz'].values, self.data.to_numpy()))
+
     def testConstructFromColumns(self):
         ps = Phasespace.from_columns(x=self.data['x'],
                                      px=self.data['px'],
@@ -107,22 +129,134 @@ class TestPhasespaceAstra(unittest.TestCase):
         self.assertAlmostEqual(params.Sdelta_slice*1e4, 0.2098, places=4)
         self.assertAlmostEqual(params.Sdelta_un*1e4, 0.1199, places=4)
 
+    def testAnalyzeSlices(self):
+        with self.assertRaises(ValueError):
+            self.data.analyze_slices(by='x')
+
+        params = self.data.analyze_slices(10, min_particles=5)
+        self.assertEqual(500, params.n.sum())
+        self.assertEqual(10, len(params.emitx))
+
+        t = self.data['t'].values
+        edges = np.linspace(t.min(), t.max(), 11)
+        np.testing.assert_array_almost_equal((edges[1:] + edges[:-1]) / 2,
+                                             params.centers)
+        currents, _ = compute_current_profile(t, 10, self.data.charge)
+        np.testing.assert_array_almost_equal(currents, params.current)
+
+        for i in range(10):
+            mask = (t >= edges[i]) & (t <= edges[i + 1]) if i == 9 \
+                else (t >= edges[i]) & (t < edges[i + 1])
+            self.assertEqual(mask.sum(), params.n[i])
+            if mask.sum() < 5:
+                self.assertTrue(np.isnan(params.emitx[i]))
+                continue
+
+            sliced = self.data.to_pandas()[mask]
+            p = np.sqrt(sliced['px'] ** 2 + sliced['py'] ** 2 + sliced['pz'] ** 2)
+            self.assertAlmostEqual(p.std(ddof=0) / p.mean(), params.Sdelta[i])
+            self.assertAlmostEqual(
+                compute_canonical_emit(sliced['x'], sliced['px']) * 1e6,
+                params.emitx[i] * 1e6)
+            self.assertAlmostEqual(
+                compute_canonical_emit(sliced['y'], sliced['py']) * 1e6,
+                params.emity[i] * 1e6)
+            self.assertAlmostEqual(sliced['x'].std(ddof=0) * 1e6, params.Sx[i] * 1e6)
+
+        # slice with bounds
+        params = self.data.analyze_slices(
+            4, by='z', bounds=(self.data['z'].mean() - 1e-4, self.data['z'].mean() + 1e-4))
+        self.assertEqual(4, len(params.n))
+        self.assertLess(params.n.sum(), 500)
+
     def testCutHalo(self):
+        r = np.sqrt(self.data['x'] ** 2 + self.data['y'] ** 2)
+        charge = self.data.charge
         self.data.cut_halo(0.1)
         params = self.data.analyze()
         self.assertEqual(params.n, 450)
+        self.assertAlmostEqual(0.9 * charge, self.data.charge)
+        self.assertLessEqual(
+            np.sqrt(self.data['x'] ** 2 + self.data['y'] ** 2).max(),
+            np.sort(r)[449])
 
     def testCutTail(self):
+        t = self.data['t']
         self.data.cut_tail(0.1)
         params = self.data.analyze()
         self.assertEqual(params.n, 450)
+        self.assertLessEqual((self.data['t'] - t.median()).abs().max(),
+                             np.sort((t - t.median()).abs())[449])
 
     def testRotateBeam(self):
+        sliced = self.data.slice(stop=200)
+        x = self.data['x'].copy()
+        sliced.rotate(0.1)
+        self.assertFalse(np.array_equal(x[:200], sliced['x']))
+        # the phasespace sliced from is not modified
+        np.testing.assert_array_equal(x, self.data['x'])
+
         self.data.rotate(0.1)
         params = self.data.analyze()
         self.assertEqual(params.n, 500)
 
 
+class TestPhasespaceParser(unittest.TestCase):
+    def testParseAstra(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.001') as fp:
+            # reference particle, lost particle, standard particle
+            fp.write("0. 0. 1.0 0. 0. 1e8 1. -1e-3 1 5\n"
+                     "1e-3 0. 1e-3 1e5 0. 1e5 0. -1e-3 1 -15\n"
+                     "0. 2e-3 -1e-3 0. 1e5 -1e5 0. -1e-3 1 3\n")
+            fp.flush()
+
+            ps = parse_astra_phasespace(fp.name)
+            self.assertEqual(2, len(ps))
+            self.assertAlmostEqual(2e-12, ps.charge)
+            np.testing.assert_array_almost_equal([1.0, 0.999], ps['z'])
+            np.testing.assert_array_almost_equal([0., 2e-3], ps['y'])
+            self.assertAlmostEqual(1e-9, ps['t'][0])
+
+            with self.assertRaisesRegex(LisoRuntimeError, "columns"):
+                fp.write("1.0 2.0\n")
+                fp.flush()
+                parse_astra_phasespace(fp.name)
+
+        with tempfile.NamedTemporaryFile('w', suffix='.001') as fp:
+            # at the cathode: reference particle, standard particle
+            fp.write("0. 0. 0. 0. 0. 0. 1. -1e-3 1 -1\n"
+                     "1e-3 0. 0. 0. 0. 0. 2e-3 -1e-3 1 -1\n")
+            fp.flush()
+            ps = parse_astra_phasespace(fp.name, cathode=True)
+            np.testing.assert_array_almost_equal([1., 1.002], ps['t'] * 1e9)
+
+        with tempfile.NamedTemporaryFile('w', suffix='.001') as fp:
+            # at the cathode with the reference particle dropped
+            fp.write("0. 0. 1.0 0. 0. 1e8 1. -1e-3 1 5\n"
+                     "1e-3 0. 1e-3 1e5 0. 1e5 2e-3 -1e-3 1 -1\n"
+                     "0. 2e-3 -1e-3 0. 1e5 -1e5 -3e-3 -1e-3 1 -3\n")
+            fp.flush()
+            ps = parse_astra_phasespace(fp.name, cathode=True)
+            self.assertEqual(2, len(ps))
+            np.testing.assert_array_almost_equal([1.001, 0.999], ps['z'])
+            # times are relative to the dropped reference particle
+            np.testing.assert_array_almost_equal([1.002, 0.997], ps['t'] * 1e9)
+
+    def testParseImpactt(self):
+        with tempfile.NamedTemporaryFile('w') as fp:
+            # 'partcl.data' has the number of particles in the first line
+            fp.write("2\n"
+                     "0. 0. 0. 0. 1e-3 100.\n"
+                     "0. 0. 0. 0. -1e-3 100.\n")
+            fp.flush()
+
+            ps = parse_impactt_phasespace(fp.name)
+            self.assertEqual(2, len(ps))
+            np.testing.assert_array_almost_equal([1e-3, -1e-3], ps['z'])
+            self.assertLess(ps['t'][0], 0)
+            self.assertAlmostEqual(ps['t'][0], -ps['t'][1])
+
+
 class TestPhasespaceImpactt(unittest.TestCase):
     def setUp(self):
         pfile = osp.join(_ROOT_DIR, "impactt_output/impactt.out")
@@ -4,7 +4,8 @@ import pandas as pd
 import numpy as np
 
 from liso import (
-    phasespace_density, mesh_phasespace
+    compute_canonical_emit, compute_moments, phasespace_density,
+    mesh_phasespace
 )
 
 
@@ -56,3 +57,22 @@ def test_phasespace_density2():
     np.testing.assert_array_almost_equal([1/3] * 3, z)
     np.testing.assert_array_equal(x, x_sample)
     np.testing.assert_array_equal(y, y_sample)
+
+
+@pytest.mark.parametrize("chunk_size", [7, 100, 1 << 20])
+def test_compute_moments(chunk_size):
+    rng = np.random.RandomState(0)
+    data = rng.normal(size=(1000, 3)) * [1e-3, 1e-2, 1.] + [1., 100., -5.]
+
+    mean, cov = compute_moments(data, chunk_size=chunk_size)
+    np.testing.assert_array_almost_equal(data.mean(axis=0), mean)
+    np.testing.assert_allclose(np.cov(data.T, ddof=0), cov, rtol=1e-10)
+    assert compute_canonical_emit(data[:, 0], data[:, 1]) == pytest.approx(
+        np.sqrt(cov[0, 0] * cov[1, 1] - cov[0, 1] ** 2))
+
+    mean, cov = compute_moments(
+        data, chunk_size=chunk_size,
+        transform=lambda x: np.column_stack([x, x[:, 0] * x[:, 1]]))
+    assert mean.shape == (4,)
+    assert cov.shape == (4, 4)
+    assert mean[3] == pytest.approx((data[:, 0] * data[:, 1]).mean())
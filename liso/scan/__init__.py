@@ -1,8 +1,10 @@
 from .linac_scan import LinacScan
 from .machine_scan import MachineScan
+from .work_queue import WorkQueue
 
 
 __all__ = [
     'LinacScan',
     'MachineScan',
+    'WorkQueue',
 ]
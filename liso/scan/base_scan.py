@@ -10,7 +10,10 @@ from collections import deque, OrderedDict
 
 import numpy as np
 
-from .scan_param import JitterParam, SampleParam, StepParam
+from .scan_param import (
+    JitterParam, SampleParam, StepParam, SAMPLING_METHODS,
+    sample_unit_hypercube
+)
 from ..logging import logger
 
 
@@ -75,15 +78,45 @@ class _BaseScan(abc.ABC):
 
         return list(ret_queue)
 
-    def _generate_param_sequence(self, cycles):
+    @staticmethod
+    def _check_sampling(sampling):
+        if sampling not in SAMPLING_METHODS:
+            raise ValueError(f"Unknown sampling method: {sampling}. Must be "
+                             f"one of {SAMPLING_METHODS}")
+
+    def _generate_param_sequence(self, cycles, sampling='random', seed=None):
+        """Generate the sequence of the scan parameters.
+
+        :param int cycles: number of cycles of the parameter space.
+        :param str sampling: 'random' for pseudo-random numbers. 'sobol',
+            'halton' or 'lhs' for drawing the values of all the random
+            parameters jointly from a scrambled Sobol'/Halton sequence or
+            a Latin hypercube design.
+        :param int/None seed: seed of the design if sampling is not
+            'random'.
+        """
+        self._check_sampling(sampling)
         if not self._params:
             return []
 
         repeats = np.prod([len(param) for param in self._params.values()])
+
+        design = None
+        n_random = sum(param.is_random for param in self._params.values())
+        if sampling != 'random' and n_random > 0:
+            # one dimension per random parameter and one row per point
+            design = sample_unit_hypercube(
+                sampling, int(repeats) * cycles, n_random, seed)
+
         ret = []
+        i_col = 0
         for param in self._params.values():
             repeats = int(repeats / len(param))
-            ret.append(param.generate(repeats=repeats, cycles=cycles))
+            u = None
+            if design is not None and param.is_random:
+                u = design[:, i_col]
+                i_col += 1
+            ret.append(param.generate(repeats=repeats, cycles=cycles, u=u))
             cycles *= len(param)
 
         for i in range(5):
@@ -0,0 +1,152 @@
+"""
+Distributed under the terms of the GNU General Public License v3.0.
+
+The full license is in the file LICENSE, distributed with this software.
+
+Copyright (C) Jun Zhu. All rights reserved.
+"""
+import os
+import pathlib
+import re
+
+import numpy as np
+
+from ..logging import logger
+
+
+class ScanJournal:
+    """Journal of a scan for resuming it after an interruption.
+
+    The journal is stored in the output directory and consists of two
+    files:
+
+        SCAN-G$group.npz: the planned scan, i.e. the parameter names,
+            the point IDs and the parameter values at each point.
+        SCAN-G$group.log: one line per closed data file with the file
+            name and the IDs of the points it contains. It is only
+            appended, so a point is completed once its file has been
+            closed.
+
+    A worker of a WorkQueue only keeps the log, which is read by
+    load_log().
+    """
+    def __init__(self, path, group):
+        """Initialization.
+
+        :param str/pathlib.Path path: output directory of the scan.
+        :param int group: writer group of the scan.
+        """
+        self._path = pathlib.Path(path)
+        self._plan_file = self._path.joinpath(f"SCAN-G{group:02d}.npz")
+        self._log_file = self._path.joinpath(f"SCAN-G{group:02d}.log")
+
+        self._params = None
+        self._ids = None
+        self._sequence = None
+        self._completed = set()
+        self._files = set()
+
+    def exists(self):
+        return self._plan_file.exists()
+
+    @property
+    def params(self):
+        return self._params
+
+    @property
+    def ids(self):
+        return self._ids
+
+    @property
+    def sequence(self):
+        return self._sequence
+
+    @property
+    def completed(self):
+        return self._completed
+
+    def create(self, params, ids, sequence):
+        """Write the planned scan.
+
+        :param list params: names of the scan parameters.
+        :param array-like ids: ID of each point.
+        :param array-like sequence: parameter values at each point.
+        """
+        self._params = list(params)
+        self._ids = np.asarray(ids, dtype=np.int64)
+        self._sequence = np.asarray(sequence, dtype=np.float64).reshape(
+            len(self._ids), len(self._params))
+
+        # write into a temporary file first so that a journal is never
+        # partially written
+        tmp = self._plan_file.with_name(self._plan_file.name + '.tmp')
+        with open(tmp, 'wb') as fp:
+            np.savez(fp, params=np.array(self._params, dtype=str),
+                     ids=self._ids, sequence=self._sequence)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp, self._plan_file)
+
+        # a new journal has no completed point
+        open(self._log_file, 'w').close()
+
+    def load(self):
+        """Read the planned scan and the completed points."""
+        with np.load(self._plan_file) as data:
+            self._params = data['params'].tolist()
+            self._ids = data['ids']
+            self._sequence = data['sequence']
+
+        self.load_log()
+
+    def load_log(self):
+        """Read the completed points."""
+        self._completed.clear()
+        self._files.clear()
+        if self._log_file.exists():
+            with open(self._log_file) as fp:
+                for line in fp:
+                    items = line.split()
+                    # a line could be truncated by a crash
+                    if not line.endswith('\n') or not items:
+                        continue
+                    self._files.add(items[0])
+                    self._completed.update(int(i) for i in items[1:])
+
+    def record(self, filepath, ids):
+        """Record the points in a closed data file.
+
+        :param str filepath: path of the data file.
+        :param list ids: IDs of the points.
+        """
+        name = pathlib.Path(filepath).name
+        with open(self._log_file, 'a') as fp:
+            fp.write(' '.join([name] + [str(i) for i in ids]) + '\n')
+            fp.flush()
+            os.fsync(fp.fileno())
+        self._files.add(name)
+        self._completed.update(ids)
+
+    def recover(self, pattern):
+        """Set aside the data files which were not closed.
+
+        The files are renamed with the suffix '.incomplete' since they
+        cannot be read and their points will be run again.
+
+        :param str pattern: glob pattern of the data files of the scan.
+
+        :return int: sequence number of the next data file.
+        """
+        next_seq = 0
+        for filepath in sorted(self._path.glob(pattern + '*')):
+            match = re.search(r'-S(\d+)\.hdf5', filepath.name)
+            if match is None:
+                continue
+            next_seq = max(next_seq, int(match.group(1)) + 1)
+
+            if filepath.suffix == '.hdf5' and filepath.name not in self._files:
+                logger.warning(f"Data file {filepath} was not closed and "
+                               f"is renamed to {filepath.name}.incomplete")
+                filepath.rename(
+                    filepath.with_name(filepath.name + '.incomplete'))
+        return next_seq
@@ -6,17 +6,24 @@ The full license is in the file LICENSE, distributed with this software.
 Copyright (C) Jun Zhu. All rights reserved.
 """
 import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import multiprocessing
+import os
 import pathlib
+import socket
 import sys
+import threading
 import traceback
 
 import numpy as np
 
 from .base_scan import _BaseScan
+from .journal import ScanJournal
+from .work_queue import WorkQueue
 from ..exceptions import LisoRuntimeError
 from ..io import SimWriter
 from ..logging import logger
+from ..simulation.scheduler import CoreScheduler
 
 
 class LinacScan(_BaseScan):
@@ -53,55 +60,88 @@ class LinacScan(_BaseScan):
         parent_path.mkdir(exist_ok=True)
         return parent_path
 
-    async def _async_scan(self, cycles, output_dir, *,
-                          start_id, n_tasks, group, chmod, **kwargs):
-        tasks = set()
-        sequence = self._generate_param_sequence(cycles)
-        n_pulses = len(sequence)
+    async def _async_scan(self, points, output_dir, *, param_names,
+                          n_tasks, n_workers, n_cores, group, chmod,
+                          queue_size, compression, phasespace_dtype,
+                          processes=False, finished=None, start_seq=0,
+                          on_close=None, **kwargs):
+        """Simulate and write the points concurrently.
+
+        :param iterator points: (simulation id, parameter mapping) pairs.
+            The next point is only requested when a task slot is free.
+        :param list param_names: names of the scan parameters.
+        :param bool processes: True for processing the particle files in
+            a process pool.
+        :param list/None finished: if given, (simulation id, error message
+            or None) pairs are appended once the simulations finish.
+        :param int start_seq: sequence number of the first output file.
+        :param callable on_close: see SimWriter.
+        """
+        tasks = dict()
 
         phasespace_schema = self._linac.schema
-        control_schema = self._linac.compile(self._params)
+        control_schema = self._linac.compile(dict.fromkeys(param_names))
         for param in control_schema:
             control_schema[param] = {'type': '<f4'}
         schema = (control_schema, phasespace_schema)
 
-        with SimWriter(output_dir,
-                       schema=schema,
-                       chmod=chmod,
-                       group=group) as writer:
-            count = 0
+        # The event loop only launches and reaps the simulations. Writing
+        # the initial particle files and parsing and analyzing the output
+        # are done in the executor and the data are written into files
+        # by the background thread of the writer.
+        if processes:
+            executor = ProcessPoolExecutor(max_workers=min(n_tasks, n_cores))
+        else:
+            executor = ThreadPoolExecutor(max_workers=n_tasks)
+        # A simulation does not start until the cores for all its MPI
+        # ranks are available.
+        scheduler = CoreScheduler(n_cores)
+        with executor, SimWriter(output_dir,
+                                 schema=schema,
+                                 chmod=chmod,
+                                 group=group,
+                                 queue_size=queue_size,
+                                 compression=compression,
+                                 phasespace_dtype=phasespace_dtype,
+                                 start_seq=start_seq,
+                                 on_close=on_close) as writer:
+            points = iter(points)
+            exhausted = False
             while True:
-                if count < n_pulses:
-                    x_map = dict()
-                    for i, k in enumerate(self._params):
-                        x_map[k] = sequence[count][i]
-
-                    sim_id = count + start_id
-                    task = asyncio.create_task(
-                        self._linac.async_run(sim_id, x_map, **kwargs))
-                    tasks.add(task)
-
-                    logger.info(f"Scan {sim_id:06d}: "
-                                + str(x_map)[1:-1].replace(': ', ' = '))
+                if not exhausted and len(tasks) < n_tasks:
+                    try:
+                        sim_id, x_map = next(points)
+                    except StopIteration:
+                        exhausted = True
+                    else:
+                        task = asyncio.create_task(self._linac.async_run(
+                            sim_id, x_map, executor=executor,
+                            n_workers=n_workers, scheduler=scheduler,
+                            **kwargs))
+                        tasks[task] = sim_id
 
-                    count += 1
+                        logger.info(f"Scan {sim_id:06d}: "
+                                    + str(x_map)[1:-1].replace(': ', ' = '))
 
                 if len(tasks) == 0:
                     break
 
-                if len(tasks) >= n_tasks or count == n_pulses:
+                if len(tasks) >= n_tasks or exhausted:
                     done, _ = await asyncio.wait(
                         tasks, return_when=asyncio.FIRST_COMPLETED)
 
                     for task in done:
+                        sim_id = tasks.pop(task)
+                        error = None
                         try:
-                            sim_id, controls, phasespaces = task.result()
+                            _, controls, phasespaces = task.result()
                             writer.write(sim_id, controls, phasespaces)
                         except LisoRuntimeError as e:
                             exc_type, exc_value, exc_traceback = sys.exc_info()
                             logger.debug(repr(traceback.format_tb(exc_traceback))
                                          + str(e))
                             logger.warning(str(e))
+                            error = str(e)
                         except Exception as e:
                             exc_type, exc_value, exc_traceback = sys.exc_info()
                             logger.error(
@@ -110,14 +150,56 @@ class LinacScan(_BaseScan):
                                 + str(e))
                             raise
 
-                        tasks.remove(task)
+                        if finished is not None:
+                            finished.append((sim_id, error))
+
+            metrics = writer.metrics
+
+        if queue_size > 0:
+            logger.info(f"Writer queue: max depth = "
+                        f"{metrics['max_queue_depth']}/{queue_size}, "
+                        f"blocked {metrics['blocked_puts']} times for "
+                        f"{metrics['blocked_time']:.3f} s")
+
+    def _check_resources(self, n_tasks, n_workers, n_cores):
+        """Return the number of concurrent tasks and cores."""
+        ranks = self._linac._get_n_workers(n_workers)
+
+        if n_cores is None:
+            n_cores = multiprocessing.cpu_count()
+        if max(ranks.values()) > n_cores:
+            raise ValueError(f"n_workers {dict(ranks)} exceeds the "
+                             f"number of cores: {n_cores}")
+
+        if n_tasks is None:
+            n_tasks = max(1, n_cores // min(ranks.values()))
+
+        logger.info(f"Starting parameter scan with {n_tasks} concurrent "
+                    f"tasks on {n_cores} cores. MPI ranks: "
+                    + str(dict(ranks))[1:-1].replace("'", ""))
+        return n_tasks, n_cores
+
+    @staticmethod
+    def _check_start_id(start_id):
+        if not isinstance(start_id, int) or start_id < 1:
+            raise ValueError(
+                f"start_id must a positive integer. Actual: {start_id}")
 
     def scan(self, cycles=1, output_dir="./", *,
              start_id=1,
              n_tasks=None,
+             n_workers=1,
+             n_cores=None,
              chmod=True,
              group=1,
              seed=None,
+             sampling='random',
+             queue_size=0,
+             compression=None,
+             phasespace_dtype='<f8',
+             processes=False,
+             journal=False,
+             resume=False,
              **kwargs):
         """Start a parameter scan.
 
@@ -127,35 +209,272 @@ class LinacScan(_BaseScan):
         :param str output_dir: Directory where the output simulation data
             is saved.
         :param int start_id: starting simulation id. Default = 1.
-        :param int/None n_tasks: maximum number of concurrent tasks.
+        :param int/None n_tasks: maximum number of concurrent tasks. If
+            None, it is the number of cores divided by the smallest
+            number of MPI ranks.
+        :param int/dict n_workers: number of MPI ranks of each simulation.
+            It can also be a mapping from beamline name to number of MPI
+            ranks, e.g. {'gun': 8}, where the other beamlines are run with
+            a single process.
+        :param int/None n_cores: number of cores shared by the concurrent
+            simulations. A simulation waits until there are enough free
+            cores for its MPI ranks, so that the cores are never
+            oversubscribed. If None, it is the number of CPUs. Note that
+            the binding policy of the MPI library must allow concurrent
+            jobs, e.g. 'export OMPI_MCA_hwloc_base_binding_policy=none'
+            for Open MPI.
         :param bool chmod: True for changing the permission to 400 after
             finishing writing.
         :param int group: writer group.
         :param int/None seed: seed for the legacy MT19937 BitGenerator
-            in numpy.
+            in numpy and for the scrambling of the sampling design.
+        :param str sampling: sampling of the sample and jitter parameters.
+            'random' for pseudo-random numbers. 'sobol', 'halton' or
+            'lhs' for drawing the values of all the random parameters
+            jointly from a scrambled Sobol'/Halton sequence or a Latin
+            hypercube design, where Gaussian jitters are obtained by the
+            inverse CDF. These designs cover the parameter space more
+            evenly. The 'sobol' design is only balanced if the number
+            of points is a power of 2.
+        :param int queue_size: maximum number of simulations waiting to be
+            written into files by the background thread. The scan is
+            blocked when the queue is full. If 0 (default), data are
+            written in the event loop.
+        :param dict compression: filter options of the datasets, e.g.
+            {'compression': 'gzip', 'shuffle': True}. See SimWriter.
+        :param str phasespace_dtype: data type of the phasespace columns
+            in the output files. Use '<f4' for halving the file size at
+            the cost of precision.
+        :param bool processes: True for writing the initial particle
+            files and parsing and analyzing the output particle files in
+            a process pool instead of a thread pool. The processing is
+            then not serialized by the GIL, at the cost of transferring
+            the particles between processes.
+        :param bool journal: True for recording the planned parameter
+            sequence and the completed simulations in a journal
+            (SCAN-G$group.npz/.log) in output_dir, so that an interrupted
+            scan can be resumed. A FileExistsError is raised if a journal
+            of the same group already exists.
+        :param bool resume: True for resuming the scan recorded in the
+            journal in output_dir with the same group. The planned
+            parameter values are reused and only the simulations which
+            have not been written into a closed file are run. The output
+            is written into new files and recorded in the journal.
+            cycles, start_id, seed and sampling are ignored.
         """
-        if not isinstance(start_id, int) or start_id < 1:
-            raise ValueError(
-                f"start_id must a positive integer. Actual: {start_id}")
-
-        if n_tasks is None:
-            n_tasks = multiprocessing.cpu_count()
+        self._check_start_id(start_id)
+        self._check_sampling(sampling)
+        # check the parameter names before writing the journal
+        self._linac.compile(self._params)
 
         output_dir = self._create_output_dir(output_dir)
 
         logger.info(str(self._linac))
-        logger.info(f"Starting parameter scan with {n_tasks} CPUs.")
+        n_tasks, n_cores = self._check_resources(n_tasks, n_workers, n_cores)
         logger.info(self.summarize())
 
-        np.random.seed(seed)
+        scan_journal = None
+        if resume:
+            scan_journal = ScanJournal(output_dir, group)
+            if not scan_journal.exists():
+                raise FileNotFoundError(f"No scan journal of group {group} "
+                                        f"found in {output_dir}!")
+            scan_journal.load()
+            if scan_journal.params != list(self._params):
+                raise ValueError(f"Scan parameters {list(self._params)} "
+                                 f"differ from the ones in the journal: "
+                                 f"{scan_journal.params}")
+            ids, sequence = scan_journal.ids, scan_journal.sequence
+            start_seq = scan_journal.recover(f"SIM-G{group:02d}-S")
+            logger.info(f"Resuming scan: {len(scan_journal.completed)} of "
+                        f"{len(ids)} simulations have been completed")
+        else:
+            if journal:
+                scan_journal = ScanJournal(output_dir, group)
+                if scan_journal.exists():
+                    raise FileExistsError(
+                        f"A scan journal of group {group} already exists in "
+                        f"{output_dir}. Use resume=True to continue the "
+                        f"scan.")
+            np.random.seed(seed)
+            sequence = self._generate_param_sequence(
+                cycles, sampling=sampling, seed=seed)
+            ids = np.arange(len(sequence)) + start_id
+            if scan_journal is not None:
+                scan_journal.create(self._params, ids, sequence)
+            start_seq = 0
+
+        if scan_journal is None:
+            completed, on_close = set(), None
+        else:
+            completed, on_close = scan_journal.completed, scan_journal.record
+        points = ((int(i), dict(zip(self._params, item)))
+                  for i, item in zip(ids, sequence) if i not in completed)
 
         loop = asyncio.get_event_loop()
         loop.run_until_complete(self._async_scan(
-            cycles, output_dir,
-            start_id=start_id,
+            points, output_dir,
+            param_names=list(self._params),
             n_tasks=n_tasks,
+            n_workers=n_workers,
+            n_cores=n_cores,
             group=group,
             chmod=chmod,
+            queue_size=queue_size,
+            compression=compression,
+            phasespace_dtype=phasespace_dtype,
+            processes=processes,
+            start_seq=start_seq,
+            on_close=on_close,
             **kwargs))
 
         logger.info(f"Scan finished!")
+
+    def publish(self, queue_file, cycles=1, *, start_id=1, seed=None,
+                sampling='random'):
+        """Publish the parameter points into a work queue.
+
+        The points are simulated by any number of workers calling
+        work() with the same queue file.
+
+        :param str queue_file: path of the WorkQueue database. Put it on
+            a file system shared by all the nodes running workers.
+        :param int cycles: number of cycles of the parameter space.
+        :param int start_id: simulation id of the first point. Points
+            can be published more than once, e.g. in several batches,
+            as long as the simulation ids do not overlap.
+        :param int/None seed: seed for the legacy MT19937 BitGenerator
+            in numpy and for the scrambling of the sampling design.
+        :param str sampling: sampling of the sample and jitter parameters.
+            'random' for pseudo-random numbers. 'sobol', 'halton' or
+            'lhs' for drawing the values of all the random parameters
+            jointly from a scrambled Sobol'/Halton sequence or a Latin
+            hypercube design, where Gaussian jitters are obtained by the
+            inverse CDF. These designs cover the parameter space more
+            evenly. The 'sobol' design is only balanced if the number
+            of points is a power of 2.
+
+        :return int: number of published points.
+        """
+        self._check_start_id(start_id)
+        # check the parameter names before publishing
+        self._linac.compile(self._params)
+
+        np.random.seed(seed)
+        sequence = self._generate_param_sequence(
+            cycles, sampling=sampling, seed=seed)
+        with WorkQueue(queue_file) as queue:
+            queue.publish(self._params, sequence, start_id=start_id)
+
+        logger.info(f"Published {len(sequence)} points to {queue_file}: "
+                    f"simulation ids {start_id} - "
+                    f"{start_id + len(sequence) - 1}")
+        logger.info(self.summarize())
+        return len(sequence)
+
+    def work(self, queue_file, output_dir="./", *,
+             worker=None,
+             group=None,
+             n_tasks=None,
+             n_workers=1,
+             n_cores=None,
+             chmod=True,
+             queue_size=0,
+             compression=None,
+             phasespace_dtype='<f8',
+             processes=False,
+             heartbeat=60.,
+             **kwargs):
+        """Simulate the points pulled from a work queue.
+
+        The worker returns when the queue has no pending point. Each
+        worker writes its own files and records them in the log of a
+        scan journal. A worker reusing the group of a previous one
+        continues the sequence of its files. The scan parameters are read from
+        the queue, so the parameters do not need to be added to the
+        scan of a worker.
+
+        A point is marked as done once the output file containing it
+        has been closed. If a worker dies, the points it claimed can be
+        put back to the queue by WorkQueue.requeue(), e.g. with
+        expired=10 * heartbeat.
+
+        :param str queue_file: path of the WorkQueue database.
+        :param str output_dir: Directory where the output simulation data
+            is saved.
+        :param str/None worker: name of the worker. If None, it is
+            'hostname-pid'.
+        :param int/None group: writer group. If None, a group unique to
+            the worker is assigned by the queue and freed when the
+            worker returns without error.
+        :param float heartbeat: interval in seconds at which the worker
+            refreshes the lease of its claimed points.
+
+        See scan() for the other parameters.
+        """
+        if worker is None:
+            worker = f"{socket.gethostname()}-{os.getpid()}"
+
+        output_dir = self._create_output_dir(output_dir)
+
+        logger.info(str(self._linac))
+        n_tasks, n_cores = self._check_resources(n_tasks, n_workers, n_cores)
+
+        with WorkQueue(queue_file) as queue:
+            registered = group is None
+            if registered:
+                group = queue.register(worker)
+            logger.info(f"Worker {worker} (group {group}) started")
+
+            journal = ScanJournal(output_dir, group)
+            journal.load_log()
+            start_seq = journal.recover(f"SIM-G{group:02d}-S")
+
+            def _on_close(filepath, ids):
+                journal.record(filepath, ids)
+                queue.complete(ids)
+
+            finished = []
+            points = iter(lambda: queue.claim(worker), None)
+
+            stopped = threading.Event()
+
+            def _heartbeat():
+                while not stopped.wait(heartbeat):
+                    queue.heartbeat(worker)
+
+            thread = threading.Thread(target=_heartbeat, daemon=True)
+            thread.start()
+            try:
+                loop = asyncio.get_event_loop()
+                loop.run_until_complete(self._async_scan(
+                    points, output_dir,
+                    param_names=queue.params,
+                    n_tasks=n_tasks,
+                    n_workers=n_workers,
+                    n_cores=n_cores,
+                    group=group,
+                    chmod=chmod,
+                    queue_size=queue_size,
+                    compression=compression,
+                    phasespace_dtype=phasespace_dtype,
+                    processes=processes,
+                    finished=finished,
+                    start_seq=start_seq,
+                    on_close=_on_close,
+                    **kwargs))
+            finally:
+                stopped.set()
+                thread.join()
+                queue.fail([(i, err) for i, err in finished
+                            if err is not None])
+                # points which were claimed but not written into a
+                # closed file
+                queue.requeue(worker=worker)
+
+            if registered:
+                queue.unregister(worker)
+
+            logger.info(f"Worker {worker} finished {len(finished)} points. "
+                        f"Queue status: "
+                        + str(queue.counts())[1:-1].replace("'", ""))
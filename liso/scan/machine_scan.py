@@ -18,6 +18,7 @@ import traceback
 import numpy as np
 
 from .base_scan import _BaseScan
+from .journal import ScanJournal
 from ..exceptions import LisoRuntimeError
 from ..io import ExpWriter
 from ..logging import logger
@@ -37,7 +38,7 @@ class MachineScan(_BaseScan):
 
         self._param_readouts = dict()
 
-    def _create_output_dir(self, parent):
+    def _create_output_dir(self, parent, resume=False):
         parent_path = pathlib.Path(parent)
         # It is allowed to use an existing parent directory,
         # but not a run folder.
@@ -51,6 +52,13 @@ class MachineScan(_BaseScan):
                 if seq >= next_run_index:
                     next_run_index = seq + 1
 
+        if resume:
+            if next_run_index == 1:
+                raise FileNotFoundError(
+                    f"No run folder found in {parent_path}!")
+            # continue the last run
+            return parent_path.joinpath(f'r{next_run_index - 1:04d}')
+
         next_output_dir = parent_path.joinpath(f'r{next_run_index:04d}')
         next_output_dir.mkdir(parents=True, exist_ok=False)
         return next_output_dir
@@ -60,7 +68,13 @@ class MachineScan(_BaseScan):
              chmod=True,
              timeout=None,
              group=1,
-             seed=None):
+             seed=None,
+             sampling='random',
+             queue_size=0,
+             compression=None,
+             chunks=None,
+             journal=False,
+             resume=False):
         """Start a parameter scan.
 
         :param int cycles: number of cycles of the parameter space. For
@@ -76,8 +90,37 @@ class MachineScan(_BaseScan):
             ID, in seconds.
         :param int group: writer group.
         :param int/None seed: seed for the legacy MT19937 BitGenerator
-            in numpy.
+            in numpy and for the scrambling of the sampling design.
+        :param str sampling: sampling of the sample and jitter parameters.
+            'random' for pseudo-random numbers. 'sobol', 'halton' or
+            'lhs' for drawing the values of all the random parameters
+            jointly from a scrambled Sobol'/Halton sequence or a Latin
+            hypercube design, where Gaussian jitters are obtained by the
+            inverse CDF. These designs cover the parameter space more
+            evenly. The 'sobol' design is only balanced if the number
+            of points is a power of 2.
+        :param int queue_size: maximum number of pulses waiting to be
+            written into files by the background writer thread. The scan
+            is blocked when the queue is full. If 0 (default), data are
+            written in the scan loop.
+        :param dict compression: filter options of the datasets, e.g.
+            {'compression': 'gzip', 'shuffle': True}. See ExpWriter.
+        :param dict chunks: chunk shapes of array channels, e.g.
+            {address: (1, 256, 2330)}. The chunk shapes of the other array
+            channels are tuned automatically. See ExpWriter.
+        :param bool journal: True for recording the planned parameter
+            sequence and the completed points in a journal
+            (SCAN-G$group.npz/.log) in the run folder, so that an
+            interrupted scan can be resumed.
+        :param bool resume: True for resuming the scan recorded in the
+            journal of the last run folder with the same group. The
+            planned parameter values are reused and only the points which
+            have not been written into a closed file are scanned. The
+            output is written into new files and recorded in the journal.
+            cycles, seed and sampling are ignored.
         """
+        self._check_sampling(sampling)
+
         if tasks is None:
             tasks = multiprocessing.cpu_count()
         executor = ThreadPoolExecutor(max_workers=tasks)
@@ -93,24 +136,67 @@ class MachineScan(_BaseScan):
         logger.info(f"Starting parameter scan with {tasks} CPUs.")
         logger.info(self.summarize())
 
-        np.random.seed(seed)
-
-        output_dir = self._create_output_dir(output_dir)
+        output_dir = self._create_output_dir(output_dir, resume)
+
+        scan_journal = None
+        if resume:
+            scan_journal = ScanJournal(output_dir, group)
+            if not scan_journal.exists():
+                raise FileNotFoundError(f"No scan journal of group {group} "
+                                        f"found in {output_dir}!")
+            scan_journal.load()
+            if scan_journal.params != list(self._params):
+                raise ValueError(f"Scan parameters {list(self._params)} "
+                                 f"differ from the ones in the journal: "
+                                 f"{scan_journal.params}")
+            ids, sequence = scan_journal.ids, scan_journal.sequence
+            start_seq = scan_journal.recover(f"RAW-*-G{group:02d}-S")
+            logger.info(f"Resuming scan in {output_dir}: "
+                        f"{len(scan_journal.completed)} of {len(ids)} "
+                        f"points have been completed")
+        else:
+            np.random.seed(seed)
+            sequence = self._generate_param_sequence(
+                cycles, sampling=sampling, seed=seed)
+            n_pulses = len(sequence) if sequence else cycles
+            # points are numbered from 1
+            ids = np.arange(1, n_pulses + 1)
+            sequence = np.asarray(sequence, dtype=np.float64).reshape(
+                n_pulses, len(self._params))
+            if journal:
+                scan_journal = ScanJournal(output_dir, group)
+                scan_journal.create(self._params, ids, sequence)
+            start_seq = 0
+
+        # macro-pulse ID -> point ID
+        points = dict()
+
+        if scan_journal is None:
+            completed, _record = set(), None
+        else:
+            completed = scan_journal.completed
+
+            def _record(filepath, pulse_ids):
+                scan_journal.record(filepath,
+                                    [points[pid] for pid in pulse_ids])
 
-        sequence = self._generate_param_sequence(cycles)
-        n_pulses = len(sequence) if sequence else cycles
         with ExpWriter(output_dir,
                        schema=self._machine.schema,
                        chmod=chmod,
-                       group=group) as writer:
-            count = 0
-            while count < n_pulses:
+                       group=group,
+                       queue_size=queue_size,
+                       compression=compression,
+                       chunks=chunks,
+                       start_seq=start_seq,
+                       on_close=_record) as writer:
+            for count, values in zip(ids.tolist(), sequence):
+                if count in completed:
+                    continue
+
                 mapping = dict()
-                if sequence:
-                    for i, k in enumerate(self._params):
-                        mapping[k] = {'value': sequence[count][i]}
-                        mapping[k].update(self._param_readouts[k])
-                count += 1
+                for i, k in enumerate(self._params):
+                    mapping[k] = {'value': values[i]}
+                    mapping[k].update(self._param_readouts[k])
                 logger.info(f"Scan {count:06d}: "
                             + str({address: item['value']
                                    for address, item in mapping.items()})
@@ -122,6 +208,7 @@ class MachineScan(_BaseScan):
                         mapping=mapping,
                         timeout=timeout,
                     )
+                    points[idx] = count
                     writer.write(idx, controls, diagnostics)
                 except LisoRuntimeError as e:
                     exc_type, exc_value, exc_traceback = sys.exc_info()
@@ -136,6 +223,13 @@ class MachineScan(_BaseScan):
                         + str(e))
                     raise
 
+            metrics = writer.metrics
+
+        if queue_size > 0:
+            logger.info(f"Writer queue: max depth = "
+                        f"{metrics['max_queue_depth']}/{queue_size}, "
+                        f"blocked {metrics['blocked_puts']} times for "
+                        f"{metrics['blocked_time']:.3f} s")
         logger.info(f"Scan finished!")
 
     def add_param(self, name, readout=None, tol=1e-6, **kwargs):
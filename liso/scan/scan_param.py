@@ -8,22 +8,76 @@ Copyright (C) Jun Zhu. All rights reserved.
 import abc
 
 import numpy as np
+from scipy.special import ndtri
 
 from ..elements import OperationalElement
 
 
+SAMPLING_METHODS = ('random', 'sobol', 'halton', 'lhs')
+
+
+def sample_unit_hypercube(method, n, d, seed=None):
+    """Return n points in the d-dimensional unit hypercube.
+
+    :param str method: 'sobol' or 'halton' for scrambled quasi-Monte Carlo
+        sequences and 'lhs' for Latin hypercube sampling.
+    :param int n: number of points. The first n points of the Sobol'
+        sequence are returned. They are only balanced if n is a power
+        of 2, otherwise scipy emits a UserWarning.
+    :param int d: number of dimensions.
+    :param int/None seed: seed of the scrambling/permutation.
+
+    :return numpy.ndarray: array with shape (n, d).
+    """
+    if method not in SAMPLING_METHODS[1:]:
+        raise ValueError(f"Unknown sampling method: {method}. Must be one "
+                         f"of {SAMPLING_METHODS}")
+
+    from scipy.stats import qmc
+
+    if method == 'sobol':
+        return qmc.Sobol(d, scramble=True, seed=seed).random(n)
+    if method == 'halton':
+        return qmc.Halton(d, scramble=True, seed=seed).random(n)
+    return qmc.LatinHypercube(d, seed=seed).random(n)
+
+
+def _normal(size, u=None):
+    """Return samples of the standard normal distribution.
+
+    :param int size: number of samples.
+    :param numpy.ndarray/None u: uniformly distributed samples within
+        [0, 1) which are transformed by the inverse CDF. If None,
+        pseudo-random numbers are generated.
+    """
+    if u is None:
+        return np.random.normal(size=size)
+    eps = np.finfo(np.float64).eps
+    return ndtri(np.clip(u, eps, 1. - eps))
+
+
 class ScanParam(OperationalElement):
     """Base class for parameters used in parameter scan."""
     def __init__(self, name):
         super().__init__(name)
 
+    @property
+    def is_random(self):
+        """Whether the generated values are random."""
+        return False
+
     @abc.abstractmethod
-    def generate(self, repeats=1, cycles=1):
+    def generate(self, repeats=1, cycles=1, u=None):
         """Generate a sequence of parameters.
 
         :param int repeats: number of repeats of each element in the parameter
             space.
         :param int cycles: number of cycles of the sequence.
+        :param numpy.ndarray/None u: if given, random values are generated
+            from these uniformly distributed samples within [0, 1), e.g.
+            a column of a quasi-Monte Carlo design. Its length must be
+            the length of the sequence. Ignored if the parameter is not
+            random.
 
         For examples, generate(2, 3) = [1 1 2 2 1 1 2 2 1 1 2 2] with parameter
         space being [1 2].
@@ -57,24 +111,35 @@ class StepParam(ScanParam):
     def __len__(self):
         return len(self._values)
 
-    def _generate_once(self, repeats):
+    @property
+    def is_random(self):
+        """Override."""
+        return self._sigma != 0.
+
+    def _generate_once(self, repeats, u=None):
         """Override."""
         sigma = self._sigma
         ret = []
-        for v in self._values:
+        for i, v in enumerate(self._values):
             if sigma == 0.:
                 ret.extend([v] * repeats)
-            elif sigma < 0:
-                ret.extend(v * (1 + np.random.normal(size=repeats) * sigma))
+                continue
+
+            rand_nums = _normal(
+                repeats, None if u is None else u[i*repeats:(i+1)*repeats])
+            if sigma < 0:
+                ret.extend(v * (1 + rand_nums * sigma))
             else:
-                ret.extend(v + np.random.normal(size=repeats) * sigma)
+                ret.extend(v + rand_nums * sigma)
         return ret
 
-    def generate(self, repeats=1, cycles=1):
+    def generate(self, repeats=1, cycles=1, u=None):
         """Override."""
+        n = len(self._values) * repeats
         ret = []
-        for _ in range(cycles):
-            ret.extend(self._generate_once(repeats))
+        for i in range(cycles):
+            ret.extend(self._generate_once(
+                repeats, None if u is None else u[i*n:(i+1)*n]))
         return np.array(ret)
 
     def list_item(self):
@@ -107,9 +172,16 @@ class SampleParam(ScanParam):
     def __len__(self):
         return 1
 
-    def generate(self, repeats=1, cycles=1):
+    @property
+    def is_random(self):
         """Override."""
-        return np.random.uniform(self._lb, self._ub, repeats * cycles)
+        return True
+
+    def generate(self, repeats=1, cycles=1, u=None):
+        """Override."""
+        if u is None:
+            return np.random.uniform(self._lb, self._ub, repeats * cycles)
+        return self._lb + np.asarray(u) * (self._ub - self._lb)
 
     def list_item(self):
         """Override."""
@@ -139,9 +211,14 @@ class JitterParam(ScanParam):
     def __len__(self):
         return 1
 
-    def generate(self, repeats=1, cycles=1):
+    @property
+    def is_random(self):
+        """Override."""
+        return self._sigma != 0.
+
+    def generate(self, repeats=1, cycles=1, u=None):
         """Override."""
-        rand_nums = np.random.normal(size=repeats * cycles)
+        rand_nums = _normal(repeats * cycles, u)
         if self._sigma < 0:
             return self._value * (1 + rand_nums * self._sigma)
         return self._value + rand_nums * self._sigma
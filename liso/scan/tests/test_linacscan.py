@@ -1,6 +1,7 @@
 import platform
 import unittest
 from unittest.mock import patch
+from concurrent.futures import ProcessPoolExecutor
 import os.path as osp
 import tempfile
 import asyncio
@@ -11,12 +12,11 @@ import numpy as np
 
 from liso import (
     EuXFELInterface, Linac, LinacScan, MachineScan,
-    open_run, open_sim, Phasespace
+    open_run, open_sim, Phasespace, WorkQueue
 )
 from liso import doocs_channels as dc
 from liso.experiment import machine
 from liso.experiment.machine import _DoocsReader
-from liso.io import ExpWriter
 from liso.logging import logger
 logger.setLevel('ERROR')
 
@@ -109,6 +109,34 @@ class TestLinacScan(unittest.TestCase):
         self.assertLess(np.abs(np.mean(lst1)), 0.005)
         self.assertLess(np.abs(np.mean(lst2) - 5.), 0.25)
 
+    def testQuasiRandomSampling(self):
+        self._sc.add_param("param1", start=-1., stop=1., num=2)
+        self._sc.add_param("param2", lb=-10., ub=20)
+        self._sc.add_param("param3", value=1., sigma=0.1)
+
+        with self.assertRaisesRegex(ValueError, "Unknown sampling method"):
+            self._sc._generate_param_sequence(10, sampling='grid')
+
+        n = 64
+        for sampling in ['sobol', 'halton', 'lhs']:
+            with self.subTest(sampling):
+                lst = self._sc._generate_param_sequence(n, sampling=sampling, seed=1)
+                self.assertListEqual(
+                    lst, self._sc._generate_param_sequence(n, sampling=sampling, seed=1))
+                self.assertEqual(2 * n, len(lst))
+                lst1, lst2, lst3 = (np.array(x) for x in zip(*lst))
+                np.testing.assert_array_equal([-1.] * n + [1.] * n, np.sort(lst1))
+                self.assertTrue(np.all(lst2 >= -10) and np.all(lst2 < 20))
+                self.assertLess(np.abs(np.mean(lst2) - 5.), 0.1)
+                self.assertLess(np.abs(np.mean(lst3) - 1.), 0.002)
+                self.assertLess(np.abs(np.std(lst3) - 0.1), 0.005)
+
+        # the sampled parameters are stratified jointly over all the points
+        lst = self._sc._generate_param_sequence(n, sampling='lhs', seed=1)
+        lst2 = np.array([item[1] for item in lst])
+        np.testing.assert_array_equal(
+            np.arange(2 * n), np.sort(np.floor((lst2 + 10.) / 30. * 2 * n)))
+
     def testScan(self):
 
         with patch.object(self._sc._linac['gun'], 'async_run') as patched_run:
@@ -160,19 +188,161 @@ class TestLinacScan(unittest.TestCase):
                     sim = open_sim(tmp_dir)
                     np.testing.assert_array_equal(np.arange(1, 19) + 10, sorted(sim.sim_ids))
 
+            with self.subTest("Test errors in the writer thread"):
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    with patch('liso.io.writer.SimWriter._write',
+                               side_effect=OSError("disk full")):
+                        with self.assertRaisesRegex(OSError, "disk full"):
+                            self._sc.scan(2, output_dir=tmp_dir, queue_size=2)
+
+            with self.subTest("Test MPI ranks"):
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    with self.assertRaisesRegex(ValueError, "exceeds the number of cores"):
+                        self._sc.scan(2, output_dir=tmp_dir, n_workers={'gun': 8}, n_cores=4)
+
+                    patched_run.reset_mock()
+                    self._sc.scan(1, output_dir=tmp_dir, n_workers={'gun': 2}, n_cores=4)
+                    self.assertEqual(9, patched_run.call_count)
+                    kwargs = patched_run.call_args[1]
+                    self.assertEqual(2, kwargs['n_workers'])
+                    self.assertEqual(4, kwargs['scheduler'].n_cores)
+
+            with self.subTest("Test process pool"):
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    self._sc.scan(1, output_dir=tmp_dir, processes=True)
+                    self.assertIsInstance(
+                        patched_run.call_args[1]['executor'], ProcessPoolExecutor)
+                    self.assertEqual(9, len(open_sim(tmp_dir).sim_ids))
+
+            with self.subTest("Test work queue"):
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    queue_file = osp.join(tmp_dir, "queue.db")
+                    self.assertEqual(18, self._sc.publish(queue_file, 2, seed=1))
+                    self.assertEqual(9, self._sc.publish(queue_file, 1, start_id=101))
+
+                    # workers do not need the scan parameters
+                    worker_sc = LinacScan(self._sc._linac)
+                    output_dir = osp.join(tmp_dir, "data")
+                    # the first worker stops after 5 points
+                    claim = WorkQueue.claim
+                    n_claims = iter(range(5))
+                    with patch.object(WorkQueue, 'claim', autospec=True, side_effect=lambda q, w: (
+                            claim(q, w) if next(n_claims, None) is not None else None)), \
+                            patch.object(WorkQueue, 'complete', autospec=True,
+                                         side_effect=WorkQueue.complete) as patched_complete:
+                        worker_sc.work(queue_file, output_dir, worker='w1', n_tasks=2)
+                    # the points are completed when the file is closed
+                    patched_complete.assert_called_once()
+                    self.assertListEqual([1, 2, 3, 4, 5],
+                                         sorted(patched_complete.call_args[0][1]))
+                    # the group of w1 is freed and reused by w2
+                    worker_sc.work(queue_file, output_dir, worker='w2', n_tasks=2)
+                    # a file which was not closed by a dead worker
+                    pathlib.Path(output_dir, 'SIM-G01-S000002.hdf5').touch()
+                    worker_sc.work(queue_file, output_dir, worker='w3')
+
+                    sim = open_sim(output_dir)
+                    np.testing.assert_array_equal(
+                        np.concatenate([np.arange(1, 19), np.arange(101, 110)]),
+                        sorted(sim.sim_ids))
+                    self.assertSetEqual(
+                        {'gun/gun_gradient', 'gun/gun_phase'}, sim.control_channels)
+                    self.assertListEqual(
+                        ['SCAN-G01.log', 'SIM-G01-S000000.hdf5', 'SIM-G01-S000001.hdf5',
+                         'SIM-G01-S000002.hdf5.incomplete'],
+                        sorted(p.name for p in pathlib.Path(output_dir).iterdir()))
+                    with WorkQueue(queue_file) as queue:
+                        self.assertDictEqual(
+                            {'pending': 0, 'running': 0, 'done': 27, 'failed': 0},
+                            queue.counts())
+                        self.assertEqual(1, queue.register('w4'))
+
             with self.subTest("Test chmod"):
                 with tempfile.TemporaryDirectory() as tmp_dir:
                     self._sc.scan(2, output_dir=tmp_dir)
                     path = pathlib.Path(tmp_dir)
-                    for file in path.iterdir():
+                    for file in path.glob("*.hdf5"):
                         self.assertEqual('400', oct(file.stat().st_mode)[-3:])
 
                 with tempfile.TemporaryDirectory() as tmp_dir:
                     self._sc.scan(2, output_dir=tmp_dir, chmod=False)
                     path = pathlib.Path(tmp_dir)
-                    for file in path.iterdir():
+                    for file in path.glob("*.hdf5"):
                         self.assertNotEqual('400', oct(file.stat().st_mode)[-3:])
 
+    def testResume(self):
+        # scan() seeds the global random state
+        self.addCleanup(np.random.set_state, np.random.get_state())
+
+        ps = Phasespace(pd.DataFrame(
+            columns=['x', 'px', 'y', 'py', 'z', 'pz', 't']), 0.1)
+        n_calls = 0
+
+        def _run(*args, **kwargs):
+            nonlocal n_calls
+            n_calls += 1
+            if n_calls == 8:
+                raise RuntimeError("crashed")
+            return ps
+
+        self._sc.add_param('gun_gradient', start=1., stop=3., num=3)
+        self._sc.add_param('gun_phase', value=10., sigma=1.)
+        with patch.object(self._sc._linac['gun'], 'async_run', side_effect=_run):
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                with self.assertRaises(FileNotFoundError):
+                    self._sc.scan(4, output_dir=tmp_dir, resume=True)
+
+                with self.assertRaisesRegex(RuntimeError, "crashed"):
+                    self._sc.scan(4, output_dir=tmp_dir, n_tasks=1, start_id=5, seed=1,
+                                  journal=True)
+                path = pathlib.Path(tmp_dir)
+                with np.load(path.joinpath("SCAN-G01.npz")) as data:
+                    planned = dict(zip(data['ids'], data['sequence']))
+                self.assertEqual(12, len(planned))
+                # the file was closed after the exception
+                self.assertEqual(7, len(open_sim(tmp_dir).sim_ids))
+
+                with self.assertRaisesRegex(FileExistsError, "resume=True"):
+                    self._sc.scan(4, output_dir=tmp_dir, journal=True)
+
+                # a file which was not closed, e.g. killed by the system
+                path.joinpath("SIM-G01-S000001.hdf5").touch()
+
+                n_calls = 0
+                self._sc.scan(1, output_dir=tmp_dir, seed=2, resume=True)
+                self.assertEqual(5, n_calls)
+                self.assertListEqual(
+                    ['SIM-G01-S000000.hdf5', 'SIM-G01-S000001.hdf5.incomplete',
+                     'SIM-G01-S000002.hdf5'],
+                    sorted(p.name for p in path.glob("SIM-*")))
+
+                sim = open_sim(tmp_dir)
+                np.testing.assert_array_equal(np.arange(5, 17), sorted(sim.sim_ids))
+                controls = sim.get_controls()
+                for sim_id, values in planned.items():
+                    np.testing.assert_array_equal(
+                        values.astype(np.float32),
+                        controls.loc[sim_id, ['gun/gun_gradient', 'gun/gun_phase']])
+
+                # nothing left
+                self._sc.scan(1, output_dir=tmp_dir, resume=True)
+                self.assertEqual(5, n_calls)
+
+                other = LinacScan(self._sc._linac)
+                other.add_param('gun_phase', value=10., sigma=1.)
+                other.add_param('gun_gradient', start=1., stop=3., num=3)
+                with self.assertRaisesRegex(ValueError, "differ from the ones in the journal"):
+                    other.scan(1, output_dir=tmp_dir, resume=True)
+
+            # the journal is opt-in
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                n_calls = 0
+                self._sc.scan(1, output_dir=tmp_dir, group=2)
+                self.assertEqual(3, n_calls)
+                self.assertListEqual(
+                    ['SIM-G02-S000000.hdf5'],
+                    sorted(p.name for p in pathlib.Path(tmp_dir).iterdir()))
+
 
 _PID0 = 1000
 
@@ -188,13 +358,6 @@ def _side_effect_read(dataset, address):
 
 
 class TestMachineScan(unittest.TestCase):
-    def setUp(self):
-        self._orig_image_chunk = ExpWriter._IMAGE_CHUNK
-        ExpWriter._IMAGE_CHUNK = (3, 2)
-
-    def tearDown(self):
-        ExpWriter._IMAGE_CHUNK = self._orig_image_chunk
-
     def run(self, result=None):
         with tempfile.TemporaryDirectory() as tmp_dir:
             self._tmp_dir = tmp_dir
@@ -289,13 +452,13 @@ class TestMachineScan(unittest.TestCase):
         with tempfile.TemporaryDirectory() as tmp_dir:
             sc.scan(10, output_dir=tmp_dir, timeout=0.001)
             path = pathlib.Path(tmp_dir).joinpath('r0001')
-            for file in path.iterdir():
+            for file in path.glob("*.hdf5"):
                 self.assertEqual('400', oct(file.stat().st_mode)[-3:])
 
         with tempfile.TemporaryDirectory() as tmp_dir:
             sc.scan(10, output_dir=tmp_dir, chmod=False, timeout=0.001)
             path = pathlib.Path(tmp_dir).joinpath('r0001')
-            for file in path.iterdir():
+            for file in path.glob("*.hdf5"):
                 self.assertNotEqual('400', oct(file.stat().st_mode)[-3:])
 
     @patch("liso.experiment.machine.pydoocs_write")
@@ -352,3 +515,35 @@ class TestMachineScan(unittest.TestCase):
             with self.assertRaisesRegex(RuntimeError,
                                         "Failed to read all the initial values"):
                 sc.scan(10, output_dir=tmp_dir, timeout=0.01)
+
+    @patch("liso.experiment.machine.pydoocs_write")
+    @patch("liso.experiment.machine.pydoocs_read")
+    def testResume(self, patched_read, patched_write):
+        sc = self._sc
+        dataset = self._prepare_dataset()
+        patched_read.side_effect = lambda x: _side_effect_read(dataset, x)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with self.assertRaises(FileNotFoundError):
+                sc.scan(10, output_dir=tmp_dir, resume=True)
+
+            sc.add_param('XFEL.A/B/C/D', lb=-3, ub=3)
+            sc.scan(10, output_dir=tmp_dir, timeout=0.1, journal=True)
+            path = pathlib.Path(tmp_dir).joinpath('r0001')
+            with np.load(path.joinpath("SCAN-G01.npz")) as data:
+                planned = data['sequence'][:, 0]
+
+            # forget the last file
+            path.joinpath("SCAN-G01.log").write_text("")
+            patched_write.reset_mock()
+            sc.scan(10, output_dir=tmp_dir, timeout=0.1, resume=True)
+
+            # the scan continues in the same run folder
+            self.assertListEqual(['r0001'], [p.name for p in pathlib.Path(tmp_dir).iterdir()])
+            self.assertListEqual(
+                ['RAW-R0001-G01-S000000.hdf5.incomplete', 'RAW-R0001-G01-S000001.hdf5'],
+                sorted(p.name for p in path.glob("RAW-*")))
+            written = [c[0][1] for c in patched_write.call_args_list
+                       if c[0][0] == 'XFEL.A/B/C/D']
+            np.testing.assert_array_equal(planned, written)
+            open_run(path).info()
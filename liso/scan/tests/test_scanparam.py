@@ -1,8 +1,11 @@
 import unittest
+import warnings
 
 import numpy as np
 
-from liso.scan.scan_param import JitterParam, SampleParam, StepParam
+from liso.scan.scan_param import (
+    JitterParam, SampleParam, StepParam, sample_unit_hypercube
+)
 
 
 class TestStepParam(unittest.TestCase):
@@ -66,3 +69,59 @@ class TestStepParam(unittest.TestCase):
         self.assertEqual(600, len(param_lst))
         self.assertTrue(np.all(param_lst >= -4))
         self.assertTrue(np.all(param_lst < 6))
+
+    def testUniformSamples(self):
+        u = np.array([0.05, 0.5, 0.95, 0.])
+
+        param = SampleParam('param', lb=-4, ub=6)
+        np.testing.assert_array_almost_equal([-3.5, 1., 5.5, -4.], param.generate(repeats=4, u=u))
+
+        param = JitterParam('param', value=1., sigma=0.1)
+        lst = param.generate(repeats=2, cycles=2, u=u)
+        self.assertAlmostEqual(1. - 0.1 * 1.6448536, lst[0])
+        self.assertEqual(1., lst[1])
+        self.assertAlmostEqual(1. + 0.1 * 1.6448536, lst[2])
+        self.assertTrue(np.isfinite(lst[3]))
+
+        param = StepParam('param', start=-1., stop=1., num=2, sigma=-0.1)
+        lst = param.generate(repeats=1, cycles=2, u=u)
+        np.testing.assert_array_almost_equal(
+            [-1. * (1 + 0.1 * 1.6448536), 1., -1. * (1 - 0.1 * 1.6448536)], lst[:3])
+
+        self.assertFalse(StepParam('param', start=-1., stop=1., num=2).is_random)
+        self.assertFalse(JitterParam('param', value=1.).is_random)
+        self.assertTrue(SampleParam('param', lb=0., ub=1.).is_random)
+
+
+class TestSampling(unittest.TestCase):
+    def testSampleUnitHypercube(self):
+        with self.assertRaisesRegex(ValueError, "Unknown sampling method"):
+            sample_unit_hypercube('random', 10, 2)
+
+        for method in ['sobol', 'halton', 'lhs']:
+            with self.subTest(method):
+                samples = sample_unit_hypercube(method, 100, 3, seed=1)
+                self.assertTupleEqual((100, 3), samples.shape)
+                self.assertTrue(np.all(samples >= 0) and np.all(samples < 1))
+                np.testing.assert_array_equal(
+                    samples, sample_unit_hypercube(method, 100, 3, seed=1))
+                self.assertFalse(np.array_equal(
+                    samples, sample_unit_hypercube(method, 100, 3, seed=2)))
+                # much more even than pseudo-random numbers
+                np.testing.assert_allclose(0.5, samples.mean(axis=0), atol=0.01)
+
+        with self.assertWarnsRegex(UserWarning, "power of 2"):
+            sample_unit_hypercube('sobol', 100, 2)
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            samples = sample_unit_hypercube('sobol', 64, 2, seed=0)
+        # each of the 4 x 4 elementary intervals contains exactly 4 points
+        counts = np.histogram2d(samples[:, 0], samples[:, 1], bins=4,
+                                range=[[0, 1], [0, 1]])[0]
+        np.testing.assert_array_equal(np.full((4, 4), 4), counts)
+
+        # each interval of a Latin hypercube contains exactly one point
+        samples = sample_unit_hypercube('lhs', 50, 2, seed=0)
+        for i in range(2):
+            np.testing.assert_array_equal(
+                np.arange(50), np.sort(np.floor(samples[:, i] * 50)))
@@ -0,0 +1,104 @@
+import unittest
+from unittest.mock import patch
+from concurrent.futures import ProcessPoolExecutor
+import os.path as osp
+import tempfile
+import time
+
+from liso import WorkQueue
+
+
+def _claim_all(path, worker):
+    ret = []
+    with WorkQueue(path) as queue:
+        while True:
+            point = queue.claim(worker)
+            if point is None:
+                return ret
+            ret.append(point[0])
+
+
+class TestWorkQueue(unittest.TestCase):
+    def run(self, result=None):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self._path = osp.join(tmp_dir, "queue.db")
+            super().run(result)
+
+    def testGeneral(self):
+        with WorkQueue(self._path) as queue:
+            self.assertListEqual([], queue.params)
+            self.assertIsNone(queue.claim('w1'))
+
+            queue.publish(['a', 'b'], [(1., 2.), (3., 4.), (5., 6.)], start_id=10)
+            self.assertListEqual(['a', 'b'], queue.params)
+            with self.assertRaisesRegex(ValueError, "differ from the published"):
+                queue.publish(['a'], [(1.,)], start_id=20)
+            with self.assertRaisesRegex(ValueError, "already been published"):
+                queue.publish(['a', 'b'], [(1., 2.)], start_id=12)
+            # nothing is published if the transaction failed
+            self.assertEqual(3, queue.counts()['pending'])
+
+        # persistent
+        with WorkQueue(self._path) as queue:
+            self.assertTupleEqual((10, {'a': 1., 'b': 2.}), queue.claim('w1'))
+            self.assertTupleEqual((11, {'a': 3., 'b': 4.}), queue.claim('w2'))
+            self.assertTupleEqual((12, {'a': 5., 'b': 6.}), queue.claim('w2'))
+            self.assertIsNone(queue.claim('w1'))
+            self.assertDictEqual(
+                {'pending': 0, 'running': 3, 'done': 0, 'failed': 0}, queue.counts())
+
+            queue.complete([10])
+            queue.fail([(11, "error")])
+            self.assertDictEqual(
+                {'pending': 0, 'running': 1, 'done': 1, 'failed': 1}, queue.counts())
+
+            self.assertEqual(0, queue.requeue(worker='w1'))
+            self.assertEqual(1, queue.requeue(worker='w2'))
+            self.assertEqual(1, queue.requeue(failed=True))
+            self.assertListEqual([11, 12], [queue.claim('w1')[0] for _ in range(2)])
+
+    def testHeartbeat(self):
+        with WorkQueue(self._path) as queue:
+            queue.publish(['a'], [(1.,), (2.,), (3.,)])
+            t0 = time.time()
+            queue.claim('w1')
+            queue.claim('w2')
+            queue.claim('w2')
+            queue.fail([(3, "error")])
+            self.assertEqual(0, queue.requeue(expired=60.))
+
+            with patch('liso.scan.work_queue.time.time', return_value=t0 + 100.):
+                self.assertEqual(1, queue.heartbeat('w1'))
+                # the lease of w2 has expired
+                self.assertEqual(0, queue.requeue(worker='w1', expired=60.))
+                self.assertEqual(1, queue.requeue(expired=60.))
+                self.assertEqual(1, queue.requeue(failed=True, expired=60.))
+            self.assertDictEqual(
+                {'pending': 2, 'running': 1, 'done': 0, 'failed': 0}, queue.counts())
+
+    def testRegister(self):
+        with WorkQueue(self._path) as queue:
+            self.assertEqual(1, queue.register('w1'))
+            self.assertEqual(2, queue.register('w2'))
+            self.assertEqual(1, queue.register('w1'))
+            for i in range(3, 100):
+                self.assertEqual(i, queue.register(f'w{i}'))
+            with self.assertRaisesRegex(ValueError, "writer groups"):
+                queue.register('w100')
+
+            # a freed group is reused
+            queue.unregister('w2')
+            self.assertEqual(2, queue.register('w100'))
+
+    def testMultiProcess(self):
+        n = 200
+        with WorkQueue(self._path) as queue:
+            queue.publish(['a'], [(i,) for i in range(n)])
+
+        with ProcessPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(_claim_all, self._path, f'w{i}')
+                       for i in range(4)]
+            claimed = [i for fut in futures for i in fut.result()]
+
+        # each point is claimed exactly once
+        self.assertListEqual(list(range(1, n + 1)), sorted(claimed))
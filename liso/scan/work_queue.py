@@ -0,0 +1,273 @@
+"""
+Distributed under the terms of the GNU General Public License v3.0.
+
+The full license is in the file LICENSE, distributed with this software.
+
+Copyright (C) Jun Zhu. All rights reserved.
+"""
+from contextlib import contextmanager
+import json
+import sqlite3
+import threading
+import time
+
+
+class WorkQueue:
+    """Durable queue of scan points shared by distributed workers.
+
+    The queue is an SQLite database file. A coordinator publishes the
+    parameter points and any number of worker processes, which can be
+    on different nodes if the file is on a shared file system, claim
+    and simulate them one by one. Each point is claimed by exactly one
+    worker.
+
+    A worker refreshes the lease of its claimed points by heartbeat(),
+    so that the points of a worker which has died can be told from the
+    ones of a slow worker and requeued.
+
+    Note that the locking of SQLite relies on the file system. Some
+    network file systems do not implement it correctly.
+    """
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    # maximum number of writer groups, see SimWriter
+    _MAX_GROUPS = 99
+
+    def __init__(self, path, *, timeout=60.):
+        """Initialization.
+
+        The database is created if it does not exist.
+
+        :param str path: path of the database file.
+        :param float timeout: maximum time in seconds waiting for the
+            lock of the database held by another process.
+        """
+        self._path = str(path)
+        # the connection is shared with the writer thread of a worker
+        self._conn = sqlite3.connect(self._path,
+                                     timeout=timeout,
+                                     isolation_level=None,
+                                     check_same_thread=False)
+        self._lock = threading.RLock()
+
+        with self._transaction() as cursor:
+            cursor.execute("CREATE TABLE IF NOT EXISTS params ("
+                           "position INTEGER PRIMARY KEY, "
+                           "name TEXT UNIQUE NOT NULL)")
+            cursor.execute("CREATE TABLE IF NOT EXISTS points ("
+                           "sim_id INTEGER PRIMARY KEY, "
+                           "params TEXT NOT NULL, "
+                           "status TEXT NOT NULL, "
+                           "worker TEXT, "
+                           "attempts INTEGER NOT NULL DEFAULT 0, "
+                           "error TEXT, "
+                           "updated REAL)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS points_status "
+                           "ON points (status, sim_id)")
+            cursor.execute("CREATE TABLE IF NOT EXISTS workers ("
+                           "grp INTEGER PRIMARY KEY, "
+                           "name TEXT UNIQUE NOT NULL, "
+                           "started REAL)")
+
+    @contextmanager
+    def _transaction(self):
+        """Execute statements in a transaction holding the write lock."""
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                yield cursor
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+            else:
+                cursor.execute("COMMIT")
+            finally:
+                cursor.close()
+
+    @property
+    def params(self):
+        """Return the names of the scan parameters."""
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                "SELECT name FROM params ORDER BY position")]
+
+    def publish(self, params, points, *, start_id=1):
+        """Publish parameter points.
+
+        :param list params: names of the scan parameters.
+        :param list points: values of the scan parameters at each point.
+        :param int start_id: simulation id of the first point.
+
+        :raise ValueError: if the parameters differ from the published
+            ones or a simulation id has already been published.
+        """
+        params = list(params)
+        now = time.time()
+        with self._transaction() as cursor:
+            published = [row[0] for row in cursor.execute(
+                "SELECT name FROM params ORDER BY position")]
+            if not published:
+                cursor.executemany("INSERT INTO params VALUES (?, ?)",
+                                   enumerate(params))
+            elif published != params:
+                raise ValueError(f"Scan parameters {params} differ from the "
+                                 f"published ones: {published}")
+
+            try:
+                cursor.executemany(
+                    "INSERT INTO points (sim_id, params, status, updated) "
+                    "VALUES (?, ?, ?, ?)",
+                    ((start_id + i, json.dumps([float(v) for v in point]),
+                      self.PENDING, now) for i, point in enumerate(points)))
+            except sqlite3.IntegrityError:
+                raise ValueError("Simulation ids starting from "
+                                 f"{start_id} have already been published!")
+
+    def claim(self, worker):
+        """Claim the pending point with the smallest simulation id.
+
+        :param str worker: name of the worker.
+
+        :return tuple/None: (simulation id, parameter mapping) or None if
+            there is no pending point.
+        """
+        with self._transaction() as cursor:
+            row = cursor.execute(
+                "SELECT sim_id, params FROM points WHERE status = ? "
+                "ORDER BY sim_id LIMIT 1", (self.PENDING,)).fetchone()
+            if row is None:
+                return
+            cursor.execute(
+                "UPDATE points SET status = ?, worker = ?, "
+                "attempts = attempts + 1, updated = ? WHERE sim_id = ?",
+                (self.RUNNING, worker, time.time(), row[0]))
+            names = [r[0] for r in cursor.execute(
+                "SELECT name FROM params ORDER BY position")]
+
+        return row[0], dict(zip(names, json.loads(row[1])))
+
+    def complete(self, sim_ids):
+        """Mark points as done.
+
+        :param list sim_ids: simulation ids.
+        """
+        now = time.time()
+        with self._transaction() as cursor:
+            cursor.executemany(
+                "UPDATE points SET status = ?, error = NULL, updated = ? "
+                "WHERE sim_id = ?",
+                ((self.DONE, now, int(i)) for i in sim_ids))
+
+    def fail(self, failures):
+        """Mark points as failed.
+
+        :param list failures: (simulation id, error message) pairs.
+        """
+        now = time.time()
+        with self._transaction() as cursor:
+            cursor.executemany(
+                "UPDATE points SET status = ?, error = ?, updated = ? "
+                "WHERE sim_id = ?",
+                ((self.FAILED, str(err), now, int(i)) for i, err in failures))
+
+    def heartbeat(self, worker):
+        """Refresh the lease of the running points claimed by a worker.
+
+        :param str worker: name of the worker.
+
+        :return int: number of running points of the worker.
+        """
+        with self._transaction() as cursor:
+            return cursor.execute(
+                "UPDATE points SET updated = ? WHERE status = ? "
+                "AND worker = ?", (time.time(), self.RUNNING, worker)).rowcount
+
+    def requeue(self, *, worker=None, failed=False, expired=None):
+        """Put running points back to the queue.
+
+        It should be called for the points claimed by a worker which
+        has died.
+
+        :param str/None worker: name of the worker. If None, the points
+            claimed by all the workers are requeued.
+        :param bool failed: True for requeuing the failed points as well.
+        :param float/None expired: if given, only the running points
+            whose lease has not been refreshed for longer than this time
+            in seconds are requeued. It should be a few times the
+            heartbeat interval of the workers.
+
+        :return int: number of requeued points.
+        """
+        now = time.time()
+        sql = "UPDATE points SET status = ?, updated = ? WHERE ((status = ?"
+        args = [self.PENDING, now, self.RUNNING]
+        if expired is not None:
+            sql += " AND updated < ?"
+            args.append(now - expired)
+        sql += ")"
+        if failed:
+            sql += " OR status = ?"
+            args.append(self.FAILED)
+        sql += ")"
+        if worker is not None:
+            sql += " AND worker = ?"
+            args.append(worker)
+
+        with self._transaction() as cursor:
+            return cursor.execute(sql, args).rowcount
+
+    def register(self, worker):
+        """Register a worker and return its writer group.
+
+        A worker which has been registered gets the same group.
+
+        :param str worker: name of the worker.
+
+        :return int: writer group (1-99) unique to the worker.
+        """
+        with self._transaction() as cursor:
+            row = cursor.execute("SELECT grp FROM workers WHERE name = ?",
+                                 (worker,)).fetchone()
+            if row is not None:
+                return row[0]
+
+            groups = {r[0] for r in cursor.execute("SELECT grp FROM workers")}
+            for group in range(1, self._MAX_GROUPS + 1):
+                if group not in groups:
+                    cursor.execute("INSERT INTO workers VALUES (?, ?, ?)",
+                                   (group, worker, time.time()))
+                    return group
+
+        raise ValueError(
+            f"All the {self._MAX_GROUPS} writer groups have been used!")
+
+    def unregister(self, worker):
+        """Unregister a worker and free its writer group.
+
+        :param str worker: name of the worker.
+        """
+        with self._transaction() as cursor:
+            cursor.execute("DELETE FROM workers WHERE name = ?", (worker,))
+
+    def counts(self):
+        """Return the number of points in each status."""
+        ret = dict.fromkeys(
+            (self.PENDING, self.RUNNING, self.DONE, self.FAILED), 0)
+        with self._lock:
+            ret.update(self._conn.execute(
+                "SELECT status, COUNT(*) FROM points GROUP BY status"))
+        return ret
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
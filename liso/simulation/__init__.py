@@ -1,3 +1,4 @@
+from .cache import SimulationCache
 from .input import ParticleFileGenerator
 from .linac import Linac
 
@@ -5,4 +6,5 @@ from .linac import Linac
 __all__ = [
     'Linac',
     'ParticleFileGenerator',
+    'SimulationCache',
 ]
@@ -8,7 +8,9 @@ Copyright (C) Jun Zhu. All rights reserved.
 import asyncio
 import os.path as osp
 from abc import ABC, abstractmethod
+from collections import namedtuple
 import subprocess
+import uuid
 from distutils.spawn import find_executable
 
 import numpy as np
@@ -28,6 +30,60 @@ from ..simulation import ParticleFileGenerator
 from ..io import TempSimulationDirectory
 
 
+def _check_file(filepath, title=''):
+    if not osp.isfile(filepath):
+        raise LisoRuntimeError(f"{title} file {filepath} does not exist!")
+    if not osp.getsize(filepath):
+        raise LisoRuntimeError(f"{title} file {filepath} is empty!")
+
+
+def _read_phasespace(parse, filepath, charge):
+    """Read an output particle file.
+
+    :param callable parse: parser of the particle file.
+    :param str filepath: path of the particle file.
+    :param float/None charge: bunch charge set if it is not given in the
+        particle file.
+
+    :return Phasespace: particle phasespace.
+    """
+    _check_file(filepath, 'Output')
+
+    ps = parse(filepath)
+    if ps.charge is None:
+        ps.charge = charge
+    return ps
+
+
+def _load_output(parse, filepath, charge):
+    """Read and analyze an output particle file.
+
+    It does not touch the beamline, so it can be run concurrently in a
+    thread or a process pool.
+
+    :return tuple: (Phasespace, BeamParameters).
+    """
+    ps = _read_phasespace(parse, filepath, charge)
+    return ps, ps.analyze()
+
+
+class BeamlineResult(namedtuple(
+        'BeamlineResult',
+        ['phasespace', 'out', 'start', 'end', 'min', 'max', 'avg', 'std'])):
+    """Immutable result of a single simulation of a beamline.
+
+    The field names are the same as the corresponding properties of
+    Beamline.
+
+    Attributes:
+        phasespace (Phasespace): output phasespace.
+        out (BeamParameters): parameters of the output phasespace.
+        start, end, min, max, avg, std (LineParameters): statistics of
+            the beam evolution along the beamline.
+    """
+    __slots__ = ()
+
+
 class Beamline(ABC):
     """Beamline abstraction class."""
 
@@ -121,8 +177,12 @@ class Beamline(ABC):
         """Parse the template input file."""
         raise NotImplementedError
 
-    def compile(self, mapping):
-        self._input_gen.update(mapping)
+    def compile(self, mapping, input_=None):
+        self._input_gen.update(mapping, input_)
+
+    def render(self, mapping):
+        """Return the rendered input without updating the beamline."""
+        return self._input_gen.render(mapping)
 
     @abstractmethod
     def _generate_initial_particle_file(self, data, swd):
@@ -183,12 +243,6 @@ class Beamline(ABC):
     def _get_executable(self, parallel):
         raise NotImplementedError
 
-    def _check_file(self, filepath, title=''):
-        if not osp.isfile(filepath):
-            raise LisoRuntimeError(f"{title} file {filepath} does not exist!")
-        if not osp.getsize(filepath):
-            raise LisoRuntimeError(f"{title} file {filepath} is empty!")
-
     def _check_executable(self, parallel=False):
         filepath = self._get_executable(parallel)
         executable = find_executable(filepath)
@@ -196,6 +250,14 @@ class Beamline(ABC):
             f"executable [{filepath}] is not available"
         return executable
 
+    def _read_output(self, swd):
+        """Read output particle file.
+
+        :param str swd: simulation working directory.
+        """
+        return _read_phasespace(
+            self._parse_phasespace, osp.join(swd, self._pout), self._charge)
+
     def _update_output(self, swd):
         """Analyse output particle file.
 
@@ -203,30 +265,66 @@ class Beamline(ABC):
 
         :param str swd: simulation working directory.
         """
-        pout = osp.join(swd, self._pout)
-        self._check_file(pout, 'Output')
-
-        ps = self._parse_phasespace(pout)
-        if ps.charge is None:
-            ps.charge = self._charge
+        ps = self._read_output(swd)
         self._out = ps.analyze()
         return ps
 
-    def _update_statistics(self):
-        """Analysis output beam evolution files."""
-        rootname = osp.join(self._swd, self._rootname)
+    def _analyze_statistics(self, swd):
+        """Analysis output beam evolution files.
+
+        :param str swd: simulation working directory.
+
+        :return dict: LineParameters of start, end, min, max, avg and std.
+        """
+        rootname = osp.join(swd, self._rootname)
         for suffix in self._output_suffixes:
-            self._check_file(rootname + suffix, 'Output')
+            _check_file(rootname + suffix, 'Output')
 
         data = self._parse_line(rootname)
-        self._start = analyze_line(data, lambda x: x.iloc[0])
-        self._end = analyze_line(data, lambda x: x.iloc[-1])
-        self._min = analyze_line(data, np.min)
-        self._max = analyze_line(data, np.max)
-        self._avg = analyze_line(data, np.average)
-        self._std = analyze_line(data, np.std)
+        return {
+            'start': analyze_line(data, lambda x: x.iloc[0]),
+            'end': analyze_line(data, lambda x: x.iloc[-1]),
+            'min': analyze_line(data, np.min),
+            'max': analyze_line(data, np.max),
+            'avg': analyze_line(data, np.average),
+            'std': analyze_line(data, np.std),
+        }
 
-    def _run_core(self, n_workers, timeout):
+    def _get_result(self, phasespace):
+        """Return the result of the last run().
+
+        :param Phasespace phasespace: output phasespace.
+        """
+        return BeamlineResult(phasespace, self._out, self._start, self._end,
+                              self._min, self._max, self._avg, self._std)
+
+    def _set_result(self, result):
+        """Update the output and statistics with the given result.
+
+        :param BeamlineResult result: result of a previous simulation.
+
+        :return Phasespace: output phasespace.
+        """
+        self._out = result.out
+        self._start = result.start
+        self._end = result.end
+        self._min = result.min
+        self._max = result.max
+        self._avg = result.avg
+        self._std = result.std
+        return result.phasespace
+
+    def _update_statistics(self):
+        """Analysis output beam evolution files."""
+        stats = self._analyze_statistics(self._swd)
+        self._start = stats['start']
+        self._end = stats['end']
+        self._min = stats['min']
+        self._max = stats['max']
+        self._avg = stats['avg']
+        self._std = stats['std']
+
+    def _get_command(self, n_workers, timeout):
         executable = self._check_executable(n_workers > 1)
 
         # self._fin must be in the swd
@@ -236,6 +334,10 @@ class Beamline(ABC):
 
         if timeout is not None:
             command = f"timeout {timeout}s " + command
+        return command
+
+    def _run_core(self, n_workers, timeout):
+        command = self._get_command(n_workers, timeout)
 
         try:
             # We do not want to generate a full history of the simulation
@@ -268,23 +370,27 @@ class Beamline(ABC):
 
         return self._update_output(self._swd)
 
-    async def _async_run_core(self, swd, timeout):
-        executable = self._check_executable()
+    async def _async_run_core(self, swd, timeout, n_workers=1,
+                              scheduler=None):
+        if not isinstance(n_workers, int) or not n_workers > 0:
+            raise ValueError("n_workers must be a positive integer!")
 
-        # self._fin must be in the swd
-        command = f"{executable} {self._fin}"
-        if timeout is not None:
-            command = f"timeout {timeout}s " + command
+        if scheduler is None:
+            await self._async_run_process(swd, timeout, n_workers)
+        else:
+            async with scheduler.reserve(n_workers):
+                await self._async_run_process(swd, timeout, n_workers)
+
+    async def _async_run_process(self, swd, timeout, n_workers):
+        command = self._get_command(n_workers, timeout)
 
         # Astra will find external files in the simulation working
         # directory but output files in the directory where the input
         # file is located.
 
         # We do not want to generate a full history of the simulation
-        # log. The current one is good enough for debugging. It is not
-        # a problem even if different processes write the file
-        # interleavingly.
-        with open(f'simulation.log', "w") as out_file:
+        # log. The current one is good enough for debugging.
+        with open(osp.join(swd, 'simulation.log'), "w") as out_file:
             # It does not raise even if command
             proc = await asyncio.create_subprocess_shell(
                 command,
@@ -295,20 +401,85 @@ class Beamline(ABC):
 
             _, err = await proc.communicate()
 
-    async def async_run(self, phasespace, tmp_dir, *, timeout):
-        """Run simulation asynchronously for the beamline."""
+    async def async_run(self, phasespace, tmp_dir, *, timeout, input_=None,
+                        executor=None, n_workers=1, scheduler=None):
+        """Run simulation asynchronously for the beamline.
+
+        :param tuple/None input_: lines of the input returned by render().
+            If None, the input from the last compile() will be used.
+        :param concurrent.futures.Executor executor: executor which writes
+            the initial particle file and parses and analyzes the output
+            particle file, so that the event loop is not blocked by the
+            CPU-bound work. It can be a ProcessPoolExecutor since the
+            beamline is only updated in the event loop. If None, the
+            default executor of the event loop is used.
+        :param int n_workers: number of MPI ranks of the simulation. The
+            parallel executable is run by mpirun if it is larger than 1.
+        :param CoreScheduler/None scheduler: if given, the simulation
+            does not start until n_workers cores are reserved.
+        """
+        loop = asyncio.get_event_loop()
         with TempSimulationDirectory(osp.join(self._swd, tmp_dir),
                                      delete_old=True) as swd:
 
             if phasespace is not None:
-                self._generate_initial_particle_file(phasespace, swd)
+                await loop.run_in_executor(
+                    executor, self._generate_initial_particle_file,
+                    phasespace, swd)
 
             # need absolute path here
-            self._input_gen.write(osp.join(swd, self._fin))
+            self._input_gen.write(osp.join(swd, self._fin), input_)
+
+            await self._async_run_core(swd, timeout, n_workers, scheduler)
+
+            ps, self._out = await loop.run_in_executor(
+                executor, _load_output, self._parse_phasespace,
+                osp.join(swd, self._pout), self._charge)
+            return ps
+
+    async def async_evaluate(self, phasespace, *, input_, timeout=None,
+                             executor=None, n_workers=1, scheduler=None):
+        """Run simulation asynchronously and return the result.
+
+        The simulation is run in a scratch directory unique to this call
+        and the beamline is not modified. Therefore, it is safe to
+        evaluate the same beamline concurrently.
+
+        :param Phasespace/None phasespace: input phasespace.
+        :param tuple input_: lines of the input returned by render().
+        :param float timeout: Maximum allowed duration in seconds of the
+            simulation.
+        :param concurrent.futures.Executor executor: see async_run().
+        :param int n_workers: number of MPI ranks of the simulation.
+        :param CoreScheduler/None scheduler: see async_run().
+
+        :return BeamlineResult: result of the simulation.
+        """
+        loop = asyncio.get_event_loop()
+        with TempSimulationDirectory(
+                osp.join(self._swd, f'tmp{uuid.uuid4().hex}')) as swd:
+
+            if phasespace is not None:
+                await loop.run_in_executor(
+                    executor, self._generate_initial_particle_file,
+                    phasespace, swd)
+
+            self._input_gen.write(osp.join(swd, self._fin), input_)
 
-            await self._async_run_core(swd, timeout)
+            await self._async_run_core(swd, timeout, n_workers, scheduler)
 
-            return self._update_output(swd)
+            return await loop.run_in_executor(
+                executor, self._evaluate_output, swd)
+
+    def _evaluate_output(self, swd):
+        """Return the result of the simulation in a directory.
+
+        :param str swd: simulation working directory.
+        """
+        ps = self._read_output(swd)
+        return BeamlineResult(phasespace=ps,
+                              out=ps.analyze(),
+                              **self._analyze_statistics(swd))
 
     def status(self):
         """Return the status of the beamline."""
@@ -0,0 +1,317 @@
+"""
+Distributed under the terms of the GNU General Public License v3.0.
+
+The full license is in the file LICENSE, distributed with this software.
+
+Copyright (C) Jun Zhu. All rights reserved.
+"""
+import asyncio
+from collections import OrderedDict
+import functools
+import hashlib
+import os
+import os.path as osp
+import pickle
+import tempfile
+import threading
+
+import numpy as np
+
+from ..logging import logger
+
+
+def _hash_input(beamline, input_):
+    """Return a sha256 object updated with the beamline and its input."""
+    h = hashlib.sha256()
+    h.update(repr((type(beamline).__name__,
+                   beamline._swd,
+                   beamline._fin,
+                   beamline._pin,
+                   beamline._pout,
+                   beamline._charge)).encode())
+    for line in input_:
+        h.update(line.encode())
+    return h
+
+
+class SimulationCache:
+    """Persistent cache of beamline simulation results.
+
+    Results are stored on disk under a key computed from the content
+    which determines the simulation, i.e. the rendered input, the
+    upstream phasespace and the beamline definition. Therefore, the same
+    cache directory can be shared between runs and restarts.
+
+    The least recently used entries are evicted when either of the
+    limits is exceeded.
+
+    The methods are thread-safe so that the file I/O can be run in an
+    executor by the asynchronous evaluation.
+
+    Note: external files referred in the input file, e.g. field maps,
+    are not part of the key. Please clear the cache after modifying them.
+    """
+    _SUFFIX = '.pickle'
+
+    def __init__(self, path, *, max_entries=None, max_bytes=None):
+        """Initialization.
+
+        :param str path: directory of the cache.
+        :param int/None max_entries: maximum number of entries.
+        :param int/None max_bytes: maximum total size in bytes of the
+            entries.
+        """
+        if max_entries is not None and max_entries < 1:
+            raise ValueError("max_entries must be a positive integer!")
+        if max_bytes is not None and max_bytes < 1:
+            raise ValueError("max_bytes must be a positive integer!")
+
+        self._path = osp.abspath(path)
+        os.makedirs(self._path, exist_ok=True)
+
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+
+        # key -> size of the entry in bytes, ordered from the least
+        # recently used one to the most recently used one
+        self._index = OrderedDict()
+        self._n_bytes = 0
+        self._lock = threading.RLock()
+        self._load_index()
+
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def path(self):
+        return self._path
+
+    def _load_index(self):
+        entries = []
+        for filename in os.listdir(self._path):
+            if not filename.endswith(self._SUFFIX):
+                continue
+            st = os.stat(osp.join(self._path, filename))
+            entries.append((st.st_mtime, filename[:-len(self._SUFFIX)],
+                            st.st_size))
+
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._n_bytes += size
+        self._evict()
+
+    def _filepath(self, key):
+        return osp.join(self._path, key + self._SUFFIX)
+
+    @staticmethod
+    def make_key(beamline, input_, phasespace):
+        """Compute the key of a beamline simulation.
+
+        :param Beamline beamline: beamline.
+        :param tuple input_: lines of the rendered input.
+        :param Phasespace/None phasespace: input phasespace.
+        """
+        h = _hash_input(beamline, input_)
+        if phasespace is not None:
+            h.update(repr(phasespace.charge).encode())
+            for col in phasespace.columns:
+                h.update(np.ascontiguousarray(
+                    phasespace[col], dtype=np.float64).tobytes())
+        return h.hexdigest()
+
+    def get(self, key):
+        """Return the cached result.
+
+        :param str key: key returned by make_key().
+
+        :return BeamlineResult/None: None if not found.
+        """
+        filepath = self._filepath(key)
+        try:
+            with open(filepath, 'rb') as fp:
+                result = pickle.load(fp)
+            os.utime(filepath)
+        except FileNotFoundError:
+            # possibly evicted by another process
+            with self._lock:
+                self._discard(key)
+                self.misses += 1
+            return None
+        except (pickle.UnpicklingError, EOFError, AttributeError) as e:
+            logger.warning(f"Corrupted cache entry {filepath}: {repr(e)}")
+            with self._lock:
+                self._remove(key)
+                self.misses += 1
+            return None
+
+        with self._lock:
+            if key not in self._index:
+                # written by another process
+                self._index[key] = osp.getsize(filepath)
+                self._n_bytes += self._index[key]
+            self._index.move_to_end(key)
+            self.hits += 1
+        return result
+
+    def put(self, key, result):
+        """Store a result.
+
+        :param str key: key returned by make_key().
+        :param BeamlineResult result: result of the simulation.
+        """
+        fd, tmp = tempfile.mkstemp(dir=self._path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                pickle.dump(result, fp, protocol=pickle.HIGHEST_PROTOCOL)
+            # atomic so that a partially written entry is never read
+            os.replace(tmp, self._filepath(key))
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+        with self._lock:
+            self._discard(key)
+            self._index[key] = osp.getsize(self._filepath(key))
+            self._n_bytes += self._index[key]
+            self._evict()
+
+    def _discard(self, key):
+        size = self._index.pop(key, None)
+        if size is not None:
+            self._n_bytes -= size
+
+    def _remove(self, key):
+        self._discard(key)
+        try:
+            os.remove(self._filepath(key))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        while self._index and (
+                (self._max_entries is not None
+                 and len(self._index) > self._max_entries)
+                or (self._max_bytes is not None
+                    and self._n_bytes > self._max_bytes)):
+            self._remove(next(iter(self._index)))
+
+    def clear(self):
+        """Remove all the entries."""
+        with self._lock:
+            for key in list(self._index):
+                self._remove(key)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+
+class CheckpointCache:
+    """In-memory cache of beamline results in a linac.
+
+    The key of a beamline is chained with the key of its upstream
+    beamline. Namely, it only depends on the inputs of the beamline and
+    all its upstream beamlines. Therefore, unlike SimulationCache, the
+    phasespace does not need to be hashed and the simulation can resume
+    from the output of the last unchanged upstream beamline.
+    """
+    def __init__(self, max_entries):
+        """Initialization.
+
+        :param int max_entries: maximum number of entries.
+        """
+        if max_entries < 1:
+            raise ValueError("max_entries must be a positive integer!")
+        self._max_entries = max_entries
+
+        self._data = OrderedDict()
+        # key -> asyncio.Task of the simulations which are running
+        self._pending = dict()
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(beamline, input_, upstream_key):
+        """Compute the key of a beamline simulation.
+
+        :param Beamline beamline: beamline.
+        :param tuple input_: lines of the rendered input.
+        :param str/None upstream_key: key of the upstream beamline.
+        """
+        h = _hash_input(beamline, input_)
+        if upstream_key is not None:
+            h.update(upstream_key.encode())
+        return h.hexdigest()
+
+    def get(self, key):
+        """Return the result of a finished simulation.
+
+        :param str key: key returned by make_key().
+
+        :return BeamlineResult/None: None if not found.
+        """
+        try:
+            result = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return result
+
+    def put(self, key, result):
+        """Store a result.
+
+        :param str key: key returned by make_key().
+        :param BeamlineResult result: result of the simulation.
+        """
+        self._data[key] = result
+        self._data.move_to_end(key)
+        while len(self._data) > self._max_entries:
+            self._data.popitem(last=False)
+
+    async def async_get(self, key, run):
+        """Return the result and run the simulation if not found.
+
+        If the same simulation is already running, its result will be
+        awaited instead of running it again.
+
+        :param str key: key returned by make_key().
+        :param callable run: coroutine function without argument which
+            returns the result of the simulation.
+
+        :return BeamlineResult: result of the simulation.
+        """
+        task = self._pending.get(key)
+        if task is not None:
+            self.hits += 1
+            return await asyncio.shield(task)
+
+        result = self.get(key)
+        if result is not None:
+            return result
+
+        task = asyncio.ensure_future(run())
+        self._pending[key] = task
+        task.add_done_callback(functools.partial(self._on_task_done, key))
+        # the simulation continues for the other waiters even if this
+        # one is cancelled
+        return await asyncio.shield(task)
+
+    def _on_task_done(self, key, task):
+        del self._pending[key]
+        if not task.cancelled() and task.exception() is None:
+            self.put(key, task.result())
+
+    def clear(self):
+        """Remove all the finished entries."""
+        self._data.clear()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
@@ -16,6 +16,147 @@ from ..exceptions import LisoRuntimeError
 
 MC2_E = constants.m_e * constants.c**2 / constants.e
 
+_SPACE = ord(' ')
+_ZERO = ord('0')
+
+
+def _format_e(x, width, precision):
+    """Format floats like '%{width}.{precision}E' without printf.
+
+    The mantissa is rounded with floating-point arithmetic. Elements
+    which are not finite, have a 3-digit exponent or whose rounding
+    is ambiguous within the floating-point error are reported so that
+    they can be formatted by printf.
+
+    :param numpy.ndarray x: 1D float array.
+    :param int width: field width.
+    :param int precision: number of digits after the decimal point.
+
+    :return numpy.ndarray chars: uint8 array with shape (n, width).
+    :return numpy.ndarray ok: False for elements which are not formatted.
+    """
+    ax = np.abs(x)
+    nonzero = ax != 0
+    ok = np.isfinite(x)
+    ax = np.where(ok & nonzero, ax, 1.)
+
+    e = np.floor(np.log10(ax)).astype(np.int64)
+    # log10 can be off by one close to powers of 10
+    for _ in range(2):
+        shift = precision - e
+        scaled = np.where(shift >= 0,
+                          ax * 10. ** np.abs(shift),
+                          ax / 10. ** np.abs(shift))
+        e += (scaled >= 10. ** (precision + 1)).astype(np.int64)
+        e -= (scaled < 10. ** precision).astype(np.int64)
+
+    m = np.rint(scaled)
+    ok &= np.abs(scaled - np.floor(scaled) - 0.5) > 0.01
+    carry = m >= 10. ** (precision + 1)
+    m[carry] = 10. ** precision
+    e[carry] += 1
+    m = m.astype(np.int64)
+    m[~nonzero] = 0
+    e[~nonzero] = 0
+    ok &= np.abs(e) < 100
+
+    n_chars = precision + 7
+    chars = np.full((len(x), width), _SPACE, dtype=np.uint8)
+    pos = width - n_chars
+    chars[:, pos] = np.where(np.signbit(x), ord('-'), _SPACE)
+    powers = 10 ** np.arange(precision, -1, -1, dtype=np.int64)
+    digits = (m[:, None] // powers) % 10 + _ZERO
+    chars[:, pos + 1] = digits[:, 0]
+    chars[:, pos + 2] = ord('.')
+    chars[:, pos + 3:pos + 3 + precision] = digits[:, 1:]
+    chars[:, -4] = ord('E')
+    chars[:, -3] = np.where(e < 0, ord('-'), ord('+'))
+    ae = np.abs(e)
+    chars[:, -2] = (ae // 10) % 10 + _ZERO
+    chars[:, -1] = ae % 10 + _ZERO
+
+    return chars, ok
+
+
+def _format_d(x, width):
+    """Format integer-valued floats like '%{width}d' without printf.
+
+    :param numpy.ndarray x: 1D float array.
+    :param int width: field width.
+
+    :return numpy.ndarray chars: uint8 array with shape (n, width).
+    :return numpy.ndarray ok: False for elements which are not formatted.
+    """
+    ok = (x == np.rint(x)) & (np.abs(x) < 10. ** (width - 1))
+    v = np.abs(np.where(ok, x, 0.)).astype(np.int64)
+    n_digits = np.ones(len(x), dtype=np.int64)
+    chars = np.full((len(x), width), _SPACE, dtype=np.uint8)
+    for k in range(width):
+        if k > 0:
+            n_digits += v >= 10 ** k
+        chars[:, width - 1 - k] = np.where(
+            k < n_digits, (v // 10 ** k) % 10 + _ZERO, _SPACE)
+    sign_pos = np.clip(width - 1 - n_digits, 0, None)
+    is_neg = x < 0
+    chars[np.nonzero(is_neg)[0], sign_pos[is_neg]] = ord('-')
+    return chars, ok
+
+
+def _savetxt(fp, data, fmt, *, chunk_size=1 << 16):
+    """Write a 2D array to a text file.
+
+    It produces the same output as numpy.savetxt(fp, data, fmt=fmt,
+    delimiter=' ') but formats the numbers with vectorized byte
+    operations instead of calling printf row by row. The few elements
+    which cannot be formatted in this way are formatted by printf
+    individually, and a chunk is written with printf in one go if a
+    field does not fit its width.
+
+    :param file fp: file object opened in binary mode.
+    :param numpy.ndarray data: 2D float array.
+    :param list fmt: format, i.e. '%W.PE' or '%Wd', of each column.
+    """
+    specs = []
+    for f in fmt:
+        matched = re.fullmatch(r'%(\d+)(?:\.(\d+)E|d)', f)
+        if matched is None:
+            raise ValueError(f"Unsupported format: {f}")
+        width, precision = matched.groups()
+        specs.append((int(width), None if precision is None
+                      else int(precision)))
+
+    line_fmt = ' '.join(fmt) + '\n'
+    row_width = sum(w for w, _ in specs) + len(specs)
+    for i in range(0, len(data), chunk_size):
+        chunk = data[i:i + chunk_size]
+        buf = np.empty((len(chunk), row_width), dtype=np.uint8)
+        buf[:, -1] = ord('\n')
+        is_ok = True
+        col = 0
+        for j, (f, (width, precision)) in enumerate(zip(fmt, specs)):
+            if precision is None:
+                chars, ok = _format_d(chunk[:, j], width)
+            else:
+                chars, ok = _format_e(chunk[:, j], width, precision)
+            for k in np.nonzero(~ok)[0]:
+                formatted = (f % chunk[k, j]).encode()
+                if len(formatted) != width:
+                    is_ok = False
+                    break
+                chars[k] = np.frombuffer(formatted, dtype=np.uint8)
+            if not is_ok:
+                break
+            buf[:, col:col + width] = chars
+            if j < len(specs) - 1:
+                buf[:, col + width] = _SPACE
+            col += width + 1
+
+        if is_ok:
+            fp.write(buf.tobytes())
+        else:
+            fp.write(((line_fmt * len(chunk))
+                      % tuple(chunk.ravel().tolist())).encode())
+
 
 class ParticleFileGenerator:
     """Simulation particle file generator."""
@@ -105,22 +246,21 @@ class ParticleFileGenerator:
 
         :param str filepath: path name of the output file.
         """
-        data = np.zeros(self._n,
-                        dtype=[('x', 'f8'), ('y', 'f8'), ('z', 'f8'),
-                               ('px', 'f8'), ('py', 'f8'), ('pz', 'f8'),
-                               ('t', 'f8'), ('q', 'f8'),
-                               ('index', 'i8'), ('flag', 'i8')])
+        n = self._n
+        data = np.empty((n, 10), dtype=np.float64)
 
         # x, y, px, py with the first one the reference particle
-        data['x'][1:] = self._data[1:, 0]
-        data['y'][1:] = self._data[1:, 2]
-        data['px'][1:] = self._data[1:, 1] * MC2_E  # /mc -> eV/c
-        data['py'][1:] = self._data[1:, 3] * MC2_E  # /mc -> eV/c
+        data[0, :2] = 0.
+        data[1:, 0] = self._data[1:, 0]
+        data[1:, 1] = self._data[1:, 2]
+        data[0, 3:5] = 0.
+        data[1:, 3] = self._data[1:, 1] * MC2_E  # /mc -> eV/c
+        data[1:, 4] = self._data[1:, 3] * MC2_E  # /mc -> eV/c
 
         pz_ref = self._data[:, 5].mean() \
             if self._pz_ref is None else self._pz_ref
-        data['pz'][0] = pz_ref * MC2_E  # /mc -> eV/c
-        data['pz'][1:] = (self._data[1:, 5] - pz_ref) * MC2_E  # /mc -> eV/c
+        data[0, 5] = pz_ref * MC2_E  # /mc -> eV/c
+        data[1:, 5] = (self._data[1:, 5] - pz_ref) * MC2_E  # /mc -> eV/c
 
         # z (m) / t (ns)
         t_ref = 0.
@@ -132,25 +272,23 @@ class ParticleFileGenerator:
             z_ref = self._data[:, 4].mean() \
                 if self._z_ref is None else self._z_ref
 
-        data['z'][0] = z_ref
-        data['z'][1:] = self._data[1:, 4] - z_ref
+        data[0, 2] = z_ref
+        data[1:, 2] = self._data[1:, 4] - z_ref
 
-        data['t'][0] = t_ref
-        data['t'][1:] = self._data[1:, 6] - t_ref
-        data['t'] *= 1.e9  # s -> ns
+        data[0, 6] = t_ref
+        data[1:, 6] = self._data[1:, 6] - t_ref
+        data[:, 6] *= 1.e9  # s -> ns
 
         # q (in nC)
-        data['q'] = -1.e9 * self._q / self._n
+        data[:, 7] = -1.e9 * self._q / n
         # index (1 for electron)
-        data['index'] = 1
+        data[:, 8] = 1
         # flag (standard particles)
-        data['flag'] = -1 if self._cathode else 5
+        data[:, 9] = -1 if self._cathode else 5
 
         os.makedirs(os.path.dirname(filepath), exist_ok=True)
-        with open(filepath, 'w+') as fp:
-            np.savetxt(fp, data,
-                       fmt=" ".join(["%20.12E"] * 8 + ["%3d"] * 2),
-                       delimiter='')
+        with open(filepath, 'wb') as fp:
+            _savetxt(fp, data, ["%20.12E"] * 8 + ["%3d"] * 2)
 
     def to_impactt(self, filepath):
         """Generate an Impact-T particle file.
@@ -160,24 +298,10 @@ class ParticleFileGenerator:
 
         :param str filepath: path name of the output file.
         """
-        data = np.zeros(self._n,
-                        dtype=[('x', 'f8'), ('px', 'f8'),
-                               ('y', 'f8'), ('py', 'f8'),
-                               ('z', 'f8'), ('pz', 'f8')])
-
-        data['x'][:] = self._data[:, 0]
-        data['px'][:] = self._data[:, 1]
-        data['y'][:] = self._data[:, 2]
-        data['py'][:] = self._data[:, 3]
-        data['z'][:] = self._data[:, 4]
-        data['pz'][:] = self._data[:, 5]
-
         os.makedirs(os.path.dirname(filepath), exist_ok=True)
-        with open(filepath, 'w+') as fp:
-            fp.write(str(self._n) + '\n')
-            np.savetxt(fp, data,
-                       fmt=" ".join(["%20.12E"] * 6),
-                       delimiter='')
+        with open(filepath, 'wb') as fp:
+            fp.write(f"{self._n}\n".encode())
+            _savetxt(fp, self._data[:, :6], ["%20.12E"] * 6)
 
     def to_elegant(self, filepath):
         """Generate an Elegant particle file."""
@@ -229,16 +353,8 @@ class ParticleFileGenerator:
         instance._n = len(ps)
         instance._q = ps.charge
 
-        data = cls._init_data(instance._n)
-        data[:, 0] = ps['x']
-        data[:, 1] = ps['px']
-        data[:, 2] = ps['y']
-        data[:, 3] = ps['py']
-        data[:, 4] = ps['z']
-        data[:, 5] = ps['pz']
-        data[:, 6] = ps['t']
-
-        instance._data = data
+        # the generator does not modify the data
+        instance._data = ps.to_numpy()
 
         instance._cathode = False
         instance._pz_ref = None
@@ -257,20 +373,25 @@ class InputGenerator(object):
     def _parse(self, filepath):
         raise NotImplementedError
 
-    def update(self, mapping):
-        """Update the input string.
+    def render(self, mapping):
+        """Return the input rendered from the template.
+
+        Unlike update(), the generator is not modified. Therefore, it
+        is safe to render inputs for concurrent simulations.
 
         Patterns in the template input file should be put between
         '<' and '>'.
 
         :param dict mapping: a pattern-value mapping for replacing the
             pattern with value in the template file.
+
+        :return tuple: lines of the input.
         """
         found = set()
-        self._input = list(self._template)
-        for i in range(len(self._input)):
+        input_ = list(self._template)
+        for i in range(len(input_)):
             while True:
-                line = self._input[i]
+                line = input_[i]
 
                 # Comment line starting with '!'
                 if re.match(r'^\s*!', line):
@@ -294,7 +415,7 @@ class InputGenerator(object):
 
                 ptn = line[left + 1:right]
                 try:
-                    self._input[i] = line.replace(
+                    input_[i] = line.replace(
                         '<' + ptn + '>', str(mapping[ptn]), 1)
                 except KeyError:
                     raise KeyError(
@@ -306,17 +427,34 @@ class InputGenerator(object):
         if not_found:
             raise KeyError(f"{not_found} not found in the templates!")
 
-    def write(self, filepath):
+        return tuple(input_)
+
+    def update(self, mapping, input_=None):
+        """Update the input string.
+
+        :param dict mapping: a pattern-value mapping for replacing the
+            pattern with value in the template file.
+        :param tuple/None input_: lines of the input returned by render()
+            with the same mapping. If given, the template is not rendered
+            again.
+        """
+        self._input = self.render(mapping) if input_ is None else input_
+
+    def write(self, filepath, input_=None):
         """Write the input string to file.
 
         :param str filepath: path of the output file.
+        :param tuple/None input_: lines of the input returned by render().
+            If None, the input from the last update() will be written.
         """
-        if self._input is None:
+        if input_ is None:
+            input_ = self._input
+        if input_ is None:
             raise LisoRuntimeError("Input is not initialized!")
 
         os.makedirs(os.path.dirname(filepath), exist_ok=True)
         with open(filepath, 'w') as fp:
-            for line in self._input:
+            for line in input_:
                 fp.write(line)
 
 
@@ -5,10 +5,53 @@ The full license is in the file LICENSE, distributed with this software.
 
 Copyright (C) Jun Zhu. All rights reserved.
 """
+import asyncio
 from collections.abc import Mapping
+import functools
 
 from collections import defaultdict, OrderedDict
+from types import MappingProxyType
+
 from .beamline import create_beamline
+from .cache import CheckpointCache
+
+
+class LinacResult(Mapping):
+    """Immutable result of a single simulation of a linac.
+
+    It is a mapping from beamline name to BeamlineResult.
+    """
+    def __init__(self, controls, results):
+        """Initialization.
+
+        :param dict controls: normalized mapping used in the simulation.
+        :param OrderedDict results: beamline name to BeamlineResult
+            mapping.
+        """
+        self._controls = MappingProxyType(dict(controls))
+        self._results = MappingProxyType(OrderedDict(results))
+
+    @property
+    def controls(self):
+        return self._controls
+
+    @property
+    def phasespaces(self):
+        """Return the output phasespaces in the format of async_run."""
+        return OrderedDict((f"{name}/out", result.phasespace)
+                           for name, result in self._results.items())
+
+    def __getitem__(self, item):
+        """Override."""
+        return self._results[item]
+
+    def __iter__(self):
+        """Override."""
+        return self._results.__iter__()
+
+    def __len__(self):
+        """Override."""
+        return self._results.__len__()
 
 
 class Linac(Mapping):
@@ -18,14 +61,30 @@ class Linac(Mapping):
     consists of one or multiple beamlines. These beamlines can be
     simulated using different codes.
     """
-    def __init__(self, mps=None):
+    def __init__(self, mps=None, *, cache=None, checkpoints=0):
         """Initialization.
 
         :param int/None mps: number of macro-particles at the
             start of the simulation.
+        :param SimulationCache/None cache: cache of the simulation results
+            used by run() and evaluate(). If given, a beamline will not
+            be simulated again if its input and input phasespace are
+            found in the cache.
+        :param int checkpoints: maximum number of beamline results kept
+            in memory. If positive, the simulation will resume from the
+            output of the last beamline whose input and upstream inputs
+            are unchanged. Besides, concurrent evaluations share the
+            simulations of identical upstream beamlines. Note that the
+            files in the simulation working directory of a skipped
+            beamline are not updated by run().
         """
         self._mps = mps  # Number of macro-particles.
 
+        self._cache = cache
+        self._checkpoints = None
+        if checkpoints > 0:
+            self._checkpoints = CheckpointCache(checkpoints)
+
         self._beamlines = OrderedDict()
 
     def __getitem__(self, item):
@@ -106,14 +165,43 @@ class Linac(Mapping):
 
     def compile(self, mapping):
         """Compile all the inputs before running the simulation."""
+        return self._compile(mapping)[0]
+
+    def _compile(self, mapping):
+        """Render all the inputs and update the beamlines with them.
+
+        :return dict: normalized mapping.
+        :return OrderedDict: rendered inputs of all the beamlines.
+        """
+        mapping_grp = self._split_mapping(mapping)
+        mapping_norm = {}
+        inputs = OrderedDict()
+        for name, bl in self._beamlines.items():
+            inputs[name] = bl.render(mapping_grp[name])
+            bl.compile(mapping_grp[name], inputs[name])
+            mapping_norm.update({
+                f"{name}/{k}": v for k, v in mapping_grp[name].items()
+            })
+        return mapping_norm, inputs
+
+    def render(self, mapping):
+        """Render all the inputs without updating the beamlines.
+
+        :param dict mapping: A mapping of parameters used in the simulation
+            input file.
+
+        :return dict: normalized mapping.
+        :return OrderedDict: rendered inputs of all the beamlines.
+        """
         mapping_grp = self._split_mapping(mapping)
         mapping_norm = {}
+        inputs = OrderedDict()
         for name, bl in self._beamlines.items():
-            bl.compile(mapping_grp[name])
+            inputs[name] = bl.render(mapping_grp[name])
             mapping_norm.update({
                 f"{name}/{k}": v for k, v in mapping_grp[name].items()
             })
-        return mapping_norm
+        return mapping_norm, inputs
 
     def run(self, mapping, *, n_workers=1, timeout=None):
         """Run simulation for all the beamlines.
@@ -124,22 +212,186 @@ class Linac(Mapping):
         :param float timeout: Maximum allowed duration in seconds of the
             simulation.
         """
-        self.compile(mapping)
+        _, inputs = self._compile(mapping)
 
         out = None
-        for i, bl in enumerate(self._beamlines.values()):
-            out = bl.run(out, timeout=timeout, n_workers=n_workers)
+        key = None
+        for name, bl in self._beamlines.items():
+            if self._checkpoints is not None:
+                key = self._checkpoints.make_key(bl, inputs[name], key)
+                result = self._checkpoints.get(key)
+                if result is not None:
+                    out = bl._set_result(result)
+                    continue
+
+            out = self._run_beamline(bl, inputs[name], out,
+                                     timeout=timeout, n_workers=n_workers)
 
-    async def async_run(self, sim_id, mapping, *, timeout=None):
-        controls = self.compile(mapping)
+            if self._checkpoints is not None:
+                self._checkpoints.put(key, bl._get_result(out))
+
+    def _run_beamline(self, bl, input_, phasespace, **kwargs):
+        """Run simulation for a beamline with the cache looked up first.
+
+        :return Phasespace: output phasespace.
+        """
+        if self._cache is None:
+            return bl.run(phasespace, **kwargs)
+
+        key = self._cache.make_key(bl, input_, phasespace)
+        result = self._cache.get(key)
+        if result is None:
+            out = bl.run(phasespace, **kwargs)
+            self._cache.put(key, bl._get_result(out))
+            return out
+        return bl._set_result(result)
+
+    def _get_n_workers(self, n_workers):
+        """Return the number of MPI ranks of each beamline.
+
+        :param int/dict n_workers: number of MPI ranks of all the
+            beamlines or a mapping from beamline name to number of MPI
+            ranks. Beamlines which are not in the mapping are run with
+            a single process.
+
+        :return OrderedDict: beamline name to number of MPI ranks mapping.
+        """
+        if isinstance(n_workers, Mapping):
+            for name in n_workers:
+                if name not in self._beamlines:
+                    raise KeyError(f"Beamline {name} does not exist!")
+            ret = OrderedDict((name, n_workers.get(name, 1))
+                              for name in self._beamlines)
+        else:
+            ret = OrderedDict((name, n_workers) for name in self._beamlines)
+
+        for name, n in ret.items():
+            if not isinstance(n, int) or not n > 0:
+                raise ValueError(f"n_workers of beamline {name} must be a "
+                                 f"positive integer. Actual: {n}")
+        return ret
+
+    async def async_run(self, sim_id, mapping, *, timeout=None,
+                        executor=None, n_workers=1, scheduler=None):
+        """Run simulation for all the beamlines asynchronously.
+
+        The inputs are rendered per call so that concurrent runs with
+        different mappings do not interfere with each other.
+
+        :param int sim_id: simulation ID, which also determines the name
+            of the temporary simulation directory.
+        :param dict mapping: A mapping of parameters used in the simulation
+            input file.
+        :param float timeout: Maximum allowed duration in seconds of the
+            simulation.
+        :param concurrent.futures.Executor executor: executor for the
+            CPU-bound pre- and post-processing of each beamline. See
+            Beamline.async_run().
+        :param int/dict n_workers: number of MPI ranks of all the
+            beamlines or a mapping from beamline name to number of MPI
+            ranks.
+        :param CoreScheduler/None scheduler: if given, the cores used by
+            a beamline are reserved before it is simulated.
+        """
+        if self._checkpoints is not None:
+            result = await self.async_evaluate(
+                mapping, timeout=timeout, executor=executor,
+                n_workers=n_workers, scheduler=scheduler)
+            return sim_id, dict(result.controls), result.phasespaces
+
+        controls, inputs = self.render(mapping)
+        n_workers = self._get_n_workers(n_workers)
 
         out = None
         phasespaces = OrderedDict()
         for name, bl in self._beamlines.items():
-            out = await bl.async_run(out, f'tmp{sim_id:06d}', timeout=timeout)
+            out = await bl.async_run(out, f'tmp{sim_id:06d}',
+                                     timeout=timeout, input_=inputs[name],
+                                     executor=executor,
+                                     n_workers=n_workers[name],
+                                     scheduler=scheduler)
             phasespaces[f"{name}/out"] = out
         return sim_id, controls, phasespaces
 
+    async def async_evaluate(self, mapping, *, timeout=None, executor=None,
+                             n_workers=1, scheduler=None):
+        """Run simulation for all the beamlines and return the result.
+
+        Unlike run() and async_run(), the linac and its beamlines are not
+        modified and each beamline is simulated in a scratch directory
+        unique to this call. Therefore, any number of evaluations can be
+        run concurrently with the same linac.
+
+        :param dict mapping: A mapping of parameters used in the simulation
+            input file.
+        :param float timeout: Maximum allowed duration in seconds of the
+            simulation.
+        :param concurrent.futures.Executor executor: see async_run().
+        :param int/dict n_workers: see async_run().
+        :param CoreScheduler/None scheduler: see async_run().
+
+        :return LinacResult: result of the simulation.
+        """
+        controls, inputs = self.render(mapping)
+        n_workers = self._get_n_workers(n_workers)
+
+        out = None
+        key = None
+        results = OrderedDict()
+        for name, bl in self._beamlines.items():
+            evaluate = functools.partial(self._async_evaluate_beamline,
+                                         bl, inputs[name], out,
+                                         timeout=timeout,
+                                         executor=executor,
+                                         n_workers=n_workers[name],
+                                         scheduler=scheduler)
+            if self._checkpoints is None:
+                result = await evaluate()
+            else:
+                key = self._checkpoints.make_key(bl, inputs[name], key)
+                result = await self._checkpoints.async_get(key, evaluate)
+
+            results[name] = result
+            out = result.phasespace
+        return LinacResult(controls, results)
+
+    async def _async_evaluate_beamline(self, bl, input_, phasespace, *,
+                                       timeout, executor, n_workers,
+                                       scheduler):
+        """Evaluate a beamline with the cache looked up first.
+
+        The hashing of the phasespace and the (un)pickling of the cache
+        entries are run in the default executor of the event loop.
+
+        :return BeamlineResult: result of the simulation.
+        """
+        if self._cache is None:
+            return await bl.async_evaluate(
+                phasespace, input_=input_, timeout=timeout,
+                executor=executor, n_workers=n_workers, scheduler=scheduler)
+
+        loop = asyncio.get_event_loop()
+        key = await loop.run_in_executor(
+            None, self._cache.make_key, bl, input_, phasespace)
+        result = await loop.run_in_executor(None, self._cache.get, key)
+        if result is not None:
+            return result
+
+        result = await bl.async_evaluate(
+            phasespace, input_=input_, timeout=timeout, executor=executor,
+            n_workers=n_workers, scheduler=scheduler)
+        await loop.run_in_executor(None, self._cache.put, key, result)
+        return result
+
+    def evaluate(self, mapping, *, timeout=None):
+        """Run simulation for all the beamlines and return the result.
+
+        Synchronous version of async_evaluate().
+        """
+        loop = asyncio.get_event_loop()
+        return loop.run_until_complete(
+            self.async_evaluate(mapping, timeout=timeout))
+
     def status(self):
         """Return the status of the linac."""
         ret = OrderedDict()
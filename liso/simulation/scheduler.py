@@ -0,0 +1,95 @@
+"""
+Distributed under the terms of the GNU General Public License v3.0.
+
+The full license is in the file LICENSE, distributed with this software.
+
+Copyright (C) Jun Zhu. All rights reserved.
+"""
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+
+
+class CoreScheduler:
+    """Share a budget of CPU cores among concurrent simulations.
+
+    A simulation reserves the number of cores it needs (e.g. the number
+    of MPI ranks) before it starts and releases them after it finishes.
+    Reservations are granted in the order of the requests so that a
+    large request is not starved by small ones.
+    """
+    def __init__(self, n_cores):
+        """Initialization.
+
+        :param int n_cores: total number of cores.
+        """
+        if not isinstance(n_cores, int) or n_cores < 1:
+            raise ValueError(
+                f"n_cores must be a positive integer. Actual: {n_cores}")
+
+        self._n_cores = n_cores
+        self._available = n_cores
+        self._waiters = deque()
+
+    @property
+    def n_cores(self):
+        return self._n_cores
+
+    @property
+    def available(self):
+        return self._available
+
+    async def acquire(self, n):
+        """Wait until n cores are available and reserve them.
+
+        :param int n: number of cores.
+        """
+        if n > self._n_cores:
+            raise ValueError(f"Cannot reserve {n} cores with a budget of "
+                             f"{self._n_cores} cores!")
+
+        if not self._waiters and self._available >= n:
+            self._available -= n
+            return
+
+        fut = asyncio.get_event_loop().create_future()
+        self._waiters.append((n, fut))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # the cores were granted right before the cancellation
+                self.release(n)
+            else:
+                self._wake_up()
+            raise
+
+    def release(self, n):
+        """Release n reserved cores.
+
+        :param int n: number of cores.
+        """
+        self._available += n
+        self._wake_up()
+
+    def _wake_up(self):
+        while self._waiters:
+            n, fut = self._waiters[0]
+            if fut.done():
+                # cancelled
+                self._waiters.popleft()
+                continue
+            if n > self._available:
+                break
+            self._waiters.popleft()
+            self._available -= n
+            fut.set_result(None)
+
+    @asynccontextmanager
+    async def reserve(self, n):
+        """Reserve n cores in an 'async with' block."""
+        await self.acquire(n)
+        try:
+            yield
+        finally:
+            self.release(n)
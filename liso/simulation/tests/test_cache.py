@@ -0,0 +1,324 @@
+import unittest
+from unittest.mock import patch
+import os
+import os.path as osp
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import tempfile
+import threading
+
+import numpy as np
+
+from liso import Linac, SimulationCache
+from liso.simulation.cache import CheckpointCache
+from liso.proc import Phasespace
+from liso.simulation.beamline import BeamlineResult
+
+_ROOT_DIR = osp.dirname(osp.abspath(__file__))
+
+
+def _random_phasespace(n=1000, seed=0):
+    rng = np.random.RandomState(seed)
+    return Phasespace.from_columns(
+        x=rng.normal(0, 1e-3, n), px=rng.normal(0, 1e-2, n),
+        y=rng.normal(0, 1e-3, n), py=rng.normal(0, 1e-2, n),
+        z=rng.normal(0, 1e-3, n), pz=rng.normal(100, 1., n),
+        t=rng.normal(0, 1e-12, n), charge=1e-12)
+
+
+def _result(ps):
+    return BeamlineResult(ps, ps.analyze(), *range(6))
+
+
+class TestSimulationCache(unittest.TestCase):
+    def run(self, result=None):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self._tmp_dir = tmp_dir
+
+            self._linac = Linac()
+            self._linac.add_beamline('astra',
+                                     name='gun',
+                                     swd=tmp_dir,
+                                     fin='injector.in',
+                                     template=osp.join(_ROOT_DIR, 'injector.in.000'),
+                                     pout='injector.0450.001')
+            self._linac.add_beamline('impactt',
+                                     name='chicane',
+                                     swd=tmp_dir,
+                                     fin='ImpactT.in',
+                                     template=osp.join(_ROOT_DIR, 'ImpactT.in.000'),
+                                     pout='fort.106',
+                                     charge=1e-15)
+
+            super().run(result)
+
+    def testMakeKey(self):
+        gun, chicane = self._linac['gun'], self._linac['chicane']
+        input1 = gun.render({'gun_gradient': 1., 'gun_phase': 2.})
+        input2 = gun.render({'gun_gradient': 1., 'gun_phase': 3.})
+        ps = _random_phasespace()
+
+        key = SimulationCache.make_key(gun, input1, None)
+        self.assertEqual(key, SimulationCache.make_key(gun, input1, None))
+        self.assertNotEqual(key, SimulationCache.make_key(gun, input2, None))
+        self.assertNotEqual(key, SimulationCache.make_key(chicane, input1, None))
+
+        key = SimulationCache.make_key(chicane, input1, ps)
+        self.assertEqual(key, SimulationCache.make_key(
+            chicane, input1, _random_phasespace()))
+        self.assertNotEqual(key, SimulationCache.make_key(
+            chicane, input1, _random_phasespace(seed=1)))
+        ps.charge = 2e-12
+        self.assertNotEqual(key, SimulationCache.make_key(chicane, input1, ps))
+
+    def testPutGet(self):
+        path = osp.join(self._tmp_dir, 'cache')
+        cache = SimulationCache(path)
+        self.assertIsNone(cache.get('abc'))
+        self.assertEqual(1, cache.misses)
+
+        ps = _random_phasespace()
+        cache.put('abc', _result(ps))
+        self.assertIn('abc', cache)
+        # no temporary file left
+        self.assertListEqual(['abc.pickle'], os.listdir(path))
+
+        result = cache.get('abc')
+        self.assertEqual(1, cache.hits)
+        np.testing.assert_array_equal(ps['x'], result.phasespace['x'])
+        self.assertEqual(ps.charge, result.phasespace.charge)
+        self.assertEqual(ps.analyze().emitx, result.out.emitx)
+        self.assertEqual(5, result.std)
+
+        # persistent
+        cache = SimulationCache(path)
+        self.assertEqual(1, len(cache))
+        self.assertEqual(5, cache.get('abc').std)
+
+        cache.clear()
+        self.assertEqual(0, len(cache))
+        self.assertListEqual([], os.listdir(path))
+
+    def testEviction(self):
+        with self.assertRaises(ValueError):
+            SimulationCache(self._tmp_dir, max_entries=0)
+
+        cache = SimulationCache(self._tmp_dir, max_entries=2)
+        result = _result(_random_phasespace(100))
+        cache.put('a', result)
+        cache.put('b', result)
+        cache.get('a')
+        cache.put('c', result)
+        self.assertNotIn('b', cache)
+        self.assertIn('a', cache)
+        self.assertIn('c', cache)
+        self.assertFalse(osp.exists(osp.join(self._tmp_dir, 'b.pickle')))
+
+        size = osp.getsize(osp.join(self._tmp_dir, 'a.pickle'))
+        cache = SimulationCache(self._tmp_dir, max_bytes=size)
+        self.assertEqual(1, len(cache))
+
+    @patch('liso.simulation.beamline.Beamline._async_run_core')
+    def testLinacEvaluate(self, mocked_async_run_core):
+        future = asyncio.Future()
+        future.set_result(object())
+        mocked_async_run_core.return_value = future
+
+        cache = SimulationCache(osp.join(self._tmp_dir, 'cache'))
+        self._linac._cache = cache
+        mapping = {
+            'gun/gun_gradient': 1., 'gun/gun_phase': 2.,
+            'chicane/MQZM1_G': 1., 'chicane/MQZM2_G': 1.,
+        }
+
+        gun, chicane = self._linac['gun'], self._linac['chicane']
+        with patch.object(gun, '_read_output',
+                          return_value=_random_phasespace()), \
+                patch.object(chicane, '_read_output',
+                             return_value=_random_phasespace(seed=1)), \
+                patch.object(gun, '_analyze_statistics', return_value={
+                    k: 1 for k in ('start', 'end', 'min', 'max', 'avg', 'std')}), \
+                patch.object(chicane, '_analyze_statistics', return_value={
+                    k: 2 for k in ('start', 'end', 'min', 'max', 'avg', 'std')}), \
+                patch.object(chicane, '_generate_initial_particle_file'):
+            result = self._linac.evaluate(mapping)
+            self.assertEqual(2, mocked_async_run_core.call_count)
+            self.assertEqual(2, len(cache))
+
+            result_cached = self._linac.evaluate(mapping)
+            self.assertEqual(2, mocked_async_run_core.call_count)
+            self.assertEqual(2, cache.hits)
+            self.assertEqual(result['chicane'].out.Sx,
+                             result_cached['chicane'].out.Sx)
+            self.assertEqual(2, result_cached['chicane'].max)
+
+            # only the downstream beamline is simulated
+            mapping['chicane/MQZM1_G'] = 2.
+            self._linac.evaluate(mapping)
+            self.assertEqual(3, mocked_async_run_core.call_count)
+
+            # the cache I/O does not block the event loop
+            threads = []
+            for method in ('get', 'put'):
+                wrapped = getattr(cache, method)
+
+                def _record(*args, _wrapped=wrapped):
+                    threads.append(threading.current_thread())
+                    return _wrapped(*args)
+
+                setattr(cache, method, _record)
+            mapping['chicane/MQZM1_G'] = 3.
+            self._linac.evaluate(mapping)
+            self.assertEqual(3, len(threads))
+            self.assertNotIn(threading.main_thread(), threads)
+
+    @patch('liso.simulation.beamline.Beamline._update_statistics')
+    @patch('liso.simulation.beamline.Beamline._run_core')
+    def testLinacRun(self, mocked_run_core, mocked_update_statistics):
+        cache = SimulationCache(osp.join(self._tmp_dir, 'cache'))
+        linac = Linac(cache=cache)
+        linac.add_beamline('astra',
+                           name='gun',
+                           swd=self._tmp_dir,
+                           fin='injector.in',
+                           template=osp.join(_ROOT_DIR, 'injector.in.000'),
+                           pout='injector.0450.001')
+        mapping = {'gun_gradient': 1., 'gun_phase': 2.}
+
+        gun = linac['gun']
+        with patch.object(gun, '_read_output',
+                          return_value=_random_phasespace()):
+            linac.run(mapping)
+            self.assertEqual(1, mocked_run_core.call_count)
+            out = gun.out
+
+            gun._out = None
+            linac.run(mapping)
+            self.assertEqual(1, mocked_run_core.call_count)
+            self.assertEqual(out.Sx, gun.out.Sx)
+
+
+class TestCheckpointCache(unittest.TestCase):
+    def run(self, result=None):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self._tmp_dir = tmp_dir
+
+            linac = Linac(checkpoints=10)
+            linac.add_beamline('astra',
+                               name='gun',
+                               swd=tmp_dir,
+                               fin='injector.in',
+                               template=osp.join(_ROOT_DIR, 'injector.in.000'),
+                               pout='injector.0450.001')
+            linac.add_beamline('impactt',
+                               name='chicane',
+                               swd=tmp_dir,
+                               fin='ImpactT.in',
+                               template=osp.join(_ROOT_DIR, 'ImpactT.in.000'),
+                               pout='fort.106',
+                               charge=1e-15)
+            self._linac = linac
+            self._mapping = {
+                'gun/gun_gradient': 1., 'gun/gun_phase': 2.,
+                'chicane/MQZM1_G': 1., 'chicane/MQZM2_G': 1.,
+            }
+
+            super().run(result)
+
+    def testMakeKey(self):
+        with self.assertRaises(ValueError):
+            CheckpointCache(0)
+
+        gun, chicane = self._linac['gun'], self._linac['chicane']
+        gun_input = gun.render({'gun_gradient': 1., 'gun_phase': 2.})
+        chicane_input = chicane.render({'MQZM1_G': 1., 'MQZM2_G': 1.})
+
+        gun_key = CheckpointCache.make_key(gun, gun_input, None)
+        key = CheckpointCache.make_key(chicane, chicane_input, gun_key)
+        self.assertEqual(key, CheckpointCache.make_key(
+            chicane, chicane_input, gun_key))
+        self.assertNotEqual(key, CheckpointCache.make_key(
+            chicane, chicane_input, None))
+
+    def testEvaluate(self):
+        gun, chicane = self._linac['gun'], self._linac['chicane']
+
+        async def _gun_evaluate(phasespace, *, input_, timeout, **kwargs):
+            await asyncio.sleep(0.01)
+            return _result(_random_phasespace())
+
+        async def _chicane_evaluate(phasespace, *, input_, timeout, **kwargs):
+            return _result(phasespace)
+
+        with patch.object(gun, 'async_evaluate',
+                          side_effect=_gun_evaluate) as mocked_gun, \
+                patch.object(chicane, 'async_evaluate',
+                             side_effect=_chicane_evaluate) as mocked_chicane:
+            result = self._linac.evaluate(self._mapping)
+
+            mapping = self._mapping.copy()
+            mapping['chicane/MQZM1_G'] = 2.
+            result_new = self._linac.evaluate(mapping)
+            self.assertEqual(1, mocked_gun.call_count)
+            self.assertEqual(2, mocked_chicane.call_count)
+            self.assertIs(result['gun'], result_new['gun'])
+            self.assertIs(result['gun'].phasespace,
+                          mocked_chicane.call_args[0][0])
+
+            # concurrent evaluations share the upstream simulation
+            mapping['gun/gun_phase'] = 3.
+
+            async def _evaluate_all():
+                mappings = []
+                for v in (3., 4., 5.):
+                    mappings.append(mapping.copy())
+                    mappings[-1]['chicane/MQZM2_G'] = v
+                return await asyncio.gather(
+                    *[self._linac.async_evaluate(m) for m in mappings])
+
+            loop = asyncio.get_event_loop()
+            results = loop.run_until_complete(_evaluate_all())
+            self.assertEqual(2, mocked_gun.call_count)
+            self.assertEqual(5, mocked_chicane.call_count)
+            self.assertIs(results[0]['gun'], results[2]['gun'])
+            self.assertEqual(7, len(self._linac._checkpoints))
+
+    def testAsyncRun(self):
+        gun, chicane = self._linac['gun'], self._linac['chicane']
+
+        async def _evaluate(phasespace, **kwargs):
+            return _result(_random_phasespace())
+
+        with patch.object(gun, 'async_evaluate',
+                          side_effect=_evaluate) as mocked_gun, \
+                patch.object(chicane, 'async_evaluate',
+                             side_effect=_evaluate) as mocked_chicane:
+            loop = asyncio.get_event_loop()
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                sim_id, _, phasespaces = loop.run_until_complete(
+                    self._linac.async_run(1, self._mapping, executor=executor))
+            self.assertEqual(1, sim_id)
+            self.assertListEqual(['gun/out', 'chicane/out'], list(phasespaces))
+            # the executor is used by the checkpointed simulation
+            self.assertIs(executor, mocked_gun.call_args[1]['executor'])
+            self.assertIs(executor, mocked_chicane.call_args[1]['executor'])
+
+    @patch('liso.simulation.beamline.Beamline._update_statistics')
+    @patch('liso.simulation.beamline.Beamline._run_core')
+    def testRun(self, mocked_run_core, mocked_update_statistics):
+        gun, chicane = self._linac['gun'], self._linac['chicane']
+        with patch.object(gun, '_read_output',
+                          return_value=_random_phasespace()), \
+                patch.object(chicane, '_read_output',
+                             return_value=_random_phasespace(seed=1)), \
+                patch.object(chicane, '_generate_initial_particle_file'):
+            self._linac.run(self._mapping)
+            self.assertEqual(2, mocked_run_core.call_count)
+
+            mapping = self._mapping.copy()
+            mapping['chicane/MQZM1_G'] = 2.
+            gun._out = None
+            self._linac.run(mapping)
+            self.assertEqual(3, mocked_run_core.call_count)
+            # restored from the checkpoint
+            self.assertIsNotNone(gun.out)
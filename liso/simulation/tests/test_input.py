@@ -1,15 +1,18 @@
 import unittest
+import io
 import os.path as osp
 import tempfile
 
 import numpy as np
 
+from liso.exceptions import LisoRuntimeError
 from liso.proc import (
     parse_astra_phasespace, parse_impactt_phasespace, parse_elegant_phasespace,
 )
 from liso.simulation import ParticleFileGenerator
 from liso.simulation.input import (
-    AstraInputGenerator, ImpacttInputGenerator, ElegantInputGenerator
+    AstraInputGenerator, ImpacttInputGenerator, ElegantInputGenerator,
+    _savetxt
 )
 
 SKIP_TEST = False
@@ -22,6 +25,35 @@ _ROOT_DIR = osp.dirname(osp.abspath(__file__))
 
 
 class TestParticleFileGenerator(unittest.TestCase):
+    def testSavetxt(self):
+        rng = np.random.RandomState(0)
+        n = 5000
+        data = rng.randn(n, 3) * 10. ** rng.randint(-30, 30, (n, 3))
+        data[:10, 0] = 0.
+        data[10:20, 0] = -0.
+        data[20:30, 0] = rng.randint(-1000, 1000, 10) / 8.
+        data[30, 1] = 9.9999999999999e5
+        data[:, 2] = rng.choice([-15, -1, 3, 5], n)
+        fmt = ["%20.12E"] * 2 + ["%3d"]
+
+        def _assert_equal():
+            expected = io.BytesIO()
+            np.savetxt(expected, data, fmt=" ".join(fmt), delimiter='')
+            out = io.BytesIO()
+            _savetxt(out, data, fmt, chunk_size=1000)
+            self.assertEqual(expected.getvalue(), out.getvalue())
+
+        _assert_equal()
+
+        # fields which do not fit the width
+        data[1234, 0] = 1e-120
+        data[2345, 1] = np.nan
+        data[3456, 2] = -100
+        _assert_equal()
+
+        with self.assertRaises(ValueError):
+            _savetxt(io.BytesIO(), data, ["%20.12f"] * 3)
+
     def testAstraCathode(self):
         n = 2000
         charge = 1e-9
@@ -122,6 +154,20 @@ class TestAstraInputGenerator(unittest.TestCase):
         with tempfile.NamedTemporaryFile('w') as file:
             self._gen.write(file.name)
 
+    def test_render(self):
+        with self.assertRaisesRegex(LisoRuntimeError, "not initialized"):
+            with tempfile.NamedTemporaryFile('w') as file:
+                self._gen.write(file.name)
+
+        input_ = self._gen.render({'gun_gradient': 10, 'gun_phase': 20})
+        self.assertIsNone(self._gen._input)
+        self.assertTrue(any("Phi(1)=20" in line.replace(' ', '') for line in input_))
+
+        with tempfile.NamedTemporaryFile('w') as file:
+            self._gen.write(file.name, input_)
+            with open(file.name, 'r') as fp:
+                self.assertEqual(''.join(input_), fp.read())
+
 
 class TestImpacttInputGenerator(unittest.TestCase):
     def setUp(self):
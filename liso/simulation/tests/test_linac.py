@@ -3,13 +3,18 @@ from unittest.mock import patch
 import os
 import os.path as osp
 import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import shutil
 import tempfile
+import threading
 
 from liso import Linac
 from liso.config import config
 from liso.io import TempSimulationDirectory
 from liso.exceptions import LisoRuntimeError
+from liso.proc import parse_astra_phasespace
 from liso.simulation.beamline import AstraBeamline, ImpacttBeamline
+from liso.simulation.scheduler import CoreScheduler
 
 _ROOT_DIR = osp.dirname(osp.abspath(__file__))
 
@@ -31,7 +36,7 @@ class TestAstraBeamline(unittest.TestCase):
         with self.assertRaisesRegex(LisoRuntimeError, "Output file"):
             self._bl._update_output(_ROOT_DIR)
 
-        with patch.object(self._bl, '_check_file'):
+        with patch('liso.simulation.beamline._check_file'):
             with patch.object(self._bl, '_parse_phasespace') as patched:
                 self._bl._update_output(_ROOT_DIR)
 
@@ -89,24 +94,54 @@ class TestLinacOneBeamLine(unittest.TestCase):
     @patch('liso.simulation.beamline.Beamline._async_run_core')
     def testAsyncRun(self, mocked_async_run_core):
         loop = asyncio.get_event_loop()
-        with patch('liso.simulation.beamline.Beamline._update_output') as mocked_uo:
+        gun = self._linac['gun']
+        with patch('liso.simulation.beamline._load_output') as mocked_lo:
             with patch('liso.simulation.beamline.Beamline._generate_initial_particle_file') as mocked_gipf:
 
                 future = asyncio.Future()
                 future.set_result(object())
                 mocked_async_run_core.return_value = future
 
+                out = object()
+                mocked_lo.side_effect = lambda parse, filepath, charge: (filepath, out)
+
                 tmp_dir = osp.join(self._tmp_dir, "tmp000001")
-                # os.mkdir(tmp_dir)
                 sim_id, controls, phasespaces = loop.run_until_complete(
                     self._linac.async_run(1, self._mapping))
 
-                mocked_uo.assert_called_once_with(tmp_dir)
+                mocked_lo.assert_called_once()
                 mocked_gipf.assert_not_called()
 
                 self.assertEqual(1, sim_id)
                 self.assertDictEqual({'gun/gun_gradient': 1.0, 'gun/gun_phase': 2.0}, controls)
-                self.assertDictEqual({'gun/out': mocked_uo()}, phasespaces)
+                self.assertDictEqual(
+                    {'gun/out': osp.join(tmp_dir, 'injector.0450.001')}, phasespaces)
+                self.assertIs(out, gun.out)
+
+                # the output is processed off the thread of the event loop
+                loop_thread = threading.get_ident()
+                mocked_lo.side_effect = lambda *args: (threading.get_ident(), out)
+                with ThreadPoolExecutor(max_workers=1) as executor:
+                    _, _, phasespaces = loop.run_until_complete(
+                        self._linac.async_run(2, self._mapping, executor=executor))
+                self.assertNotEqual(loop_thread, phasespaces['gun/out'])
+
+    @patch('liso.simulation.beamline.Beamline._async_run_core')
+    def testAsyncRunInProcessPool(self, mocked_async_run_core):
+        pfile = osp.join(_ROOT_DIR, "../../proc/tests/astra_output/astra.out")
+
+        async def _run_core(swd, *args):
+            shutil.copy(pfile, osp.join(swd, 'injector.0450.001'))
+        mocked_async_run_core.side_effect = _run_core
+
+        loop = asyncio.get_event_loop()
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            _, _, phasespaces = loop.run_until_complete(
+                self._linac.async_run(1, self._mapping, executor=executor))
+
+        ps = parse_astra_phasespace(pfile)
+        self.assertEqual(len(ps), len(phasespaces['gun/out']))
+        self.assertAlmostEqual(ps.analyze().Sx, self._linac['gun'].out.Sx)
 
 
 class TestLinacTwoBeamLine(unittest.TestCase):
@@ -163,6 +198,20 @@ class TestLinacTwoBeamLine(unittest.TestCase):
             'chicane/MQZM1_G': 1.0, 'chicane/MQZM2_G': 1.0,
         }, self._linac.compile(mapping))
 
+    def testRender(self):
+        controls, inputs = self._linac.render(self._mapping)
+        self.assertDictEqual(self._linac.compile(self._mapping), controls)
+        self.assertListEqual(['gun', 'chicane'], list(inputs))
+        for name, bl in self._linac.items():
+            self.assertEqual(bl._input_gen._input, inputs[name])
+
+        # rendering does not modify the compiled inputs
+        mapping = self._mapping.copy()
+        mapping['gun/gun_phase'] = 10.
+        _, inputs_new = self._linac.render(mapping)
+        self.assertNotEqual(inputs['gun'], inputs_new['gun'])
+        self.assertEqual(inputs['gun'], self._linac['gun']._input_gen._input)
+
     @patch('liso.simulation.beamline.Beamline._update_statistics')
     @patch('liso.simulation.beamline.Beamline._run_core')
     def testRun(self, mocked_run_core, mocked_update_statistics):
@@ -184,43 +233,130 @@ class TestLinacTwoBeamLine(unittest.TestCase):
                         mocked_gun_gipf.assert_not_called()
                         mocked_chicane_gipf.assert_called_once_with(mocked_gun_uo(), self._tmp_dir)
 
+                        # each template is rendered once
+                        gun_gen = self._linac['gun']._input_gen
+                        chicane_gen = self._linac['chicane']._input_gen
+                        with patch.object(gun_gen, 'render', wraps=gun_gen.render) as mocked_gun_render, \
+                                patch.object(chicane_gen, 'render',
+                                             wraps=chicane_gen.render) as mocked_chicane_render:
+                            self._linac.run(mapping)
+                            mocked_gun_render.assert_called_once()
+                            mocked_chicane_render.assert_called_once()
+                        self.assertEqual(gun_gen.render(self._linac._split_mapping(mapping)['gun']),
+                                         gun_gen._input)
+
     @patch('liso.simulation.beamline.Beamline._async_run_core')
     def testAsyncRun(self, mocked_async_run_core):
         sim_id_gt = 10
         mapping = self._mapping
 
         loop = asyncio.get_event_loop()
-        with patch.object(
-                self._linac['gun'], '_update_output') as mocked_gun_uo:
+        with patch('liso.simulation.beamline._load_output') as mocked_lo:
+            mocked_lo.side_effect = lambda parse, filepath, charge: (filepath, None)
             with patch.object(
-                    self._linac['chicane'], '_update_output') as mocked_chicane_uo:
+                    self._linac['gun'],
+                    '_generate_initial_particle_file') as mocked_gun_gipf:
                 with patch.object(
-                        self._linac['gun'],
-                        '_generate_initial_particle_file') as mocked_gun_gipf:
-                    with patch.object(
-                            self._linac['chicane'],
-                            '_generate_initial_particle_file') as mocked_chicane_gipf:
+                        self._linac['chicane'],
+                        '_generate_initial_particle_file') as mocked_chicane_gipf:
+
+                    future = asyncio.Future()
+                    future.set_result(object())
+                    mocked_async_run_core.return_value = future
+
+                    sim_id, controls, phasespaces = loop.run_until_complete(
+                        self._linac.async_run(sim_id_gt, mapping))
+
+                    self.assertEqual(2, mocked_async_run_core.call_count)
+                    actual_tmp_dir = osp.join(self._tmp_dir, f"tmp0000{sim_id_gt}")
+                    gun_out = osp.join(actual_tmp_dir, 'injector.0450.001')
+                    chicane_out = osp.join(actual_tmp_dir, 'fort.106')
+                    self.assertListEqual(
+                        [gun_out, chicane_out],
+                        [c[0][1] for c in mocked_lo.call_args_list])
+
+                    mocked_gun_gipf.assert_not_called()
+                    mocked_chicane_gipf.assert_called_once_with(
+                        gun_out, actual_tmp_dir)
+
+                    self.assertEqual(sim_id_gt, sim_id)
+                    self.assertDictEqual(
+                        {'gun/gun_gradient': 1.0, 'gun/gun_phase': 1.0,
+                         'chicane/MQZM1_G': 1.0, 'chicane/MQZM2_G': 1.0}, controls)
+                    self.assertDictEqual(
+                        {'gun/out': gun_out, 'chicane/out': chicane_out},
+                        phasespaces)
+
+                    # MPI ranks per beamline
+                    mocked_async_run_core.reset_mock()
+                    scheduler = CoreScheduler(8)
+                    loop.run_until_complete(self._linac.async_run(
+                        sim_id_gt, mapping, n_workers={'gun': 4},
+                        scheduler=scheduler))
+                    self.assertListEqual(
+                        [(4, scheduler), (1, scheduler)],
+                        [c[0][2:] for c in mocked_async_run_core.call_args_list])
+
+    def testNWorkers(self):
+        self.assertDictEqual({'gun': 1, 'chicane': 1}, self._linac._get_n_workers(1))
+        self.assertDictEqual({'gun': 1, 'chicane': 8},
+                             self._linac._get_n_workers({'chicane': 8}))
+        with self.assertRaisesRegex(KeyError, "Beamline linac does not exist"):
+            self._linac._get_n_workers({'linac': 2})
+        for invalid in [0, 1.5, {'gun': 0}]:
+            with self.assertRaisesRegex(ValueError, "positive integer"):
+                self._linac._get_n_workers(invalid)
+
+        gun = self._linac['gun']
+        with patch.object(gun, '_check_executable', side_effect=lambda p: f"astra{p}"):
+            self.assertEqual("astraFalse injector.in", gun._get_command(1, None))
+            self.assertEqual("timeout 10s mpirun -np 4 astraTrue injector.in",
+                             gun._get_command(4, 10))
 
-                        future = asyncio.Future()
-                        future.set_result(object())
-                        mocked_async_run_core.return_value = future
-
-                        sim_id, controls, phasespaces = loop.run_until_complete(
-                            self._linac.async_run(sim_id_gt, mapping))
-
-                        self.assertEqual(2, mocked_async_run_core.call_count)
-                        actual_tmp_dir = osp.join(self._tmp_dir, f"tmp0000{sim_id_gt}")
-                        mocked_gun_uo.assert_called_once_with(actual_tmp_dir)
-                        mocked_chicane_uo.assert_called_once_with(actual_tmp_dir)
-
-                        mocked_gun_gipf.assert_not_called()
-                        mocked_chicane_gipf.assert_called_once_with(
-                            mocked_gun_uo(), actual_tmp_dir)
-
-                        self.assertEqual(sim_id_gt, sim_id)
-                        self.assertDictEqual(
-                            {'gun/gun_gradient': 1.0, 'gun/gun_phase': 1.0,
-                             'chicane/MQZM1_G': 1.0, 'chicane/MQZM2_G': 1.0}, controls)
-                        self.assertDictEqual(
-                            {'gun/out': mocked_gun_uo(),
-                             'chicane/out': mocked_chicane_uo()}, phasespaces)
+    @patch('liso.simulation.beamline.Beamline._async_run_core')
+    def testEvaluate(self, mocked_async_run_core):
+        future = asyncio.Future()
+        future.set_result(object())
+        mocked_async_run_core.return_value = future
+
+        gun, chicane = self._linac['gun'], self._linac['chicane']
+        with patch.object(gun, '_read_output') as mocked_gun_ro, \
+                patch.object(chicane, '_read_output') as mocked_chicane_ro, \
+                patch.object(gun, '_analyze_statistics') as mocked_gun_as, \
+                patch.object(chicane, '_analyze_statistics') as mocked_chicane_as, \
+                patch.object(chicane, '_generate_initial_particle_file') as mocked_chicane_gipf:
+            stats = {k: object() for k in ('start', 'end', 'min', 'max', 'avg', 'std')}
+            mocked_gun_as.return_value = stats
+            mocked_chicane_as.return_value = stats
+
+            result1 = self._linac.evaluate(self._mapping)
+            mapping = self._mapping.copy()
+            mapping['chicane/MQZM1_G'] = 2.
+            result2 = self._linac.evaluate(mapping)
+
+            # each evaluation is run in its own scratch directory
+            swds = [c[0][0] for c in mocked_gun_ro.call_args_list]
+            swds += [c[0][0] for c in mocked_chicane_ro.call_args_list]
+            self.assertEqual(4, len(set(swds)))
+            for swd in swds:
+                self.assertEqual(self._tmp_dir, osp.dirname(swd))
+                self.assertFalse(osp.exists(swd))
+            self.assertEqual(mocked_chicane_gipf.call_args[0][0],
+                             mocked_gun_ro())
+
+            self.assertListEqual(['gun', 'chicane'], list(result1))
+            self.assertEqual(1., result1.controls['chicane/MQZM1_G'])
+            self.assertEqual(2., result2.controls['chicane/MQZM1_G'])
+            self.assertIs(mocked_chicane_ro(), result1['chicane'].phasespace)
+            self.assertEqual(mocked_chicane_ro().analyze(), result1['chicane'].out)
+            self.assertIs(stats['max'], result1['gun'].max)
+            self.assertDictEqual({'gun/out': mocked_gun_ro(),
+                                  'chicane/out': mocked_chicane_ro()},
+                                 result2.phasespaces)
+
+            # the beamlines are not modified
+            self.assertIsNone(gun.out)
+            self.assertIsNone(chicane.max)
+            self.assertIsNone(gun._input_gen._input)
+            with self.assertRaises(TypeError):
+                result1['gun'] = None
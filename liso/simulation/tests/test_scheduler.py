@@ -0,0 +1,67 @@
+import unittest
+import asyncio
+
+from liso.simulation.scheduler import CoreScheduler
+
+
+class TestCoreScheduler(unittest.TestCase):
+    def testGeneral(self):
+        with self.assertRaises(ValueError):
+            CoreScheduler(0)
+
+        scheduler = CoreScheduler(8)
+        self.assertEqual(8, scheduler.n_cores)
+        self.assertEqual(8, scheduler.available)
+
+        loop = asyncio.get_event_loop()
+        with self.assertRaises(ValueError):
+            loop.run_until_complete(scheduler.acquire(9))
+        self.assertEqual(8, scheduler.available)
+
+    def testBudget(self):
+        scheduler = CoreScheduler(8)
+        in_use = []
+        order = []
+
+        async def job(name, n):
+            async with scheduler.reserve(n):
+                order.append(name)
+                in_use.append(scheduler.n_cores - scheduler.available)
+                await asyncio.sleep(0.01)
+
+        async def run():
+            await asyncio.gather(
+                job('a', 4), job('b', 2), job('c', 4), job('d', 1),
+                job('e', 8), job('f', 1))
+
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(run())
+
+        self.assertLessEqual(max(in_use), 8)
+        # 'd' does not overtake 'c'
+        self.assertListEqual(['a', 'b', 'c', 'd', 'e', 'f'], order)
+        self.assertEqual(8, scheduler.available)
+
+    def testCancel(self):
+        scheduler = CoreScheduler(4)
+
+        async def run():
+            await scheduler.acquire(3)
+            waiter = asyncio.ensure_future(scheduler.acquire(4))
+            small = asyncio.ensure_future(scheduler.acquire(1))
+            await asyncio.sleep(0)
+            self.assertFalse(small.done())
+
+            # cores are handed over to the next request
+            waiter.cancel()
+            await asyncio.sleep(0)
+            await asyncio.sleep(0)
+            self.assertTrue(small.done())
+            self.assertEqual(0, scheduler.available)
+
+            scheduler.release(3)
+            scheduler.release(1)
+
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(run())
+        self.assertEqual(4, scheduler.available)
@@ -29,7 +29,7 @@ setup(
     install_requires=[
         'numpy>=1.18',
         'pandas>=1.1',
-        'scipy>=1.4.1',
+        'scipy>=1.7',
         'h5py==2.10',
         'matplotlib',
         'pydantic>=1.7.2',
@@ -40,6 +40,9 @@ setup(
         'test': [
             'pytest',
         ],
+        'parquet': [
+            'pyarrow',
+        ],
     },
     python_requires='>=3.7',
     classifiers=[